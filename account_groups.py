@@ -0,0 +1,75 @@
+import json
+
+# Volumen mínimo y paso de volumen en lotes (1 centilote)
+MIN_LOTS = 0.01
+
+
+class AccountGroup:
+    """
+    Grupo de cuentas que reciben la misma señal (copy trading).
+
+    Cada miembro tiene un factor de escala que se aplica al volumen de la
+    señal: con scale 0.5 una señal de 1 lote abre 0.5 lotes en esa cuenta.
+    """
+
+    def __init__(self, name, members):
+        """
+        Args:
+            name: Nombre del grupo (el campo "group" del webhook)
+            members: Lista de tuplas (account_id, scale)
+        """
+        self.name = name
+        self.members = members
+
+    def __len__(self):
+        return len(self.members)
+
+    def account_ids(self):
+        return [account_id for account_id, _ in self.members]
+
+    def allocations(self, volume):
+        """
+        Reparte el volumen de la señal entre las cuentas del grupo
+
+        Returns:
+            Lista de tuplas (account_id, volumen en lotes), con el volumen
+            redondeado a centilotes y como mínimo MIN_LOTS
+        """
+        return [
+            (account_id, max(round(float(volume) * scale, 2), MIN_LOTS))
+            for account_id, scale in self.members
+        ]
+
+
+def load_account_groups(path):
+    """
+    Carga los grupos de cuentas desde un fichero JSON con el formato:
+
+        {"copy": [{"account_id": 123456, "scale": 1.0},
+                  {"account_id": 654321, "scale": 0.5}]}
+
+    Returns:
+        Diccionario {nombre: AccountGroup} (vacío si el fichero no existe)
+
+    Raises:
+        ValueError: Si el fichero no tiene el formato esperado
+    """
+    try:
+        with open(path) as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {}
+
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} debe contener un objeto {{grupo: [cuentas]}}")
+
+    groups = {}
+    for name, members in data.items():
+        try:
+            groups[name] = AccountGroup(name, [
+                (int(member["account_id"]), float(member.get("scale", 1.0)))
+                for member in members
+            ])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Grupo de cuentas {name!r} inválido en {path}: {e}")
+    return groups
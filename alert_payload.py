@@ -0,0 +1,193 @@
+import json
+from urllib.parse import parse_qsl
+
+# Decodificador JSON rápido si está instalado (pip install orjson)
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Valores admitidos de los campos con opciones cerradas
+ORDER_SIDES = frozenset(["buy", "sell"])
+CANDLE_COLORS = frozenset(["GREEN", "RED"])
+
+
+class PayloadError(ValueError):
+    """Payload inválido; errors es una lista de {"field", "error"}"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{e['field']}: {e['error']}" for e in errors))
+
+
+def decode_body(body, content_type="", query_string=b""):
+    """
+    Obtiene el diccionario del webhook a partir del cuerpo en bruto
+
+    TradingView a veces envía x-www-form-urlencoded, así que se aceptan JSON,
+    formulario, parámetros de la URL y, como último recurso, el cuerpo como
+    texto JSON.
+
+    Args:
+        body: Cuerpo de la petición (bytes)
+        content_type: Cabecera Content-Type
+        query_string: Parámetros de la URL sin decodificar (lo que va
+            tras "?"); solo se decodifican si el cuerpo no trae datos
+
+    Raises:
+        PayloadError: Si el cuerpo es JSON inválido o no es un objeto
+    """
+    content_type = content_type.lower()
+    if content_type.startswith("application/json"):
+        try:
+            data = _loads(body)
+        except ValueError as e:
+            raise PayloadError([{"field": "body", "error": f"Invalid JSON: {e}"}])
+    else:
+        data = {}
+        if content_type.startswith("application/x-www-form-urlencoded") and body:
+            data = dict(parse_qsl(body.decode("utf-8")))
+        if not data and query_string:
+            data = dict(parse_qsl(query_string.decode("utf-8")))
+        if not data and body:
+            try:
+                data = _loads(body)
+            except ValueError:
+                pass
+
+    if not isinstance(data, dict):
+        raise PayloadError([{"field": "body", "error": "expected a JSON object"}])
+    return data
+
+
+def _number(value):
+    # bool es un int, pero "volume": true no es un número
+    if isinstance(value, bool):
+        raise ValueError
+    return float(value)
+
+
+class AlertParser:
+    """
+    Validador compilado de la alerta de TradingView.
+
+    La tabla de campos se resuelve una sola vez al crear el parser en una
+    tupla de funciones (una por campo), de modo que cada petición solo
+    recorre esa tupla sin volver a interpretar el esquema.
+
+    Los errores en campos obligatorios se devuelven como PayloadError; los
+    valores opcionales inválidos se ignoran (como hasta ahora) y se anotan
+    en warnings.
+    """
+
+    def __init__(self, default_volume=0.1, max_volume=50):
+        self.default_volume = default_volume
+        self.max_volume = max_volume
+        self._fields = tuple(self._compile())
+
+    def _compile(self):
+        default_volume = self.default_volume
+        max_volume = self.max_volume
+
+        def required_text(name, choices=None):
+            def parse(data, alert, errors, warnings):
+                value = data.get(name)
+                if value is None or value == "":
+                    errors.append({"field": name, "error": "required"})
+                    return
+                value = str(value).strip()
+                if choices is not None and value.lower() not in choices:
+                    errors.append({"field": name, "error": f"must be one of {sorted(choices)}"})
+                    return
+                alert[name] = value
+            return parse
+
+        def optional_text(name):
+            def parse(data, alert, errors, warnings):
+                value = data.get(name)
+                alert[name] = str(value) if value not in (None, "") else None
+            return parse
+
+        def volume(data, alert, errors, warnings):
+            value = data.get("volume", default_volume)
+            try:
+                value = _number(value)
+            except (ValueError, TypeError):
+                warnings.append(f"volume inválido: {value}. Se usa {default_volume}")
+                value = default_volume
+            # Limitar el volumen al máximo permitido
+            alert["volume"] = min(value, max_volume)
+
+        def distance(name):
+            # SL/TP en pips o en dinero: positivo, 0 para ignorarlo
+            def parse(data, alert, errors, warnings):
+                value = data.get(name)
+                if value is None or value == "":
+                    alert[name] = None
+                    return
+                try:
+                    value = _number(value)
+                except (ValueError, TypeError):
+                    warnings.append(f"{name} inválido: {value}. Se ignora.")
+                    alert[name] = None
+                    return
+                if value < 0:
+                    warnings.append(f"{name} debe ser positivo: {value}. Se ignora.")
+                    value = 0
+                alert[name] = value
+            return parse
+
+        def candle_color(data, alert, errors, warnings):
+            value = data.get("candle_color")
+            if value is None or value == "":
+                alert["candle_color"] = None
+                return
+            value = str(value).upper()
+            if value not in CANDLE_COLORS:
+                warnings.append(f"candle_color inválido: {value}. Debe ser 'GREEN' o 'RED'. Se ignora.")
+                value = None
+            alert["candle_color"] = value
+
+        yield required_text("symbol")
+        yield required_text("order", ORDER_SIDES)
+        yield volume
+        yield distance("sl_pips")
+        yield distance("tp_pips")
+        yield distance("sl_money")
+        yield distance("tp_money")
+        yield candle_color
+        yield optional_text("token")
+        yield optional_text("group")
+
+    def validate(self, data):
+        """
+        Valida un diccionario ya decodificado
+
+        Returns:
+            Tupla (alert, warnings): alert es un diccionario con symbol,
+            order, volume, sl_pips, tp_pips, sl_money, tp_money,
+            candle_color, token y group ya convertidos
+
+        Raises:
+            PayloadError: Si faltan campos obligatorios o no son válidos
+        """
+        alert = {}
+        errors = []
+        warnings = []
+        for parse in self._fields:
+            parse(data, alert, errors, warnings)
+        if errors:
+            raise PayloadError(errors)
+        return alert, warnings
+
+    def parse(self, body, content_type="", query_string=b""):
+        """
+        Decodifica y valida (ver decode_body y validate)
+
+        Returns:
+            Tupla (data, alert, warnings) con el diccionario original
+        """
+        data = decode_body(body, content_type, query_string)
+        alert, warnings = self.validate(data)
+        return data, alert, warnings
@@ -0,0 +1,466 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import argparse
+import shutil
+import tempfile
+import warnings
+import subprocess
+from twisted.internet import task, defer, reactor
+from twisted.internet.error import ConnectError
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOATradeSide
+from ctrader_simulator import SimulatedServer, SimulatedSymbol, default_symbols
+from symbol_table import SymbolTable
+
+# Benchmark de extremo a extremo: webhook → orden → evento de ejecución
+#
+# Uso:
+#   python bench-e2e.py --target v7 --workloads steady,burst,symbols,sltp --output v7.json
+#   python bench-e2e.py --target v7 --sync --baseline v7.json
+#   python bench-e2e.py --target v6 --output v6.json
+#   python bench-e2e.py --sync --workloads sltp,cold --sl-tp-mode absolute
+#   python bench-e2e.py --startup-check --workloads steady --requests 20
+#
+# Arranca ctrader_simulator.py en este proceso y el servidor webhook en un
+# subproceso conectado a él (v7: henry-webhook-v7.py con ctrader-stop-loss.py,
+# v6: henry-webhook-v6.py con ctrader.py), y le lanza cargas de alertas a
+# ritmo fijo (lazo abierto: cada petición sale a su hora aunque las
+# anteriores no hayan respondido). Cada alerta de un símbolo va en sentido
+# contrario a la anterior, porque v7 mantiene sin orden nueva una posición
+# abierta en el mismo sentido; en v7 cada alerta es, por tanto, un cierre
+# más una orden nueva:
+#
+#   steady   --requests alertas a --rate por segundo en EURUSD
+#   burst    --bursts ráfagas de --burst-size alertas simultáneas
+#   symbols  como steady, repartidas entre --symbols símbolos
+#   sltp     como steady, con SL/TP (en pips para v7, en dinero para v6)
+#   cold     una alerta con SL/TP por cada uno de --symbols símbolos que no
+#            se han operado ni están en el libro de precios
+#
+# --sl-tp-mode fija SL_TP_MODE en el webhook (v7) para comparar el SL/TP
+# relativo con el absoluto, que necesita un precio reciente del símbolo.
+#
+# --startup-check abre en el simulador una posición BUY de EURUSD antes de
+# arrancar el webhook y le envía una alerta SELL en cuanto acepta
+# peticiones, mientras el simulador retrasa la autenticación de la cuenta.
+# La alerta debe cerrar la posición existente antes de abrir la nueva; si
+# no, el proceso sale con código 1.
+#
+# El webhook trabaja en un directorio temporal (log, diario y cachés) que se
+# borra al terminar; --keep-workdir lo conserva para revisar el log.
+#
+# Por cada carga guarda el throughput, los percentiles de cada etapa y las
+# órdenes que llegan al simulador. Con --sync (solo v7) cada petición espera
+# a la ejecución y se añade el desglose timings_ms del servidor. Con
+# --baseline se comparan los p50/p99 con un resultado anterior y el proceso
+# sale con código 1 si alguno empeora más de --max-regression.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TARGETS = {
+    "v7": ("henry-webhook-v7.py", "ctrader-stop-loss.py"),
+    "v6": ("henry-webhook-v6.py", "ctrader.py"),
+}
+
+WORKLOADS = ("steady", "burst", "symbols", "sltp", "cold")
+
+# El webhook importa "ctrader": se carga el módulo elegido con ese nombre
+# antes de ejecutar el script del webhook como __main__
+BOOTSTRAP = """
+import sys, runpy, importlib.util
+module_path, webhook_path = sys.argv[1], sys.argv[2]
+spec = importlib.util.spec_from_file_location("ctrader", module_path)
+module = importlib.util.module_from_spec(spec)
+sys.modules["ctrader"] = module
+spec.loader.exec_module(module)
+sys.argv = [webhook_path]
+runpy.run_path(webhook_path, run_name="__main__")
+"""
+
+TOKEN = "bench-token"
+
+# Retraso de la autenticación de la cuenta con --startup-check, para que la
+# alerta llegue al webhook antes de que la sesión esté autenticada
+STARTUP_AUTH_DELAY = 1.0  # Segundos
+
+# readBody avisa en cada respuesta cuando el transporte no tiene abortConnection
+warnings.filterwarnings("ignore", "Using readBody", DeprecationWarning)
+
+def percentile(sorted_values, pct):
+    """Percentil pct (0-100) de una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(values):
+    """Percentiles (ms) de una lista de latencias"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 3),
+        "p99": round(percentile(values, 99), 3),
+        "p999": round(percentile(values, 99.9), 3),
+        "max": round(values[-1], 3),
+    }
+
+class BenchServer(SimulatedServer):
+    """Simulador que anota la hora de llegada de cada orden"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.orders = []  # [(perf_counter, symbolId)]
+        self.account_auth_delay = 0.0  # Segundos extra antes de autenticar una cuenta
+
+    def on_account_auth(self, client, client_msg_id, request):
+        if self.account_auth_delay > 0:
+            reactor.callLater(self.account_auth_delay, super().on_account_auth, client, client_msg_id, request)
+        else:
+            super().on_account_auth(client, client_msg_id, request)
+
+    def on_new_order(self, client, client_msg_id, request):
+        self.orders.append((time.perf_counter(), request.symbolId))
+        super().on_new_order(client, client_msg_id, request)
+
+def bench_symbols(count):
+    """
+    Símbolos del simulador: los de SYMBOLS y dos series de count símbolos
+    sintéticos en USD, SIMnnn (se calientan antes de medir) y COLDnnn (no)
+    """
+    symbols = default_symbols()
+    for i in range(1, count + 1):
+        symbols[900000 + i] = SimulatedSymbol(900000 + i, f"SIM{i:03d}", 5, 4, 100 + i, 2, round(1.0 + i / 100.0, 5), 0.00002)
+        symbols[950000 + i] = SimulatedSymbol(950000 + i, f"COLD{i:03d}", 5, 4, 100 + i, 2, round(1.0 + i / 100.0, 5), 0.00002)
+    return symbols
+
+def alert(symbol, sides, sync=False, **extra):
+    """Payload de una alerta en sentido contrario a la anterior del símbolo"""
+    side = "sell" if sides.get(symbol) == "buy" else "buy"
+    sides[symbol] = side
+    payload = dict({"symbol": symbol, "order": side, "volume": 0.01, "token": TOKEN}, **extra)
+    if sync:
+        payload["wait"] = True
+    return payload
+
+def build_schedule(name, args, symbol_names, cold_names, sides):
+    """Lista de (segundos desde el inicio, payload) de una carga"""
+    if name == "steady":
+        return [(i / args.rate, alert("EURUSD", sides, args.sync)) for i in range(args.requests)]
+    if name == "burst":
+        return [(b * args.burst_gap, alert("EURUSD", sides, args.sync)) for b in range(args.bursts) for _ in range(args.burst_size)]
+    if name == "symbols":
+        return [(i / args.rate, alert(symbol_names[i % len(symbol_names)], sides, args.sync)) for i in range(args.requests)]
+    if name == "sltp":
+        return [(i / args.rate, alert("EURUSD", sides, args.sync, sl_pips=10, tp_pips=20, sl_money=5, tp_money=10)) for i in range(args.requests)]
+    if name == "cold":
+        return [(i / args.rate, alert(symbol, sides, args.sync, sl_pips=10, tp_pips=20, sl_money=5, tp_money=10)) for i, symbol in enumerate(cold_names)]
+    raise ValueError(f"Carga desconocida: {name}")
+
+def post(agent, url, payload, key):
+    """POST JSON; devuelve un deferred con (status, cuerpo)"""
+    headers = Headers({b"Content-Type": [b"application/json"], b"Idempotency-Key": [key.encode("utf-8")]})
+    body = FileBodyProducer(io.BytesIO(json.dumps(payload).encode("utf-8")))
+    d = agent.request(b"POST", url.encode("utf-8"), headers, body)
+    return d.addCallback(lambda response: readBody(response).addCallback(lambda data: (response.code, data)))
+
+@defer.inlineCallbacks
+def wait_until(predicate, timeout, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Timeout esperando al servidor webhook")
+        yield task.deferLater(reactor, interval, lambda: None)
+
+@defer.inlineCallbacks
+def wait_for_webhook(agent, url, server, timeout):
+    """Espera a que la cuenta esté autenticada en el simulador y el webhook responda"""
+    yield wait_until(lambda: any(client.accounts for client in server.clients), timeout)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            yield agent.request(b"GET", url.encode("utf-8"))
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            yield task.deferLater(reactor, 0.1, lambda: None)
+
+@defer.inlineCallbacks
+def run_startup_check(agent, url, server, account_id, seeded, timeout):
+    """
+    Alerta en sentido contrario a una posición que ya estaba abierta,
+    enviada en cuanto el webhook acepta peticiones
+
+    Returns:
+        Resultado con las posiciones del símbolo que quedan abiertas; ok es
+        True si la posición anterior se cerró y solo queda la nueva
+    """
+    payload = {"symbol": "EURUSD", "order": "sell", "volume": 0.01, "token": TOKEN, "wait": True}
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            start = time.perf_counter()
+            status, _ = yield post(agent, url, payload, f"startup-{uuid.uuid4().hex[:8]}")
+            break
+        except ConnectError:
+            if time.monotonic() > deadline:
+                raise
+            yield task.deferLater(reactor, 0.05, lambda: None)
+    elapsed = time.perf_counter() - start
+
+    # Sin modo síncrono (v6) la orden sigue en marcha tras la respuesta
+    try:
+        yield wait_until(lambda: server.orders, timeout)
+    except TimeoutError:
+        pass
+
+    positions = server.positions.get(account_id, {})
+    sides = sorted(ProtoOATradeSide.Name(position["trade_side"]) for position in positions.values() if position["symbol_id"] == seeded["symbol_id"])
+    return {
+        "status": status,
+        "http_ms": round(elapsed * 1000.0, 3),
+        "seeded_closed": seeded["position_id"] not in positions,
+        "open_positions": sides,
+        "ok": seeded["position_id"] not in positions and sides == ["SELL"],
+    }
+
+@defer.inlineCallbacks
+def run_workload(agent, url, server, name, schedule, drain_timeout):
+    """Lanza una carga y devuelve su resultado"""
+    run_id = uuid.uuid4().hex[:8]
+    latencies = []
+    stages = {}
+    status_counts = {}
+    orders_before = len(server.orders)
+    done = []
+
+    def fire(i, payload):
+        start = time.perf_counter()
+
+        def on_response(result):
+            status, data = result
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+            try:
+                timings = json.loads(data).get("timings_ms") or {}
+            except ValueError:
+                timings = {}
+            for stage, value in timings.items():
+                stages.setdefault(stage, []).append(value)
+
+        def on_error(failure):
+            status_counts[failure.type.__name__] = status_counts.get(failure.type.__name__, 0) + 1
+
+        d = post(agent, url, payload, f"{name}-{run_id}-{i}").addCallbacks(on_response, on_error)
+        done.append(d)
+
+    start = time.perf_counter()
+    for i, (offset, payload) in enumerate(schedule):
+        reactor.callLater(offset, fire, i, payload)
+    yield wait_until(lambda: len(done) == len(schedule), schedule[-1][0] + 5)
+    yield defer.DeferredList(done)
+    elapsed = time.perf_counter() - start
+
+    # Las órdenes pueden seguir ejecutándose después del 200 (modo asíncrono)
+    accepted = status_counts.get("200", 0)
+    try:
+        yield wait_until(lambda: len(server.orders) - orders_before >= accepted, drain_timeout)
+    except TimeoutError:
+        pass
+    orders = server.orders[orders_before:]
+
+    return {
+        "workload": name,
+        "requests": len(schedule),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "status": status_counts,
+        "orders": len(orders),
+        "orders_per_s": round(len(orders) / (orders[-1][0] - start), 1) if orders else 0.0,
+        "stages_ms": dict(
+            {"http": summarize(latencies)},
+            **{stage: summarize(values) for stage, values in sorted(stages.items())}
+        ),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, max_regression):
+    """
+    Compara p50/p99 de cada etapa con un resultado anterior
+
+    Returns:
+        Lista de regresiones (etapas cuyo percentil empeora más de max_regression)
+    """
+    old = {w["workload"]: w for w in baseline["workloads"]}
+    regressions = []
+    for workload in results["workloads"]:
+        previous = old.get(workload["workload"])
+        if previous is None:
+            continue
+        for stage, current in workload["stages_ms"].items():
+            before = previous["stages_ms"].get(stage)
+            if not current or not before:
+                continue
+            for pct in ("p50", "p99"):
+                if before[pct] <= 0:
+                    continue
+                change = current[pct] / before[pct] - 1.0
+                line = f"{workload['workload']:>8} {stage:>16} {pct}: {before[pct]:>9.3f} → {current[pct]:>9.3f} ms ({change:+.1%})"
+                if change > max_regression:
+                    regressions.append(line)
+                    line += "  ⚠️"
+                print(line, file=sys.stderr)
+    return regressions
+
+@defer.inlineCallbacks
+def run_benchmark(args):
+    webhook, module = TARGETS[args.target]
+    webhook = args.webhook or os.path.join(REPO_DIR, webhook)
+    module = args.module or os.path.join(REPO_DIR, module)
+
+    symbols = bench_symbols(args.symbols)
+    server = BenchServer(symbols=symbols, latency=args.latency, jitter=args.jitter, tick_interval=args.tick_interval, seed=args.seed)
+    ctrader_port = server.listen(0)
+
+    # Directorio de trabajo del webhook: logs, diario, cachés y tabla de símbolos
+    workdir = tempfile.mkdtemp(prefix="bench-e2e-")
+    log = process = None
+    try:
+        SymbolTable([
+            (symbol.symbol_id, symbol.name, symbol.digits, symbol.pip_position, 10000000)
+            for symbol in symbols.values()
+        ]).save(os.path.join(workdir, "symbols.bin"))
+
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])),
+            CTRADER_HOST="127.0.0.1",
+            CTRADER_PORT=str(ctrader_port),
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_PORT=str(args.webhook_port),
+            SECRET_TOKEN=TOKEN,
+            ACCOUNT_ID=os.environ.get("ACCOUNT_ID", "1"),
+            CTRADER_CLIENT_ID="bench",
+            CTRADER_CLIENT_SECRET="bench",
+            CTRADER_ACCESS_TOKEN="bench",
+            CTRADER_TOKEN_FILE=os.path.join(workdir, "tokens.json"),
+            SYMBOL_CACHE_FILE=os.path.join(workdir, "symbol_cache.json"),
+            SYMBOL_TABLE_FILE=os.path.join(workdir, "symbols.bin"),
+            ACCOUNT_GROUPS_FILE=os.path.join(workdir, "account_groups.json"),
+        )
+        if args.sl_tp_mode:
+            env["SL_TP_MODE"] = args.sl_tp_mode
+        if args.startup_check:
+            seeded = server.open_position(int(env["ACCOUNT_ID"]), 1, ProtoOATradeSide.BUY, 1)
+            server.account_auth_delay = STARTUP_AUTH_DELAY
+        log = open(os.path.join(workdir, "webhook.log"), "w")
+        process = subprocess.Popen([sys.executable, "-c", BOOTSTRAP, module, webhook], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        print(f"🧪 Webhook {os.path.basename(webhook)} + {os.path.basename(module)} (log en {log.name})", file=sys.stderr)
+
+        agent = Agent(reactor, pool=HTTPConnectionPool(reactor, persistent=False))
+        url = f"http://127.0.0.1:{args.webhook_port}/webhook"
+        sides = {}
+        startup = None
+        if args.startup_check:
+            startup = yield run_startup_check(agent, url, server, int(env["ACCOUNT_ID"]), seeded, args.startup_timeout)
+            server.account_auth_delay = 0.0
+            print(f"{'✅' if startup['ok'] else '❌'} Alerta al arrancar: posiciones abiertas {startup['open_positions']}", file=sys.stderr)
+            sides["EURUSD"] = "sell"
+        yield wait_for_webhook(agent, url, server, args.startup_timeout)
+
+        # Calentamiento: primera orden de cada símbolo (metadatos y suscripciones)
+        symbol_names = [symbol.name for symbol in symbols.values() if symbol.name.startswith("SIM")] or ["EURUSD"]
+        cold_names = [symbol.name for symbol in symbols.values() if symbol.name.startswith("COLD")]
+        warmup = [(0.0, alert(name, sides, sl_pips=10, sl_money=5)) for name in ["EURUSD"] + symbol_names]
+        yield run_workload(agent, url, server, "warmup", warmup, args.drain_timeout)
+
+        workloads = []
+        for name in args.workloads.split(","):
+            schedule = build_schedule(name, args, symbol_names, cold_names, sides)
+            print(f"🚀 {name}: {len(schedule)} alertas", file=sys.stderr)
+            workloads.append((yield run_workload(agent, url, server, name, schedule, args.drain_timeout)))
+            yield task.deferLater(reactor, args.pause, lambda: None)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if log is not None:
+            log.close()
+        yield server.stop()
+        if args.keep_workdir:
+            print(f"📁 Directorio de trabajo conservado en {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "target": args.target,
+        "webhook": os.path.basename(webhook),
+        "module": os.path.basename(module),
+        "commit": git_commit(),
+        "sync": args.sync,
+        "sl_tp_mode": args.sl_tp_mode,
+        "simulator": {"latency_ms": args.latency * 1000.0, "jitter_ms": args.jitter * 1000.0, "seed": args.seed},
+        "startup": startup,
+        "workloads": workloads,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del webhook contra el simulador de cTrader")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="v7")
+    parser.add_argument("--keep-workdir", action="store_true", help="No borrar el directorio de trabajo (log del webhook, diario y cachés) al terminar")
+    parser.add_argument("--webhook", help="Script del webhook (por defecto el de --target)")
+    parser.add_argument("--module", help="Módulo cTrader que importa el webhook (por defecto el de --target)")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--requests", type=int, default=1000, help="Alertas de steady, symbols y sltp")
+    parser.add_argument("--rate", type=float, default=20.0, help="Alertas por segundo de steady, symbols y sltp")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=100)
+    parser.add_argument("--burst-gap", type=float, default=5.0, help="Segundos entre ráfagas")
+    parser.add_argument("--symbols", type=int, default=50, help="Símbolos sintéticos de las cargas symbols y cold")
+    parser.add_argument("--sync", action="store_true", help="Esperar a la ejecución en cada petición (solo v7)")
+    parser.add_argument("--sl-tp-mode", choices=["relative", "absolute"], help="SL_TP_MODE del webhook (solo v7)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latencia del simulador (segundos)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tick-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--startup-check", action="store_true", help="Comprobar una alerta contraria a una posición abierta enviada al arrancar")
+    parser.add_argument("--webhook-port", type=int, default=5091)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="Espera máxima de las órdenes tras las respuestas")
+    parser.add_argument("--pause", type=float, default=1.0, help="Segundos entre cargas")
+    parser.add_argument("--output", help="Fichero JSON donde guardar el resultado")
+    parser.add_argument("--baseline", help="Resultado anterior con el que comparar")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Empeoramiento máximo admitido (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    def main(_reactor):
+        def report(results):
+            print(json.dumps(results, indent=2))
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as file:
+                    json.dump(results, file, indent=2)
+            if args.baseline:
+                with open(args.baseline, encoding="utf-8") as file:
+                    regressions = compare(results, json.load(file), args.max_regression)
+                if regressions:
+                    print(f"❌ {len(regressions)} regresiones respecto a {args.baseline}", file=sys.stderr)
+                    raise SystemExit(1)
+            if results["startup"] is not None and not results["startup"]["ok"]:
+                print("❌ La alerta al arrancar no cerró la posición abierta", file=sys.stderr)
+                raise SystemExit(1)
+
+        return run_benchmark(args).addCallback(report)
+
+    task.react(main)
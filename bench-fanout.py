@@ -0,0 +1,118 @@
+import os
+import io
+import json
+import time
+import argparse
+import contextlib
+import importlib.util
+from twisted.internet import task, defer, reactor
+
+# Benchmark del copy trading: una señal replicada en 1, 10 y 100 cuentas
+#
+# Uso:
+#   python bench-fanout.py --rtt 0.05 --rounds 20
+#
+# Ejecuta send_group_order de ctrader-stop-loss.py contra un broker simulado
+# que responde a cada ProtoOANewOrderReq con un ProtoOAExecutionEvent
+# ORDER_FILLED tras --rtt segundos. Mide cuánto tarda la señal completa
+# (todas las cuentas ejecutadas y el resultado agregado).
+
+os.environ.setdefault("ACCOUNT_ID", "1")
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location("ctrader_bench", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def percentile(sorted_values, pct):
+    """Percentil pct (0-100) de una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class SimulatedBroker:
+    """Cliente falso: contesta cada orden con ORDER_FILLED tras rtt segundos"""
+
+    def __init__(self, on_message, rtt):
+        from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAExecutionEvent
+        from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAExecutionType
+        self.on_message = on_message
+        self.rtt = rtt
+        self.running = True
+        self.sent = 0
+        self._event_type = ProtoOAExecutionEvent
+        self._filled = ProtoOAExecutionType.ORDER_FILLED
+
+    def send(self, request, clientMsgId=None, responseTimeoutInSeconds=5):
+        from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+        self.sent += 1
+        event = self._event_type(ctidTraderAccountId=request.ctidTraderAccountId, executionType=self._filled)
+        message = ProtoMessage(payloadType=event.payloadType, payload=event.SerializeToString(), clientMsgId=clientMsgId)
+        reactor.callLater(self.rtt, self.on_message, self, message)
+        return defer.Deferred()
+
+@defer.inlineCallbacks
+def run_benchmark(ctrader, group_sizes, rounds, rtt):
+    from account_groups import AccountGroup
+    from session_manager import READY
+
+    # Cada sesión del pool habla con su propio broker simulado
+    for pooled in ctrader.pool.all():
+        pooled.session.client = SimulatedBroker(pooled.session.on_message, rtt)
+        pooled.session.state = READY
+
+    # Precio y dígitos en caché para que el SL/TP se calcule sin red
+    symbol_id = ctrader.symbols.id_of("EURUSD")
+    ctrader.symbol_cache._symbols[symbol_id] = {"digits": 5, "updated_at": time.time()}
+    ctrader.price_book.update(symbol_id, 1.10000, 1.10002)
+
+    results = []
+    for size in group_sizes:
+        account_ids = list(range(1000, 1000 + size))
+        ctrader.account_groups["bench"] = AccountGroup("bench", [(account_id, 1.0) for account_id in account_ids])
+        for pooled in ctrader.pool.trading:
+            pooled.session.authorized_accounts = set(account_ids)
+
+        latencies = []
+        for _ in range(rounds):
+            ctrader.price_book.update(symbol_id, 1.10000, 1.10002)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                summary = yield ctrader.send_group_order("bench", "EURUSD", "BUY", 0.1, sl_pips=10, tp_pips=20)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            assert summary["filled"] == size, summary
+
+        latencies.sort()
+        results.append({
+            "accounts": size,
+            "rounds": rounds,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 3),
+                "p99": round(percentile(latencies, 99), 3),
+                "max": round(latencies[-1], 3),
+            },
+            "overhead_ms_p50": round(percentile(latencies, 50) - rtt * 1000.0, 3),
+            "orders_per_s": round(size * rounds / (sum(latencies) / 1000.0), 1),
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la replicación de órdenes en grupos de cuentas")
+    parser.add_argument("--module", default=os.path.join(REPO_DIR, "ctrader-stop-loss.py"))
+    parser.add_argument("--accounts", default="1,10,100", help="Tamaños de grupo separados por comas")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--rtt", type=float, default=0.05, help="Latencia simulada del broker (segundos)")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ctrader = load_module(args.module)
+
+    def main(_reactor):
+        d = run_benchmark(ctrader, [int(n) for n in args.accounts.split(",")], args.rounds, args.rtt)
+        return d.addCallback(lambda results: print(json.dumps({"rtt_ms": args.rtt * 1000.0, "results": results}, indent=2)))
+
+    task.react(main)
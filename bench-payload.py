@@ -0,0 +1,126 @@
+import io
+import json
+import timeit
+import argparse
+import contextlib
+from urllib.parse import urlencode, parse_qsl
+from alert_payload import AlertParser, decode_body, _loads
+
+# Micro-benchmark del parseo y validación del payload de /webhook
+#
+# Uso:
+#   python bench-payload.py --number 50000
+#
+# Compara la cadena anterior de henry-webhook-v7.py (json.loads del texto
+# decodificado, conversiones con try/except campo a campo e impresión del
+# payload completo) con AlertParser, con el mismo payload en JSON y en
+# formulario. Los print de ambos caminos van a un búfer en memoria.
+
+MAX_VOLUME = 50
+DEFAULT_VOLUME = 0.1
+
+PAYLOAD = {
+    "symbol": "EURUSD",
+    "order": "buy",
+    "volume": "0.5",
+    "sl_pips": 15,
+    "tp_pips": "30",
+    "candle_color": "green",
+    "token": "secret-token",
+}
+
+def legacy_parse(body, content_type, query_string):
+    """Parseo y validación tal como estaban en henry-webhook-v7.py"""
+    if content_type.startswith("application/json"):
+        data = json.loads(body.decode("utf-8"))
+    else:
+        # En twisted.web, request.args ya trae el formulario decodificado
+        data = dict(parse_qsl(body.decode("utf-8"))) or dict(parse_qsl(query_string.decode("utf-8")))
+        if not data and body:
+            try:
+                data = json.loads(body.decode("utf-8"))
+            except ValueError:
+                pass
+
+    print(f"📩 Webhook recibido con datos: {data}")
+
+    symbol = data.get("symbol")
+    order_type = data.get("order")
+    try:
+        volume = float(data.get("volume", DEFAULT_VOLUME))
+    except (ValueError, TypeError):
+        volume = DEFAULT_VOLUME
+    volume = min(volume, MAX_VOLUME)
+
+    sl_pips = data.get("sl_pips")
+    tp_pips = data.get("tp_pips")
+    candle_color = data.get("candle_color")
+    group = data.get("group")
+
+    if sl_pips is not None:
+        try:
+            sl_pips = float(sl_pips)
+            if sl_pips < 0:
+                sl_pips = 0
+        except (ValueError, TypeError):
+            sl_pips = None
+    if tp_pips is not None:
+        try:
+            tp_pips = float(tp_pips)
+            if tp_pips < 0:
+                tp_pips = 0
+        except (ValueError, TypeError):
+            tp_pips = None
+    if candle_color is not None:
+        candle_color = str(candle_color).upper()
+        if candle_color not in ["GREEN", "RED"]:
+            candle_color = None
+
+    if not all([symbol, order_type]):
+        raise ValueError("missing required parameters")
+
+    print(f"📩 Webhook recibido: {symbol} {order_type} {volume} SL:{sl_pips} pips TP:{tp_pips} pips Vela:{candle_color}")
+    return symbol, order_type, volume, sl_pips, tp_pips, candle_color, group
+
+def compiled_parse(parser, body, content_type, query_string):
+    """Parseo y validación con AlertParser"""
+    data = decode_body(body, content_type, query_string)
+    alert, warnings = parser.validate(data)
+    print(f"📩 Webhook recibido: {alert['symbol']} {alert['order']} {alert['volume']} SL:{alert['sl_pips']} pips TP:{alert['tp_pips']} pips Vela:{alert['candle_color']}")
+    return alert
+
+def measure(function, args, number, repeat):
+    """Mejor tiempo por llamada (microsegundos) de repeat tandas de number llamadas"""
+    with contextlib.redirect_stdout(io.StringIO()) as sink:
+        def call():
+            function(*args)
+            # Vaciar el búfer para que no crezca durante la medida
+            sink.seek(0)
+            sink.truncate()
+        best = min(timeit.repeat(call, number=number, repeat=repeat))
+    return round(best / number * 1e6, 3)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark del parseo del payload de /webhook")
+    parser.add_argument("--number", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    alert_parser = AlertParser(default_volume=DEFAULT_VOLUME, max_volume=MAX_VOLUME)
+    cases = {
+        "json": (json.dumps(PAYLOAD).encode("utf-8"), "application/json", b""),
+        "form": (urlencode(PAYLOAD).encode("utf-8"), "application/x-www-form-urlencoded", b""),
+    }
+
+    results = []
+    for name, (body, content_type, query_string) in cases.items():
+        legacy = measure(legacy_parse, (body, content_type, query_string), args.number, args.repeat)
+        compiled = measure(compiled_parse, (alert_parser, body, content_type, query_string), args.number, args.repeat)
+        results.append({
+            "case": name,
+            "legacy_us": legacy,
+            "compiled_us": compiled,
+            "speedup": round(legacy / compiled, 2),
+        })
+
+    print(json.dumps({"json_decoder": _loads.__module__, "number": args.number, "results": results}, indent=2))
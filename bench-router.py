@@ -0,0 +1,128 @@
+import json
+import timeit
+import argparse
+from twisted.internet import defer, task
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage, ProtoHeartbeatEvent
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASpotEvent, ProtoOAExecutionEvent, ProtoOAErrorRes, ProtoOASubscribeSpotsRes
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAExecutionType
+from message_router import MessageRouter
+from request_dispatcher import RequestDispatcher
+
+# Micro-benchmark del reparto de los mensajes recibidos
+#
+# Uso:
+#   python bench-router.py --number 20000
+#
+# Compara el on_message_received anterior de ctrader-stop-loss.py (importa
+# los mensajes y crea ProtoOASpotEvent(), ProtoOAExecutionEvent() y
+# ProtoOAErrorRes() en cada mensaje para comparar el payloadType) con
+# MessageRouter. Los manejadores no hacen nada, así que se mide solo el
+# coste de reparto y extracción por mensaje.
+#
+# La sección "receive" mide el camino completo de ctrader-stop-loss.py
+# (router y RequestDispatcher) con una orden pendiente de su ejecución
+# definitiva, correlacionada por clientMsgId: pasando el ProtoMessage a
+# ambos, cada uno extrae el payload por su cuenta; con un LazyMessage se
+# extrae una vez y solo si alguno lo usa.
+
+def frame(payload, client_msg_id=None):
+    """ProtoMessage tal como lo entrega el cliente"""
+    message = ProtoMessage(payloadType=payload.payloadType, payload=payload.SerializeToString())
+    if client_msg_id is not None:
+        message.clientMsgId = client_msg_id
+    return message
+
+def sample_messages():
+    """Un mensaje de cada tipo: con manejador (spot, ejecución) y sin él"""
+    spot = ProtoOASpotEvent(ctidTraderAccountId=1, symbolId=1, bid=109987, ask=109989, timestamp=1700000000000)
+    execution = ProtoOAExecutionEvent(ctidTraderAccountId=1, executionType=ProtoOAExecutionType.ORDER_FILLED)
+    return {
+        "spot": frame(spot),
+        "execution": frame(execution, client_msg_id="req-1"),
+        "heartbeat": frame(ProtoHeartbeatEvent()),
+        "subscribe_res": frame(ProtoOASubscribeSpotsRes(ctidTraderAccountId=1)),
+    }
+
+def ignore(*args):
+    pass
+
+def legacy_on_message_received(client_instance, message):
+    """on_message_received tal como estaba en ctrader-stop-loss.py"""
+    from ctrader_open_api import Protobuf
+    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAExecutionEvent, ProtoOAErrorRes, ProtoOASpotEvent
+
+    if message.payloadType == ProtoOASpotEvent().payloadType:
+        ignore(Protobuf.extract(message))
+
+    if message.payloadType == ProtoOAExecutionEvent().payloadType:
+        ignore(Protobuf.extract(message))
+
+    if message.payloadType == ProtoOAErrorRes().payloadType:
+        ignore(Protobuf.extract(message))
+
+def build_router():
+    router = MessageRouter()
+    router.register(ProtoOASpotEvent().payloadType, ignore)
+    router.register(ProtoOAExecutionEvent().payloadType, ignore)
+    router.register(ProtoOAErrorRes().payloadType, ignore)
+    return router
+
+class IdleClient:
+    """Cliente que acepta peticiones sin enviarlas"""
+
+    def send(self, request, clientMsgId=None, responseTimeoutInSeconds=5):
+        return defer.Deferred()
+
+def build_dispatcher():
+    """Dispatcher con una orden (clientMsgId req-1) a la espera de ORDER_FILLED"""
+    dispatcher = RequestDispatcher(clock=task.Clock())
+    # until nunca se cumple: cada evento de ejecución es una respuesta intermedia
+    dispatcher.send(IdleClient(), ProtoOASpotEvent(), timeout=3600, until=lambda payload: False)
+    return dispatcher
+
+def eager_receive(router, dispatcher, message):
+    """Camino anterior: el router y el dispatcher reciben el ProtoMessage"""
+    router.route(None, message)
+    dispatcher.dispatch(message)
+
+def lazy_receive(router, dispatcher, message):
+    """Camino actual: ambos comparten un LazyMessage"""
+    message = router.frame(message)
+    router.route(None, message)
+    dispatcher.dispatch(message)
+
+def measure(function, args, number, repeat):
+    """Mejor tiempo por llamada (microsegundos) de repeat tandas de number llamadas"""
+    best = min(timeit.repeat(lambda: function(*args), number=number, repeat=repeat))
+    return round(best / number * 1e6, 3)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark del reparto de mensajes recibidos")
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    router = build_router()
+    dispatcher = build_dispatcher()
+    results = []
+    receive = []
+    for name, message in sample_messages().items():
+        legacy = measure(legacy_on_message_received, (None, message), args.number, args.repeat)
+        routed = measure(router.route, (None, message), args.number, args.repeat)
+        results.append({
+            "message": name,
+            "legacy_us": legacy,
+            "router_us": routed,
+            "speedup": round(legacy / routed, 2),
+        })
+
+        eager = measure(eager_receive, (router, dispatcher, message), args.number, args.repeat)
+        lazy = measure(lazy_receive, (router, dispatcher, message), args.number, args.repeat)
+        receive.append({
+            "message": name,
+            "eager_us": eager,
+            "lazy_us": lazy,
+            "speedup": round(eager / lazy, 2),
+        })
+
+    print(json.dumps({"number": args.number, "results": results, "receive": receive}, indent=2))
@@ -0,0 +1,108 @@
+import json
+import timeit
+import argparse
+from twisted.internet import task
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASpotEvent
+from message_router import MessageRouter
+from price_book import PriceBook
+from spot_conflator import SpotConflator
+
+# Micro-benchmark de la conflación de spots durante una ráfaga
+#
+# Uso:
+#   python bench-spots.py --symbols 200 --ticks 10
+#
+# Cada ráfaga trae --ticks spots de cada uno de --symbols símbolos, que
+# llegan entre dos vueltas del reactor. Se compara la entrega directa
+# (cada spot actualiza el libro y pasa por --consumers consumidores más,
+# como antes) con SpotConflator, que solo entrega el último precio de cada
+# símbolo en el flush. Cada consumidor extra simula --consumer-us
+# microsegundos de trabajo por entrega.
+
+SPOT_EVENT = ProtoOASpotEvent().payloadType
+
+def burst_frames(symbols, ticks):
+    """ProtoMessage de una ráfaga: los ticks de todos los símbolos intercalados"""
+    frames = []
+    for tick in range(ticks):
+        for symbol_id in range(1, symbols + 1):
+            spot = ProtoOASpotEvent(ctidTraderAccountId=1, symbolId=symbol_id, bid=100000 + tick, ask=100002 + tick)
+            frames.append(ProtoMessage(payloadType=SPOT_EVENT, payload=spot.SerializeToString()))
+    return frames
+
+def busy_consumer(work_us):
+    """Consumidor que tarda work_us microsegundos por entrega"""
+    def consume(symbol_id, bid, ask):
+        deadline = timeit.default_timer() + work_us / 1e6
+        while timeit.default_timer() < deadline:
+            pass
+    return consume
+
+def direct_path(consumers):
+    """Entrega de cada spot a todos los consumidores, sin conflación"""
+    book = PriceBook()
+    router = MessageRouter()
+
+    def on_spot(client, spot):
+        book.update_from_spot(spot)
+        bid, ask = book.quote(spot.symbolId) or (None, None)
+        for consumer in consumers:
+            consumer(spot.symbolId, bid, ask)
+
+    router.register(SPOT_EVENT, on_spot)
+    return router, None, book
+
+def conflated_path(consumers):
+    """Spots a través de SpotConflator; el flush lo dispara el reloj"""
+    book = PriceBook()
+    clock = task.Clock()
+    conflator = SpotConflator(flush_interval=0.0, clock=clock)
+    conflator.add_consumer(book.update)
+    for consumer in consumers:
+        conflator.add_consumer(consumer)
+    router = MessageRouter()
+    router.register(SPOT_EVENT, lambda client, spot: conflator.push(spot))
+    return router, clock, conflator
+
+def run_burst(router, clock, frames):
+    for frame in frames:
+        router.route(None, frame)
+    if clock is not None:
+        # Siguiente vuelta del reactor: flush de la conflación
+        clock.advance(0)
+
+def measure(path, frames, repeat):
+    """Mejor tiempo (ms) de repeat ráfagas y el objeto de estado del camino"""
+    router, clock, state = path
+    best = min(timeit.repeat(lambda: run_burst(router, clock, frames), number=1, repeat=repeat))
+    return round(best * 1000.0, 3), state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la conflación de spots")
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--ticks", type=int, default=10, help="Spots por símbolo en cada ráfaga")
+    parser.add_argument("--consumers", type=int, default=1, help="Consumidores además del libro de precios")
+    parser.add_argument("--consumer-us", type=float, default=5.0, help="Trabajo de cada consumidor por entrega")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    frames = burst_frames(args.symbols, args.ticks)
+    consumers = [busy_consumer(args.consumer_us) for _ in range(args.consumers)]
+
+    direct_ms, _ = measure(direct_path(consumers), frames, args.repeat)
+    conflated_ms, conflator = measure(conflated_path(consumers), frames, args.repeat)
+    stats = conflator.stats()
+
+    print(json.dumps({
+        "spots_per_burst": len(frames),
+        "symbols": args.symbols,
+        "consumers": args.consumers,
+        "direct_ms": direct_ms,
+        "conflated_ms": conflated_ms,
+        "speedup": round(direct_ms / conflated_ms, 2),
+        "direct_us_per_spot": round(direct_ms * 1000.0 / len(frames), 3),
+        "conflated_us_per_spot": round(conflated_ms * 1000.0 / len(frames), 3),
+        "merged_per_burst": stats["merged"] // stats["flushes"],
+        "conflator": stats,
+    }, indent=2))
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+# Prueba de carga del endpoint /webhook: mide peticiones/segundo y latencias
+#
+# Uso (con el servidor ya arrancado):
+#   python bench-webhook.py --url http://127.0.0.1:5001/webhook --requests 2000 --concurrency 16
+#
+# Para comparar servidores, lanzar el mismo comando contra henry-webhook-v5.py
+# (Flask en un hilo) y henry-webhook-v7.py (twisted.web en el reactor).
+
+load_dotenv()
+
+def percentile(sorted_values, pct):
+    """Percentil pct (0-100) de una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_benchmark(url, total_requests, concurrency, payload):
+    """
+    Lanza total_requests peticiones POST repartidas en concurrency hilos
+
+    Returns:
+        Diccionario con throughput, percentiles de latencia (ms) y errores
+    """
+    target = urlparse(url)
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+
+    latencies = []
+    status_counts = {}
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def worker():
+        local_latencies = []
+        local_status = {}
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+                # Clave única: que la deduplicación de señales no descarte la carga
+                request_headers = dict(headers, **{"Idempotency-Key": f"bench-{remaining[0]}"})
+
+            # Conexión nueva por petición, como hace TradingView
+            start = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+                conn.request("POST", target.path or "/", body=body, headers=request_headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                conn.close()
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+            local_latencies.append((time.perf_counter() - start) * 1000.0)
+            local_status[status] = local_status.get(status, 0) + 1
+
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_status.items():
+                status_counts[status] = status_counts.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "url": url,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p90": round(percentile(latencies, 90), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+        "status": {str(status): count for status, count in status_counts.items()},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del endpoint /webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:5001/webhook")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--symbol", default="EURUSD")
+    parser.add_argument("--order", default="BUY")
+    parser.add_argument("--volume", type=float, default=0.01)
+    args = parser.parse_args()
+
+    payload = {
+        "symbol": args.symbol,
+        "order": args.order,
+        "volume": args.volume,
+        "token": os.getenv("SECRET_TOKEN", ""),
+    }
+
+    print(f"🚀 Lanzando {args.requests} peticiones contra {args.url} ({args.concurrency} concurrentes)...")
+    print(json.dumps(run_benchmark(args.url, args.requests, args.concurrency, payload), indent=2))
@@ -1,8 +1,23 @@
 import os
 import time
 from dotenv import load_dotenv
-from ctrader_open_api import Client, Protobuf, EndPoints, TcpProtocol
-from twisted.internet import reactor, defer
+from ctrader_open_api import EndPoints
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAExecutionEvent, ProtoOAErrorRes, ProtoOASpotEvent
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAExecutionType
+from twisted.internet import reactor, defer, task
+from request_dispatcher import RequestDispatcher
+from message_router import MessageRouter
+from symbol_cache import SymbolCache
+from price_book import PriceBook
+from spot_conflator import SpotConflator
+from symbol_registry import SymbolRegistry
+from symbol_table import SymbolTableWatcher
+from symbol_queue import SymbolQueue
+from position_book import PositionBook
+from session_manager import SessionManager
+from session_pool import SessionPool, PooledSession, TRADING, MARKET_DATA
+from rate_limiter import RateLimiter, NON_TRADING_REQUESTS
+from account_groups import load_account_groups
 
 load_dotenv()
 
@@ -22,508 +37,597 @@ ACCESS_TOKEN = os.getenv("CTRADER_ACCESS_TOKEN")
 REFRESH_TOKEN = os.getenv("CTRADER_REFRESH_TOKEN")
 ACCOUNT_ID = int(os.getenv("ACCOUNT_ID"))
 
-# Cliente global
-client = None
-account_authorized = False
-connection_ready = defer.Deferred()
+# Servidor de la API (por defecto la demo; ctrader_simulator.py para pruebas sin red)
+CTRADER_HOST = os.getenv("CTRADER_HOST", EndPoints.PROTOBUF_DEMO_HOST)
+CTRADER_PORT = int(os.getenv("CTRADER_PORT", EndPoints.PROTOBUF_PORT))
 
-# Estado de posiciones abiertas
-open_positions = {}  # Formato: {symbol: {"position_id": id, "side": "BUY/SELL", "candle_color": "GREEN/RED"}}
+# Tabla binaria con el catálogo completo de símbolos (generada por list_symbols.py)
+SYMBOL_TABLE_FILE = os.getenv("SYMBOL_TABLE_FILE", "symbols.bin")
 
-def initialize_client():
-    """
-    Inicializa y retorna un cliente cTrader
+# Símbolos que se operan: la caché y el libro de precios se mantienen calientes para ellos
+TRADED_SYMBOLS = [s.strip() for s in os.getenv("TRADED_SYMBOLS", ",".join(SYMBOLS)).split(",") if s.strip()]
+
+# Caché de metadatos de símbolos (digits, pipPosition, lotSize...)
+SYMBOL_CACHE_FILE = os.getenv("SYMBOL_CACHE_FILE", "symbol_cache.json")
+SYMBOL_CACHE_TTL = int(os.getenv("SYMBOL_CACHE_TTL", 6 * 3600))  # Segundos
+
+# Antigüedad máxima de un precio del libro antes de renovar la suscripción
+PRICE_MAX_AGE = float(os.getenv("PRICE_MAX_AGE", 5))  # Segundos
+
+# Cadencia de entrega de los spots: entre dos entregas solo se conserva el
+# último bid/ask de cada símbolo (0 = en la siguiente vuelta del reactor)
+SPOT_FLUSH_INTERVAL = float(os.getenv("SPOT_FLUSH_INTERVAL", 0))  # Segundos
+
+# Cómo se envían SL/TP: "relative" manda la distancia en la propia orden
+# (relativeStopLoss/relativeTakeProfit, calculada solo con los dígitos en
+# caché, sin esperar precio); "absolute" calcula el precio a partir del libro
+SL_TP_MODE = os.getenv("SL_TP_MODE", "relative").lower()
+if SL_TP_MODE not in ("relative", "absolute"):
+    raise ValueError(f"SL_TP_MODE inválido: {SL_TP_MODE}. Debe ser 'relative' o 'absolute'")
+
+# Intervalo de la reconciliación periódica de posiciones con el servidor
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", 60))  # Segundos
+
+# Sesión cTrader: tokens renovados, backoff de reconexión y espera máxima de las órdenes
+TOKEN_FILE = os.getenv("CTRADER_TOKEN_FILE", "ctrader_tokens.json")
+TOKEN_EXPIRES_AT = float(os.getenv("CTRADER_TOKEN_EXPIRES_AT")) if os.getenv("CTRADER_TOKEN_EXPIRES_AT") else None  # Epoch
+TOKEN_REAUTH_MARGIN = float(os.getenv("TOKEN_REAUTH_MARGIN", 3600))  # Segundos antes de caducar
+RECONNECT_BACKOFF_MAX = float(os.getenv("RECONNECT_BACKOFF_MAX", 60))  # Segundos
+SESSION_READY_TIMEOUT = float(os.getenv("SESSION_READY_TIMEOUT", 10))  # Segundos
+
+# Pool de sesiones: conexiones para órdenes y conexiones dedicadas a precios y metadatos
+TRADING_SESSIONS = max(int(os.getenv("TRADING_SESSIONS", 1)), 1)
+MARKET_DATA_SESSIONS = max(int(os.getenv("MARKET_DATA_SESSIONS", 1)), 0)
+
+# Límite de mensajes por conexión (la API admite 50/s) y límite aparte para
+# metadatos y market data, para que nunca agoten el margen de las órdenes
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", 45))
+RATE_LIMIT_NON_TRADING_PER_SECOND = float(os.getenv("RATE_LIMIT_NON_TRADING_PER_SECOND", 25))
+
+# Grupos de cuentas para copy trading (una señal se replica en todas las cuentas del grupo)
+ACCOUNT_GROUPS_FILE = os.getenv("ACCOUNT_GROUPS_FILE", "account_groups.json")
+
+# Caché de símbolos persistente: arranca caliente si hay fichero en disco
+symbol_cache = SymbolCache(SYMBOL_CACHE_FILE, ttl=SYMBOL_CACHE_TTL)
+print(f"[cTrader] 📦 Caché de símbolos cargada: {symbol_cache.load()} símbolos")
+
+# Registro de símbolos con índices nombre→id e id→nombre
+symbols = SymbolRegistry(SYMBOLS, metadata=symbol_cache)
+symbol_cache_refresh = None  # LoopingCall de refresco en segundo plano
+
+def on_symbol_table_loaded(table):
+    """Incorpora el catálogo de la tabla binaria al registro de símbolos"""
+    # Los símbolos definidos en SYMBOLS tienen prioridad sobre la tabla
+    symbols.load({**table.as_dict(), **SYMBOLS})
+    symbol_cache.seed(table.metadata())
+    print(f"[cTrader] 📚 Tabla de símbolos cargada: {len(table)} símbolos")
+
+# Carga la tabla ya y la recarga si list_symbols.py la regenera
+symbol_table_watcher = SymbolTableWatcher(SYMBOL_TABLE_FILE, on_symbol_table_loaded)
+symbol_table_watcher.start()
+
+def traded_symbol_ids():
+    """IDs de los símbolos de TRADED_SYMBOLS presentes en el registro"""
+    return [symbols.id_of(name) for name in TRADED_SYMBOLS if name in symbols]
+
+# Libro de precios siempre suscrito a los símbolos operados
+price_book = PriceBook()
+
+# Los spots llegan al libro (y a quien espera un tick) a través de la
+# conflación por símbolo, como mucho una vez por símbolo y entrega
+spot_feed = SpotConflator(flush_interval=SPOT_FLUSH_INTERVAL)
+spot_feed.add_consumer(price_book.update)
+
+# payloadType de los mensajes que se procesan al recibirlos, calculados una sola vez
+SPOT_EVENT = ProtoOASpotEvent().payloadType
+EXECUTION_EVENT = ProtoOAExecutionEvent().payloadType
+ERROR_RES = ProtoOAErrorRes().payloadType
+
+# Tabla payloadType → manejadores de los mensajes recibidos (ver on_message_received)
+message_router = MessageRouter()
+
+# Cola por símbolo: las órdenes de un mismo símbolo se ejecutan de una en una
+order_queue = SymbolQueue()
+
+# Posiciones abiertas por positionId, actualizadas con cada evento de ejecución
+position_book = PositionBook()
+position_reconcile = None  # LoopingCall de reconciliación periódica
+
+def on_session_sync(pooled):
     """
-    global client, connection_ready
+    Callback tras cada autenticación de una sesión, antes de que quede lista
     
-    if client is None or not getattr(client, 'transport', None) or not client.transport.connected:
-        print("[cTrader] 🔄 Inicializando cliente...")
+    Las sesiones de trading sincronizan el libro de posiciones por su propia
+    conexión: hasta que termina no se despacha ninguna orden, para que una
+    señal en sentido contrario cierre la posición que ya estaba abierta.
+    """
+    if pooled in pool.trading:
+        return sync_position_book(pooled)
+    return None
+
+def on_session_ready(pooled):
+    """Callback cada vez que una sesión del pool queda lista (al arrancar o tras reconectar)"""
+    if pooled in pool.trading:
+        # El libro ya está sincronizado: programar su reconciliación periódica
+        start_position_reconcile()
         
-        # Si hay un cliente anterior, intentar cerrarlo limpiamente
-        if client is not None:
-            try:
-                client.stopService()
-                print("[cTrader] ⚠️ Cliente anterior cerrado")
-            except:
-                pass
-            
-        # Crear un nuevo deferred para la conexión
-        connection_ready = defer.Deferred()
-        
-        # Crear cliente usando el protocolo correcto
-        client = Client(
-            EndPoints.PROTOBUF_DEMO_HOST, 
-            EndPoints.PROTOBUF_PORT, 
-            TcpProtocol
-        )
-        # Configuramos los callbacks básicos
-        client.setConnectedCallback(on_connected)
-        client.setDisconnectedCallback(on_disconnected)
-        client.setMessageReceivedCallback(on_message_received)
-        # Iniciamos el servicio
-        client.startService()
+        # Calentar la caché de símbolos y programar su refresco en segundo plano
+        start_symbol_cache_refresh()
     
-    return client, connection_ready
+    # Suscribir el libro de precios (las suscripciones no sobreviven a una reconexión)
+    if pooled in pool.market_data_sessions():
+        start_price_book()
 
-def on_connected(client_instance):
-    """Callback cuando el cliente se conecta"""
-    print("[cTrader] ✅ Conectado al servidor")
-    
-    # Primero autenticamos la aplicación
-    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAApplicationAuthReq
-    
-    request = ProtoOAApplicationAuthReq()
-    request.clientId = CLIENT_ID
-    request.clientSecret = CLIENT_SECRET
-    deferred = client_instance.send(request)
-    deferred.addCallback(on_app_auth_success)
-    deferred.addErrback(on_error)
+def on_session_lost(pooled, reason):
+    """Callback cuando una sesión pierde la conexión; reconecta sola con backoff"""
+    # Las respuestas pendientes ya no llegarán por esta conexión
+    pooled.dispatcher.fail_all(f"Desconectado: {reason}")
+    # Las suscripciones de esta sesión se han perdido
+    price_book.subscribed.difference_update(
+        [symbol_id for symbol_id in price_book.subscribed if pool.market_data_session(symbol_id) is pooled]
+    )
 
-def on_app_auth_success(response):
-    """Callback después de autenticar la aplicación"""
-    print("[cTrader] ✅ Aplicación autenticada correctamente")
-    
-    # Ahora autenticamos la cuenta
-    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAAccountAuthReq
-    
-    request = ProtoOAAccountAuthReq()
-    request.ctidTraderAccountId = ACCOUNT_ID
-    request.accessToken = ACCESS_TOKEN
-    deferred = client.send(request)
-    deferred.addCallback(on_account_auth_success)
-    deferred.addErrback(on_error)
-    
-    return response
+# Grupos de cuentas: sus cuentas se autentican en las mismas conexiones que ACCOUNT_ID
+account_groups = load_account_groups(ACCOUNT_GROUPS_FILE)
+if account_groups:
+    print(f"[cTrader] 👥 Grupos de cuentas cargados: {', '.join(f'{name} ({len(group)})' for name, group in account_groups.items())}")
 
-def on_account_auth_success(response):
-    """Callback después de autenticar la cuenta"""
-    global account_authorized, connection_ready
-    
-    print(f"[cTrader] ✅ Cuenta {ACCOUNT_ID} autenticada correctamente")
-    account_authorized = True
+def create_session(name, role, owner=None):
+    """
+    Crea una sesión del pool con su propio dispatcher y limitador de envíos
     
-    # Obtener posiciones abiertas
-    get_open_positions()
+    Args:
+        name: Nombre de la sesión (para métricas y logs)
+        role: TRADING o MARKET_DATA
+        owner: Sesión que renueva los tokens. Si es None, esta sesión es la
+            propietaria; si no, usa el access token de owner y recibe los
+            tokens que este renueve (renovar el refresh token en dos sesiones
+            a la vez invalidaría el de la otra)
+    """
+    session_dispatcher = RequestDispatcher()
+    # Un limitador por conexión: autenticación, órdenes y market data comparten su margen
+    limiter = RateLimiter(
+        RATE_LIMIT_PER_SECOND,
+        class_limits={NON_TRADING_REQUESTS: (RATE_LIMIT_NON_TRADING_PER_SECOND, RATE_LIMIT_NON_TRADING_PER_SECOND)}
+    )
+    session = SessionManager(
+        CTRADER_HOST,
+        CTRADER_PORT,
+        CLIENT_ID,
+        CLIENT_SECRET,
+        ACCOUNT_ID,
+        ACCESS_TOKEN if owner is None else owner.session.access_token,
+        refresh_token=REFRESH_TOKEN if owner is None else None,
+        token_expires_at=TOKEN_EXPIRES_AT if owner is None else None,
+        token_file=TOKEN_FILE if owner is None else None,
+        token_owner=owner is None,
+        dispatcher=session_dispatcher,
+        limiter=limiter,
+        # Las cuentas de los grupos solo operan por las sesiones de trading
+        extra_accounts=sorted({account_id for group in account_groups.values() for account_id in group.account_ids()}) if role == TRADING else (),
+        backoff_max=RECONNECT_BACKOFF_MAX,
+        reauth_margin=TOKEN_REAUTH_MARGIN
+    )
+    pooled = PooledSession(name, role, session, session_dispatcher, limiter=limiter)
+    session.on_sync = lambda: on_session_sync(pooled)
+    session.on_ready = lambda: on_session_ready(pooled)
+    session.on_lost = lambda reason: on_session_lost(pooled, reason)
     
-    # Notificar que la conexión está lista
-    if not connection_ready.called:
-        connection_ready.callback(None)
+    # Actualizar el estado local antes de entregar la respuesta a quien la
+    # espera; ambos comparten el payload, que solo se extrae si alguno lo usa
+    def on_session_message(client_instance, message):
+        frame = message_router.frame(message)
+        on_message_received(client_instance, frame)
+        session_dispatcher.dispatch(frame)
     
-    return response
+    session.on_message = on_session_message
+    return pooled
 
-def on_disconnected(client_instance, reason):
-    """Callback cuando el cliente se desconecta"""
-    global account_authorized, connection_ready
-    
-    print(f"[cTrader] ❌ Desconectado: {reason}")
-    account_authorized = False
-    
-    # Reiniciar el deferred para la próxima conexión
-    if connection_ready.called:
-        connection_ready = defer.Deferred()
+# Pool de sesiones precalentadas: conectan y autentican al arrancar, reconectan
+# con backoff exponencial con jitter y renuevan el token antes de que caduque
+trading_sessions = [create_session("trading-1", TRADING)]
+trading_sessions += [create_session(f"trading-{i}", TRADING, owner=trading_sessions[0]) for i in range(2, TRADING_SESSIONS + 1)]
+market_data_sessions = [create_session(f"market-data-{i}", MARKET_DATA, owner=trading_sessions[0]) for i in range(1, MARKET_DATA_SESSIONS + 1)]
+pool = SessionPool(trading_sessions, market_data_sessions)
+
+def share_access_token(access_token):
+    """Reparte el access token renovado por la sesión propietaria al resto del pool"""
+    for pooled in pool.all()[1:]:
+        pooled.session.update_access_token(access_token)
+
+trading_sessions[0].session.on_token_refreshed = share_access_token
+
+def initialize_client():
+    """
+    Arranca el pool de sesiones cTrader (si no estaba ya arrancado)
     
-    # Programar reconexión automática después de un tiempo
-    reactor.callLater(5, initialize_client)
+    Returns:
+        Tupla (client de la primera sesión de trading, deferred que se
+        resuelve cuando alguna sesión de trading está lista)
+    """
+    return pool.trading[0].client, pool.start()
 
 def on_message_received(client_instance, message):
-    """Callback para procesar mensajes recibidos"""
-    from ctrader_open_api import Protobuf
-    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAExecutionEvent, ProtoOAErrorRes
-    
-    # Procesar mensajes de error
-    if message.payloadType == ProtoOAErrorRes().payloadType:
-        error_event = Protobuf.extract(message)
-        print(f"[cTrader] ⚠️ Error recibido: {error_event}")
-        
-        # Si el error es de autorización, intentar reautenticar
-        if "not authorized" in str(error_event).lower():
-            print("[cTrader] 🔄 Reiniciando autenticación debido a error de autorización...")
-            global account_authorized
-            account_authorized = False
-            on_connected(client)
-    
-    # Procesar mensajes de ejecución
-    elif message.payloadType == ProtoOAExecutionEvent().payloadType:
-        execution_event = Protobuf.extract(message)
-        process_execution_event(execution_event)
+    """Callback para procesar mensajes recibidos (ver message_router)"""
+    message_router.route(client_instance, message)
 
-def process_execution_event(event):
-    """Procesa eventos de ejecución para actualizar el estado de posiciones"""
-    global open_positions
-    
-    print(f"[cTrader] ✅ Evento de ejecución recibido: {event.executionType}")
-    
-    # Actualizar estado de posiciones basado en el evento
-    if hasattr(event, 'position') and event.position:
-        position = event.position
-        symbol_id = position.tradeData.symbolId
-        position_id = position.positionId
-        
-        # Buscar el símbolo basado en el symbolId
-        symbol = None
-        for sym, sym_id in SYMBOLS.items():
-            if sym_id == symbol_id:
-                symbol = sym
-                break
-        
-        if not symbol:
-            print(f"[cTrader] ⚠️ No se encontró símbolo para ID {symbol_id}")
-            return
-        
-        # Actualizar posiciones abiertas
-        if event.executionType == 'ORDER_FILLED' and position.positionStatus == 'POSITION_STATUS_OPEN':
-            trade_side = position.tradeData.tradeSide
-            print(f"[cTrader] 📈 Nueva posición abierta: {symbol} {trade_side} (ID: {position_id})")
-            open_positions[symbol] = {
-                "position_id": position_id,
-                "side": trade_side
-            }
-        
-        # Actualizar cuando una posición se cierra
-        elif position.positionStatus == 'POSITION_STATUS_CLOSED':
-            if symbol in open_positions and open_positions[symbol]["position_id"] == position_id:
-                print(f"[cTrader] 📉 Posición cerrada: {symbol} (ID: {position_id})")
-                if symbol in open_positions:
-                    del open_positions[symbol]
+def on_spot_event(client_instance, spot):
+    """Pasa el spot a la conflación, que actualiza el libro antes de despertar a quien espera un tick"""
+    spot_feed.push(spot)
 
-def on_error(failure):
-    """Callback para manejar errores"""
-    global connection_ready
+def on_error_res(client_instance, error_event):
+    """Procesa mensajes de error"""
+    print(f"[cTrader] ⚠️ Error recibido: {error_event}")
     
-    print(f"[cTrader] ❌ Error: {failure}")
+    # Si el error es de autorización, intentar reautenticar
+    if "not authorized" in str(error_event).lower():
+        print("[cTrader] 🔄 Reiniciando autenticación debido a error de autorización...")
+        pooled = pool.for_client(client_instance)
+        if pooled is not None:
+            pooled.session.reauthenticate()
+
+def on_execution_event(client_instance, event):
+    """Actualiza las posiciones antes de despachar, para que la siguiente orden de la cola del símbolo vea ya el estado nuevo"""
+    process_execution_event(event)
+
+# Las ejecuciones se aplican antes de que el dispatcher entregue el mensaje
+# a quien lo espera
+message_router.register(SPOT_EVENT, on_spot_event)
+message_router.register(EXECUTION_EVENT, on_execution_event)
+message_router.register(ERROR_RES, on_error_res)
+
+def process_execution_event(event):
+    """Procesa eventos de ejecución para actualizar el libro de posiciones"""
+    print(f"[cTrader] ✅ Evento de ejecución recibido: {ProtoOAExecutionType.Name(event.executionType)}")
     
-    # En caso de error, notificar a cualquier deferred pendiente
-    if not connection_ready.called:
-        connection_ready.errback(failure)
+    # El libro de posiciones es el de la cuenta principal; las órdenes de
+    # los grupos de cuentas no gestionan posiciones
+    if event.ctidTraderAccountId != ACCOUNT_ID:
+        return
     
-    return failure
+    change = position_book.apply_execution(event)
+    if change is None:
+        return
+    
+    position = event.position
+    symbol = symbols.name_of(position.tradeData.symbolId) or position.tradeData.symbolId
+    if change == "opened":
+        print(f"[cTrader] 📈 Nueva posición abierta: {symbol} {position_book.get(position.positionId)['side']} (ID: {position.positionId})")
+    elif change == "closed":
+        print(f"[cTrader] 📉 Posición cerrada: {symbol} (ID: {position.positionId})")
+    else:
+        print(f"[cTrader] 🔁 Posición actualizada: {symbol} (ID: {position.positionId})")
 
-def get_symbol_info(symbol_id):
+def get_symbol_info(symbol_ids):
     """
-    Obtiene información sobre un símbolo, incluyendo el valor de un pip
+    Obtiene información sobre uno o varios símbolos en una sola petición
     
     Args:
-        symbol_id: ID del símbolo
+        symbol_ids: ID del símbolo o lista de IDs
         
     Returns:
-        Un deferred que se resolverá con la información del símbolo
+        Un deferred que se resolverá con la información de los símbolos
     """
     try:
         from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASymbolByIdReq
         
-        # Crear solicitud para obtener información del símbolo
+        if isinstance(symbol_ids, int):
+            symbol_ids = [symbol_ids]
+        
+        # Crear solicitud para obtener información de los símbolos
         request = ProtoOASymbolByIdReq()
         request.ctidTraderAccountId = ACCOUNT_ID
-        request.symbolId = symbol_id  # Este es el campo que causa el problema
+        # symbolId es un campo repetido
+        request.symbolId.extend(symbol_ids)
         
-        # Crear un deferred para esperar la respuesta
-        response_deferred = defer.Deferred()
+        # El dispatcher entrega la respuesta correspondiente a esta petición
+        response_deferred = pool.market_data_session().send(request, timeout=5)
         
-        # Función para manejar la respuesta
-        def on_symbol_info_received(msg):
-            from ctrader_open_api import Protobuf
-            from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASymbolByIdRes
-            
-            # Solo procesar mensajes de tipo ProtoOASymbolByIdRes
-            if msg.payloadType == ProtoOASymbolByIdRes().payloadType:
-                symbol_info = Protobuf.extract(msg)
-                response_deferred.callback(symbol_info)
-                return True  # Indica que se ha manejado el mensaje
-            return False
-        
-        # Registrar manejador temporal para la respuesta
-        orig_handler = client.messageReceivedCallback
-        
-        def temp_handler(client, msg):
-            if not on_symbol_info_received(msg) and orig_handler:
-                orig_handler(client, msg)
-        
-        client.setMessageReceivedCallback(temp_handler)
-        
-        # Enviar la solicitud
-        send_deferred = client.send(request)
-        
-        # Restaurar el manejador original después de un tiempo
-        def restore_handler():
-            if client.messageReceivedCallback == temp_handler:
-                client.setMessageReceivedCallback(orig_handler)
-        
-        reactor.callLater(5, restore_handler)
-        
-        # Manejar errores
         def on_error(failure):
             print(f"[cTrader] ❌ Error obteniendo información del símbolo: {failure}")
-            if not response_deferred.called:
-                response_deferred.errback(failure)
-            restore_handler()
             return failure
         
-        send_deferred.addErrback(on_error)
+        response_deferred.addErrback(on_error)
         
-        # Esperar respuesta
         return response_deferred
     
     except Exception as e:
         print(f"[cTrader] ❌ Error en get_symbol_info: {str(e)}")
         return defer.fail(e)
 
-def pips_to_price(symbol_id, pips, side, is_sl=True):
+def refresh_symbol_cache(force=False):
     """
-    Convierte pips a precio basado en el símbolo y el lado de la operación
+    Refresca la caché de símbolos con una única petición ProtoOASymbolByIdReq
     
     Args:
-        symbol_id: ID del símbolo
-        pips: Número de pips
-        side: Lado de la operación (BUY o SELL)
-        is_sl: True si es stop loss, False si es take profit
+        force: Si es True refresca todos los símbolos configurados, si no
+            solo los que faltan o han superado el TTL
         
     Returns:
-        Un deferred que se resolverá con el precio calculado
+        Un deferred que se resolverá con el número de símbolos actualizados
     """
-    result_deferred = defer.Deferred()
+    if not pool.is_ready:
+        return defer.succeed(0)
     
-    # Si pips es 0, no establecer SL/TP
-    if pips == 0:
-        result_deferred.callback(None)
-        return result_deferred
+    symbol_ids = traded_symbol_ids() if force else symbol_cache.stale_ids(traded_symbol_ids())
+    if not symbol_ids:
+        return defer.succeed(0)
     
-    # Obtener información del símbolo
-    symbol_info_deferred = get_symbol_info(symbol_id)
+    def on_symbols_received(response):
+        updated = symbol_cache.update_from_response(response)
+        symbol_cache.save()
+        print(f"[cTrader] 📦 Caché de símbolos actualizada: {updated} símbolos")
+        return updated
     
-    def calculate_price(symbol_info):
-        try:
-            # Obtener el valor de un pip para este símbolo
-            digits = symbol_info.symbol.digits
-            pip_position = 10 ** (digits - 1)  # Posición del pip (10^(dígitos-1))
-            pip_value = 1.0 / pip_position  # Valor de 1 pip
-            
-            # Obtener el precio actual
-            from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASubscribeSpotsReq
-            
-            # Suscribirse a spots para obtener el precio actual
-            spots_request = ProtoOASubscribeSpotsReq()
-            spots_request.ctidTraderAccountId = ACCOUNT_ID
-            # Corregir aquí: symbolId es un campo repetido, debe usar append
-            spots_request.symbolId.append(symbol_id)  # Usar append en lugar de asignación directa
-            
-            spots_deferred = client.send(spots_request)
-            
-            # Esperar a recibir un spot
-            spot_price_deferred = defer.Deferred()
-            
-            # Función para manejar spots recibidos
-            def on_spot_received(msg):
-                from ctrader_open_api import Protobuf
-                from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASpotEvent
-                
-                if msg.payloadType == ProtoOASpotEvent().payloadType:
-                    spot = Protobuf.extract(msg)
-                    if spot.symbolId == symbol_id:
-                        # Cancelar suscripción a spots
-                        from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAUnsubscribeSpotsReq
-                        unsub_request = ProtoOAUnsubscribeSpotsReq()
-                        unsub_request.ctidTraderAccountId = ACCOUNT_ID
-                        # Corregir aquí también
-                        unsub_request.symbolId.append(symbol_id)  # Usar append en lugar de asignación directa
-                        client.send(unsub_request)
-                        
-                        # Resolver con el precio del spot
-                        if not spot_price_deferred.called:
-                            bid_price = spot.bid
-                            ask_price = spot.ask
-                            
-                            # Para BUY: 
-                            # - El stop loss se coloca por debajo del precio de entrada (ask - sl_pips)
-                            # - El take profit se coloca por encima del precio de entrada (ask + tp_pips)
-                            # Para SELL:
-                            # - El stop loss se coloca por encima del precio de entrada (bid + sl_pips)
-                            # - El take profit se coloca por debajo del precio de entrada (bid - tp_pips)
-                            price = 0.0
-                            
-                            if side.upper() == "BUY":
-                                if is_sl:  # Stop Loss para BUY
-                                    price = ask_price - (pips * pip_value)
-                                else:  # Take Profit para BUY
-                                    price = ask_price + (pips * pip_value)
-                            else:  # SELL
-                                if is_sl:  # Stop Loss para SELL
-                                    price = bid_price + (pips * pip_value)
-                                else:  # Take Profit para SELL
-                                    price = bid_price - (pips * pip_value)
-                            
-                            # Redondear al número correcto de decimales
-                            price = round(price, digits)
-                            
-                            spot_price_deferred.callback(price)
-                        return True
-                return False
-            
-            # Registrar manejador temporal para spots
-            orig_handler = client.messageReceivedCallback
-            
-            def temp_handler(client, msg):
-                if not on_spot_received(msg) and orig_handler:
-                    orig_handler(client, msg)
-            
-            client.setMessageReceivedCallback(temp_handler)
-            
-            # Restaurar el manejador original después de un tiempo
-            def restore_handler():
-                if client.messageReceivedCallback == temp_handler:
-                    client.setMessageReceivedCallback(orig_handler)
-            
-            reactor.callLater(5, restore_handler)
-            
-            # Timeout para recibir spot
-            def on_timeout():
-                if not spot_price_deferred.called:
-                    restore_handler()
-                    spot_price_deferred.errback(Exception("Timeout esperando precio actual"))
-            
-            reactor.callLater(3, on_timeout)
-            
-            # Manejar errores de suscripción
-            def on_sub_error(failure):
-                print(f"[cTrader] ❌ Error suscribiéndose a spots: {failure}")
-                restore_handler()
-                if not spot_price_deferred.called:
-                    spot_price_deferred.errback(failure)
-                return failure
-            
-            spots_deferred.addErrback(on_sub_error)
-            
-            # Devolver el precio calculado
-            spot_price_deferred.addCallbacks(
-                lambda price: result_deferred.callback(price),
-                lambda failure: result_deferred.errback(failure)
-            )
-            
-        except Exception as e:
-            print(f"[cTrader] ❌ Error calculando precio: {str(e)}")
-            result_deferred.errback(e)
+    def on_refresh_error(failure):
+        print(f"[cTrader] ⚠️ No se pudo refrescar la caché de símbolos: {failure.getErrorMessage()}")
+        return 0
     
-    # Manejar errores
-    def on_symbol_info_error(failure):
-        print(f"[cTrader] ❌ Error obteniendo información del símbolo: {failure}")
-        result_deferred.errback(failure)
-        return failure
+    return get_symbol_info(symbol_ids).addCallbacks(on_symbols_received, on_refresh_error)
+
+def start_symbol_cache_refresh():
+    """Calienta la caché de símbolos y arranca su refresco periódico"""
+    global symbol_cache_refresh
     
-    symbol_info_deferred.addCallbacks(calculate_price, on_symbol_info_error)
+    refresh_symbol_cache()
     
-    return result_deferred
+    if symbol_cache_refresh is None or not symbol_cache_refresh.running:
+        symbol_cache_refresh = task.LoopingCall(refresh_symbol_cache)
+        # La primera ejecución ya se ha hecho arriba
+        symbol_cache_refresh.start(max(SYMBOL_CACHE_TTL / 2, 60), now=False)
 
-    # Manejar errores
-    def on_symbol_info_error(failure):
-        print(f"[cTrader] ❌ Error obteniendo información del símbolo: {failure}")
-        result_deferred.errback(failure)
-        return failure
+def get_symbol_digits(symbol_id):
+    """
+    Devuelve los dígitos de precio de un símbolo desde la caché
     
-    symbol_info_deferred.addCallbacks(calculate_price, on_symbol_info_error)
+    Solo se consulta al broker si el símbolo no está en caché (por ejemplo,
+    justo después del primer arranque).
     
-    return result_deferred
+    Returns:
+        Un deferred que se resolverá con el número de dígitos
+    """
+    entry = symbol_cache.get(symbol_id)
+    if entry is not None:
+        return defer.succeed(entry["digits"])
+    
+    def on_symbol_info(response):
+        symbol_cache.update_from_response(response)
+        symbol_cache.save()
+        return symbol_cache.get(symbol_id)["digits"]
+    
+    return get_symbol_info(symbol_id).addCallback(on_symbol_info)
 
-def get_open_positions():
+def subscribe_spots(symbol_ids):
     """
-    Obtiene todas las posiciones abiertas actualmente para actualizar el estado
+    Suscribe el libro de precios a los spots de los símbolos indicados
+    
+    Args:
+        symbol_ids: Lista de IDs de símbolos
+        
+    Returns:
+        Un deferred que se resolverá cuando el servidor confirme la suscripción
     """
-    global open_positions
+    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASubscribeSpotsReq
     
-    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAReconcileReq
+    # Cada símbolo se suscribe siempre en la misma sesión de market data
+    by_session = {}
+    for symbol_id in symbol_ids:
+        by_session.setdefault(pool.market_data_session(symbol_id), []).append(symbol_id)
     
-    result_deferred = defer.Deferred()
-   
-    try:
-        # Solicitud para reconciliar posiciones
-        request = ProtoOAReconcileReq()
+    def subscribe(pooled, session_symbol_ids):
+        request = ProtoOASubscribeSpotsReq()
         request.ctidTraderAccountId = ACCOUNT_ID
+        # symbolId es un campo repetido
+        request.symbolId.extend(session_symbol_ids)
         
-        # Guardar el manejador original (acceder directamente al atributo en lugar de usar un método getter)
-        original_handler = client.messageReceivedCallback
+        def on_subscribed(response):
+            price_book.subscribed.update(session_symbol_ids)
+            return response
         
-        # Función para manejar la respuesta
-        def on_reconcile_received(msg):
-            from ctrader_open_api import Protobuf
-            from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAReconcileRes
-            
-            # Solo procesar mensajes de tipo ProtoOAReconcileRes
-            if msg.payloadType == ProtoOAReconcileRes().payloadType:
-                reconcile_data = Protobuf.extract(msg)
-                
-                # Reiniciar el registro de posiciones abiertas
-                open_positions.clear()
-                
-                # Procesar posiciones
-                if hasattr(reconcile_data, 'position') and reconcile_data.position:
-                    for position in reconcile_data.position:
-                        symbol_id = position.tradeData.symbolId
-                        position_id = position.positionId
-                        trade_side = position.tradeData.tradeSide
-                        
-                        # Buscar el símbolo correspondiente
-                        symbol = None
-                        for sym, sym_id in SYMBOLS.items():
-                            if sym_id == symbol_id:
-                                symbol = sym
-                                break
-                        
-                        if symbol:
-                            open_positions[symbol] = {
-                                "position_id": position_id,
-                                "side": trade_side
-                            }
-                            print(f"[cTrader] 📊 Posición abierta encontrada: {symbol} {trade_side} (ID: {position_id})")
-                
-                print(f"[cTrader] 📊 Posiciones abiertas: {len(open_positions)}")
-                
-                # No necesitamos seguir procesando este tipo de mensajes
-                client.setMessageReceivedCallback(original_handler)
-                
-                result_deferred.callback(open_positions)
-                return True
-            return False
+        def on_sub_error(failure):
+            # Si ya estaba suscrito la suscripción sigue siendo válida
+            if "ALREADY_SUBSCRIBED" in str(failure.value):
+                price_book.subscribed.update(session_symbol_ids)
+                return None
+            print(f"[cTrader] ❌ Error suscribiéndose a spots en {pooled.name}: {failure.getErrorMessage()}")
+            return failure
         
-        # Establecer un manejador temporal
-        def temp_handler(client_instance, msg):
-            if not on_reconcile_received(msg):
-                # Si no procesamos este mensaje, pasarlo al manejador original
-                if original_handler:
-                    original_handler(client_instance, msg)
+        return pooled.send(request).addCallbacks(on_subscribed, on_sub_error)
+    
+    return defer.gatherResults(
+        [subscribe(pooled, ids) for pooled, ids in by_session.items()],
+        consumeErrors=True
+    ).addErrback(lambda failure: failure.value.subFailure)
+
+def start_price_book():
+    """Mantiene el libro de precios suscrito a todos los símbolos operados"""
+    symbol_ids = traded_symbol_ids()
+    subscribe_spots(symbol_ids).addCallback(
+        lambda _: print(f"[cTrader] 💹 Libro de precios suscrito a {len(symbol_ids)} símbolos")
+    ).addErrback(lambda failure: None)
+
+def price_from_quote(quote, pips, pip_value, side, is_sl, digits):
+    """
+    Calcula el precio de SL/TP a partir de un (bid, ask)
+    
+    Para BUY: 
+    - El stop loss se coloca por debajo del precio de entrada (ask - sl_pips)
+    - El take profit se coloca por encima del precio de entrada (ask + tp_pips)
+    Para SELL:
+    - El stop loss se coloca por encima del precio de entrada (bid + sl_pips)
+    - El take profit se coloca por debajo del precio de entrada (bid - tp_pips)
+    """
+    bid_price, ask_price = quote
+    
+    if side.upper() == "BUY":
+        if is_sl:  # Stop Loss para BUY
+            price = ask_price - (pips * pip_value)
+        else:  # Take Profit para BUY
+            price = ask_price + (pips * pip_value)
+    else:  # SELL
+        if is_sl:  # Stop Loss para SELL
+            price = bid_price + (pips * pip_value)
+        else:  # Take Profit para SELL
+            price = bid_price - (pips * pip_value)
+    
+    # Redondear al número correcto de decimales
+    return round(price, digits)
+
+def pips_to_distance(pips, digits):
+    """
+    Convierte pips a distancia relativa de SL/TP (1/100000 de unidad de precio)
+    
+    Usa el mismo pip que pips_to_price (10^-(dígitos-1)) y redondea al paso
+    de precio del símbolo, como mínimo un paso.
+    """
+    step = 10 ** (5 - digits) if digits <= 5 else 1
+    distance = pips * 10.0 ** (6 - digits)
+    return max(int(round(distance / step)), 1) * step
+
+def pips_to_price(symbol_id, pips, side, is_sl=True):
+    """
+    Convierte pips a precio basado en el símbolo y el lado de la operación
+    
+    El precio actual se lee del libro de precios. Solo si no hay precio o es
+    más antiguo que PRICE_MAX_AGE se renueva la suscripción y se espera al
+    siguiente tick.
+    
+    Args:
+        symbol_id: ID del símbolo
+        pips: Número de pips
+        side: Lado de la operación (BUY o SELL)
+        is_sl: True si es stop loss, False si es take profit
         
-        client.setMessageReceivedCallback(temp_handler)
+    Returns:
+        Un deferred que se resolverá con el precio calculado
+    """
+    # Si pips es 0, no establecer SL/TP
+    if pips == 0:
+        return defer.succeed(None)
+    
+    # Obtener los dígitos del símbolo (desde la caché, sin ir a la red)
+    symbol_info_deferred = get_symbol_digits(symbol_id)
+    
+    def calculate_price(digits):
+        # Obtener el valor de un pip para este símbolo
+        pip_position = 10 ** (digits - 1)  # Posición del pip (10^(dígitos-1))
+        pip_value = 1.0 / pip_position  # Valor de 1 pip
         
-        # Enviar la solicitud
-        send_deferred = client.send(request)
+        # Camino rápido: precio reciente en el libro
+        quote = price_book.quote(symbol_id, max_age=PRICE_MAX_AGE)
+        if quote is not None:
+            return price_from_quote(quote, pips, pip_value, side, is_sl, digits)
         
-        # Configurar un timeout para restaurar el manejador original
-        def timeout_handler():
-            if not result_deferred.called:
-                print("[cTrader] ⚠️ Timeout esperando posiciones abiertas")
-                # Restaurar el manejador original
-                client.setMessageReceivedCallback(original_handler)
-                # Devolver un diccionario vacío en caso de timeout
-                result_deferred.callback({})
+        # Precio ausente u obsoleto: renovar la suscripción y esperar un tick
+        print(f"[cTrader] ⏳ Precio de {symbol_id} no disponible o obsoleto, esperando tick...")
         
-        reactor.callLater(5, timeout_handler)
+        # Registrar la espera del spot antes de suscribirse para no perder el primero
+        spot_deferred = spot_feed.wait_for(
+            symbol_id,
+            timeout=3,
+            ready=lambda: price_book.quote(symbol_id) is not None
+        )
         
-        # Manejar errores en el envío
-        def on_error(failure):
-            print(f"[cTrader] ❌ Error obteniendo posiciones abiertas: {failure}")
-            # Restaurar el manejador original
-            client.setMessageReceivedCallback(original_handler)
-            
-            if not result_deferred.called:
-                result_deferred.errback(failure)
-            return failure
+        def on_sub_error(failure):
+            if not spot_deferred.called:
+                spot_deferred.errback(failure)
+            return None
         
-        send_deferred.addErrback(on_error)
+        subscribe_spots([symbol_id]).addErrback(on_sub_error)
         
-        return result_deferred
+        # El libro ya se ha actualizado con el spot antes de despertar la espera
+        spot_deferred.addCallback(
+            lambda _: price_from_quote(price_book.quote(symbol_id), pips, pip_value, side, is_sl, digits)
+        )
+        return spot_deferred
     
-    except Exception as e:
-        print(f"[cTrader] ❌ Error en get_open_positions: {str(e)}")
-        if not result_deferred.called:
-            result_deferred.errback(e)
-        return result_deferred
+    # Manejar errores
+    def on_price_error(failure):
+        print(f"[cTrader] ❌ Error calculando precio: {failure.getErrorMessage()}")
+        return failure
+    
+    return symbol_info_deferred.addCallback(calculate_price).addErrback(on_price_error)
+
+def sync_position_book(pooled):
+    """
+    Compara el libro de posiciones con ProtoOAReconcileReq y corrige solo
+    las diferencias
+    
+    Args:
+        pooled: Sesión por la que se envía la petición (no tiene por qué
+            estar lista todavía)
+    
+    Returns:
+        Un deferred que se resolverá con el diccionario de diferencias de
+        PositionBook.reconcile, o fallará si no hay respuesta
+    """
+    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAReconcileReq
+    
+    request = ProtoOAReconcileReq()
+    request.ctidTraderAccountId = ACCOUNT_ID
+    requested_at = time.monotonic()
+    
+    def on_reconcile_received(reconcile_data):
+        diff = position_book.reconcile(reconcile_data.position, since=requested_at)
+        corrected = sum(len(ids) for ids in diff.values())
+        if corrected:
+            print(f"[cTrader] 📊 Reconciliación: {len(diff['opened'])} abiertas, {len(diff['updated'])} actualizadas, {len(diff['closed'])} cerradas")
+        print(f"[cTrader] 📊 Posiciones abiertas: {len(position_book)}")
+        return diff
+    
+    return pooled.send(request, timeout=5).addCallback(on_reconcile_received)
+
+def reconcile_positions():
+    """
+    Reconciliación periódica del libro de posiciones (ver sync_position_book)
+    
+    Returns:
+        Un deferred que se resolverá con el diccionario de diferencias ({}
+        si no hay respuesta)
+    """
+    if not pool.is_ready:
+        return defer.succeed({})
+    
+    def on_reconcile_error(failure):
+        if failure.check(defer.TimeoutError):
+            print("[cTrader] ⚠️ Timeout esperando posiciones abiertas")
+        else:
+            print(f"[cTrader] ❌ Error obteniendo posiciones abiertas: {failure.getErrorMessage()}")
+        return {}
+    
+    return sync_position_book(pool.trading_session()).addErrback(on_reconcile_error)
+
+def start_position_reconcile():
+    """Arranca la reconciliación periódica del libro de posiciones"""
+    global position_reconcile
+    
+    if position_reconcile is None or not position_reconcile.running:
+        position_reconcile = task.LoopingCall(reconcile_positions)
+        # La sesión acaba de sincronizar el libro al quedar lista
+        position_reconcile.start(RECONCILE_INTERVAL, now=False)
+
+def accounts_with_label(label, account_ids):
+    """
+    Cuentas que tienen abierta alguna posición con una etiqueta
+    
+    Sirve para no repetir una orden del diario que ya se ejecutó antes de un
+    reinicio. Una posición que ya se cerró (por SL/TP) no aparece, así que
+    su orden se volvería a enviar.
+    
+    Returns:
+        Un deferred que se resolverá con el conjunto de account_ids
+    """
+    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAReconcileReq
+    
+    def check(account_id):
+        request = ProtoOAReconcileReq()
+        request.ctidTraderAccountId = account_id
+        return pool.trading_session(account_id).send(request, timeout=10).addCallback(
+            lambda response: any(position.tradeData.label == label for position in response.position)
+        )
+    
+    checks = defer.gatherResults([check(account_id) for account_id in account_ids], consumeErrors=True)
+    return checks.addCallback(lambda found: {account_id for account_id, ok in zip(account_ids, found) if ok})
 
 def close_position(symbol):
     """
@@ -535,9 +639,8 @@ def close_position(symbol):
     Returns:
         Un deferred que se resolverá cuando se complete la operación
     """
-    global open_positions
-    
-    if symbol not in open_positions:
+    position = position_book.latest(symbols.id_of(symbol))
+    if position is None:
         print(f"[cTrader] ⚠️ No hay posición abierta para {symbol}")
         return defer.succeed(None)
     
@@ -546,21 +649,21 @@ def close_position(symbol):
     result_deferred = defer.Deferred()
     
     try:
-        position_id = open_positions[symbol]["position_id"]
+        position_id = position["position_id"]
         
-        # Solicitud para cerrar la posición
+        # Solicitud para cerrar la posición completa
         request = ProtoOAClosePositionReq()
         request.ctidTraderAccountId = ACCOUNT_ID
         request.positionId = position_id
+        request.volume = position["volume"]
         
         print(f"[cTrader] 🔄 Cerrando posición para {symbol} (ID: {position_id})")
         
-        # Enviar la solicitud
-        send_deferred = client.send(request)
+        # Enviar la solicitud y esperar al evento de ejecución del cierre
+        send_deferred = pool.trading_session().send(request, timeout=10, until=is_final_execution)
         
         def on_success(response):
-            print(f"[cTrader] ✅ Solicitud de cierre enviada para {symbol}")
-            # La respuesta real vendrá a través de un evento de ejecución
+            print(f"[cTrader] ✅ Posición cerrada para {symbol}")
             result_deferred.callback(response)
             return response
         
@@ -579,7 +682,119 @@ def close_position(symbol):
         return result_deferred
 
 
-def send_market_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_color=None):
+def mark_timing(timings, stage):
+    """Anota el instante en que una orden alcanza una etapa (si se piden tiempos)"""
+    if timings is not None:
+        timings[stage] = time.perf_counter()
+
+def is_final_execution(event):
+    """True si el evento de ejecución ya no es la simple aceptación de la orden"""
+    return event.executionType != ProtoOAExecutionType.ORDER_ACCEPTED
+
+def resolve_sl_tp(symbol_id, side, sl_pips=None, tp_pips=None, mode=None):
+    """
+    Calcula el stop loss y el take profit a partir de pips
+    
+    En modo "relative" solo hacen falta los dígitos del símbolo, que están en
+    caché, así que el deferred ya viene resuelto y la orden sale sin esperar
+    ningún precio. En modo "absolute" se calculan los precios con el libro.
+    
+    Args:
+        mode: "relative" o "absolute" (por defecto SL_TP_MODE)
+    
+    Returns:
+        Un deferred que se resolverá con un diccionario {campo: valor} con
+        los campos de ProtoOANewOrderReq a rellenar (stopLoss/takeProfit o
+        relativeStopLoss/relativeTakeProfit); sin el campo si no se pide
+        (None o 0 pips)
+    """
+    wanted = []
+    if sl_pips is not None and sl_pips != 0:
+        wanted.append((True, float(sl_pips)))
+    if tp_pips is not None and tp_pips != 0:
+        wanted.append((False, float(tp_pips)))
+    if not wanted:
+        return defer.succeed({})
+    
+    if (mode or SL_TP_MODE) == "relative":
+        def distances(digits):
+            return {
+                "relativeStopLoss" if is_sl else "relativeTakeProfit": pips_to_distance(pips, digits)
+                for is_sl, pips in wanted
+            }
+        return get_symbol_digits(symbol_id).addCallback(distances)
+    
+    # Calcular los precios y esperar a que ambos cálculos terminen
+    deferreds = [pips_to_price(symbol_id, pips, side, is_sl=is_sl) for is_sl, pips in wanted]
+    
+    def prices(results):
+        return {
+            "stopLoss" if is_sl else "takeProfit": price
+            for (is_sl, _), price in zip(wanted, results)
+        }
+    return defer.gatherResults(deferreds).addCallback(prices)
+
+def describe_sl_tp(stops, sl_pips=None, tp_pips=None):
+    """Imprime el stop loss y el take profit de un diccionario de resolve_sl_tp"""
+    if "stopLoss" in stops:
+        print(f"[cTrader] 🛑 Stop Loss establecido a {stops['stopLoss']} ({sl_pips} pips)")
+    if "relativeStopLoss" in stops:
+        print(f"[cTrader] 🛑 Stop Loss a {stops['relativeStopLoss'] / 100000} del precio de entrada ({sl_pips} pips)")
+    if "takeProfit" in stops:
+        print(f"[cTrader] 🎯 Take Profit establecido a {stops['takeProfit']} ({tp_pips} pips)")
+    if "relativeTakeProfit" in stops:
+        print(f"[cTrader] 🎯 Take Profit a {stops['relativeTakeProfit'] / 100000} del precio de entrada ({tp_pips} pips)")
+
+def build_market_order(account_id, symbol_id, side, volume, stops=None, label=None):
+    """
+    Construye la ProtoOANewOrderReq de una orden de mercado
+    
+    Args:
+        account_id: ctidTraderAccountId de la cuenta
+        symbol_id: ID del símbolo
+        side: Lado de la operación ("BUY" o "SELL")
+        volume: Volumen en lotes
+        stops: Diccionario de resolve_sl_tp con el stop loss y el take
+            profit, absolutos o relativos (opcional)
+        label: Etiqueta de la orden; la posición la conserva, lo que permite
+            saber tras un reinicio si la orden llegó a ejecutarse
+    """
+    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOANewOrderReq
+    from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAOrderType, ProtoOATradeSide
+    
+    request = ProtoOANewOrderReq()
+    request.ctidTraderAccountId = account_id
+    request.symbolId = symbol_id
+    request.orderType = ProtoOAOrderType.MARKET
+    
+    # Determinar el lado de la operación
+    if side.upper() == "BUY":
+        request.tradeSide = ProtoOATradeSide.BUY
+    elif side.upper() == "SELL":
+        request.tradeSide = ProtoOATradeSide.SELL
+    else:
+        raise ValueError(f"Lado de operación inválido: {side}. Debe ser 'BUY' o 'SELL'")
+    
+    # Convertir el volumen a centilotes (x100)
+    volume_in_centilotes = int(float(volume) * 100)
+    
+    # Asegurarnos de que el volumen sea al menos 1 centilote
+    if volume_in_centilotes < 1:
+        volume_in_centilotes = 1
+        print(f"[cTrader] ⚠️ Volumen ajustado al mínimo: 0.01 lotes (1 centilote)")
+    
+    request.volume = volume_in_centilotes
+    request.comment = "Order from TradingView Webhook"
+    if label:
+        request.label = label
+    
+    # stopLoss/takeProfit o relativeStopLoss/relativeTakeProfit según el modo
+    for field, value in (stops or {}).items():
+        setattr(request, field, value)
+    
+    return request
+
+def send_market_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_color=None, timings=None, label=None):
     """
     Envía una orden de mercado con stop loss y take profit en pips
     
@@ -590,95 +805,51 @@ def send_market_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_c
         sl_pips: Stop loss en pips (opcional)
         tp_pips: Take profit en pips (opcional)
         candle_color: Color de la vela ("GREEN" o "RED")
+        timings: Diccionario opcional donde anotar los instantes de cada etapa
+        label: Etiqueta de la orden (ver build_market_order)
     """
-    global account_authorized, open_positions
-    
     # Verificar que la cuenta esté autorizada
-    if not account_authorized:
+    if not pool.is_ready:
         raise Exception("Cuenta no autorizada. No se puede enviar la orden.")
     
-    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOANewOrderReq
-    from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAOrderType, ProtoOATradeSide
-    
-    if symbol not in SYMBOLS:
+    symbol_id = symbols.id_of(symbol)
+    if symbol_id is None:
         raise Exception(f"❌ El símbolo {symbol} no está en la lista local. Añádelo a SYMBOLS.")
     
-    symbol_id = SYMBOLS[symbol]
-    
     # Deferred para el resultado final
     result_deferred = defer.Deferred()
     
     # Función para procesar la nueva orden
     def process_new_order():
-        # Calcular precios basados en pips si se especifican
-        sl_deferred = defer.succeed(None)
-        tp_deferred = defer.succeed(None)
+        mark_timing(timings, "prices_started")
         
-        # Calcular precio de stop loss si se especifica y no es cero
-        if sl_pips is not None and sl_pips != 0:
-            sl_deferred = pips_to_price(symbol_id, float(sl_pips), side, is_sl=True)
-        
-        # Calcular precio de take profit si se especifica y no es cero
-        if tp_pips is not None and tp_pips != 0:
-            tp_deferred = pips_to_price(symbol_id, float(tp_pips), side, is_sl=False)
-        
-        # Esperar a que ambos cálculos terminen
-        def handle_prices(results):
-            sl_price, tp_price = results
-            send_order(sl_price, tp_price)
+        # Calcular SL/TP (en modo relativo ya viene resuelto)
+        def handle_prices(stops):
+            mark_timing(timings, "prices_resolved")
+            send_order(stops)
         
         def handle_error(failure):
             print(f"[cTrader] ❌ Error calculando precios: {failure}")
             result_deferred.errback(failure)
             return failure
         
-        # Combinar ambos deferreds
-        defer.gatherResults([sl_deferred, tp_deferred]).addCallbacks(handle_prices, handle_error)
+        resolve_sl_tp(symbol_id, side, sl_pips, tp_pips).addCallbacks(handle_prices, handle_error)
     
     # Función para enviar la orden una vez calculados los precios
-    def send_order(sl_price=None, tp_price=None):
+    def send_order(stops=None):
         try:
             # Configurar la orden
-            request = ProtoOANewOrderReq()
-            request.ctidTraderAccountId = ACCOUNT_ID
-            request.symbolId = symbol_id
-            request.orderType = ProtoOAOrderType.MARKET
-            
-            # Determinar el lado de la operación
-            if side.upper() == "BUY":
-                request.tradeSide = ProtoOATradeSide.BUY
-            elif side.upper() == "SELL":
-                request.tradeSide = ProtoOATradeSide.SELL
-            else:
-                raise ValueError(f"Lado de operación inválido: {side}. Debe ser 'BUY' o 'SELL'")
-            
-            # Convertir el volumen a centilotes (x100)
-            volume_in_centilotes = int(float(volume) * 100)
+            request = build_market_order(ACCOUNT_ID, symbol_id, side, volume, stops, label=label)
+            describe_sl_tp(stops or {}, sl_pips, tp_pips)
             
-            # Asegurarnos de que el volumen sea al menos 1 centilote
-            if volume_in_centilotes < 1:
-                volume_in_centilotes = 1
-                print(f"[cTrader] ⚠️ Volumen ajustado al mínimo: 0.01 lotes (1 centilote)")
+            print(f"[cTrader] 🚀 Enviando orden {side} para {symbol} con volumen {volume} ({request.volume} centilotes)")
             
-            request.volume = volume_in_centilotes
-            request.comment = "Order from TradingView Webhook"
-            
-            # Añadir stop loss si está calculado
-            if sl_price is not None:
-                request.stopLoss = sl_price
-                print(f"[cTrader] 🛑 Stop Loss establecido a {sl_price} ({sl_pips} pips)")
-            
-            # Añadir take profit si está calculado
-            if tp_price is not None:
-                request.takeProfit = tp_price
-                print(f"[cTrader] 🎯 Take Profit establecido a {tp_price} ({tp_pips} pips)")
-            
-            print(f"[cTrader] 🚀 Enviando orden {side} para {symbol} con volumen {volume} ({volume_in_centilotes} centilotes)")
-            
-            # Enviar la orden
-            order_deferred = client.send(request)
+            # Enviar la orden y esperar su ejecución (no solo la aceptación)
+            mark_timing(timings, "order_sent")
+            order_deferred = pool.trading_session().send(request, timeout=10, until=is_final_execution)
             
             def on_order_success(response):
+                mark_timing(timings, "executed")
                 print(f"[cTrader] ✅ Orden enviada correctamente: {response}")
                 result_deferred.callback(response)
                 return response
@@ -694,9 +865,10 @@ def send_market_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_c
             print(f"[cTrader] ❌ Error enviando orden: {str(e)}")
             result_deferred.errback(e)
     
-    # Verificar si ya hay una posición abierta para este símbolo
-    if symbol in open_positions:
-        current_side = open_positions[symbol]["side"]
+    # Verificar si ya hay una posición abierta para este símbolo (estado local)
+    current_position = position_book.latest(symbol_id)
+    if current_position is not None:
+        current_side = current_position["side"]
         
         # Si la posición existente tiene el mismo lado que la nueva orden, verificar el color de la vela
         if current_side == side.upper():
@@ -710,8 +882,7 @@ def send_market_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_c
                 close_deferred = close_position(symbol)
                 
                 def on_close_success(_):
-                    # Esperar un poco para asegurar que la posición se cerró
-                    reactor.callLater(1, lambda: result_deferred.callback({"status": "closed", "message": f"Posición {side.upper()} cerrada para {symbol}"}))
+                    result_deferred.callback({"status": "closed", "message": f"Posición {side.upper()} cerrada para {symbol}"})
                 
                 def on_close_error(failure):
                     result_deferred.errback(failure)
@@ -728,10 +899,9 @@ def send_market_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_c
             print(f"[cTrader] 🔄 Cerrando posición {current_side} para abrir nueva posición {side.upper()}")
             close_deferred = close_position(symbol)
             
-            # Después de cerrar, continuar con la apertura de la nueva posición
+            # El cierre ya se ha ejecutado: abrir la nueva posición
             def continue_with_order(_):
-                # Esperar un poco para asegurar que la posición se cerró
-                reactor.callLater(1, lambda: process_new_order())
+                process_new_order()
             
             def on_close_error(failure):
                 result_deferred.errback(failure)
@@ -743,96 +913,101 @@ def send_market_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_c
     
     return result_deferred
 
+def send_group_order(group_name, symbol, side, volume, sl_pips=None, tp_pips=None, timings=None, label=None, account_ids=None):
+    """
+    Replica una orden de mercado en todas las cuentas de un grupo a la vez
     
-    # Función para procesar la nueva orden
-    def process_new_order():
-        # Calcular precios basados en pips si se especifican
-        sl_deferred = defer.succeed(None)
-        tp_deferred = defer.succeed(None)
+    El SL/TP se calcula una sola vez y se envía una
+    ProtoOANewOrderReq por cuenta, con el volumen escalado según el grupo.
+    Cada orden sale por la sesión de trading menos cargada en la que su
+    cuenta está autenticada, así que los límites de envío de varias
+    conexiones se suman.
+    
+    Args:
+        group_name: Nombre del grupo en ACCOUNT_GROUPS_FILE
+        symbol, side, volume, sl_pips, tp_pips: Como en send_market_order
+        timings: Diccionario opcional donde anotar los instantes de cada etapa
+        label: Etiqueta de las órdenes (ver build_market_order)
+        account_ids: Si se indica, solo se envía a estas cuentas del grupo
+            (al reejecutar una señal que ya llegó a algunas)
         
-        # Calcular precio de stop loss si se especifica y no es cero
-        if sl_pips is not None and sl_pips != 0:
-            sl_deferred = pips_to_price(symbol_id, float(sl_pips), side, is_sl=True)
+    Returns:
+        Un deferred que se resolverá con el resumen agregado:
+        {"group", "accounts", "filled", "failed", "results": [...]}
+    """
+    group = account_groups.get(group_name)
+    if group is None:
+        raise Exception(f"Grupo de cuentas desconocido: {group_name}")
+    if not pool.is_ready:
+        raise Exception("Cuenta no autorizada. No se puede enviar la orden.")
+    
+    symbol_id = symbols.id_of(symbol)
+    if symbol_id is None:
+        raise Exception(f"❌ El símbolo {symbol} no está en la lista local. Añádelo a SYMBOLS.")
+    
+    mark_timing(timings, "prices_started")
+    
+    def send_orders(stops):
+        mark_timing(timings, "prices_resolved")
+        allocations = group.allocations(volume)
+        if account_ids is not None:
+            allocations = [(account_id, v) for account_id, v in allocations if account_id in account_ids]
         
-        # Calcular precio de take profit si se especifica y no es cero
-        if tp_pips is not None and tp_pips != 0:
-            tp_deferred = pips_to_price(symbol_id, float(tp_pips), side, is_sl=False)
+        def send_one(account_id, account_volume):
+            trading = pool.trading_session(account_id)
+            if account_id not in trading.session.authorized_accounts:
+                return defer.fail(Exception(f"Cuenta {account_id} no autenticada"))
+            request = build_market_order(account_id, symbol_id, side, account_volume, stops, label=label)
+            return trading.send(request, timeout=10, until=is_final_execution)
         
-        # Esperar a que ambos cálculos terminen
-        def handle_prices(results):
-            sl_price, tp_price = results
-            send_order(sl_price, tp_price)
+        print(f"[cTrader] 👥 Enviando orden {side} para {symbol} a {len(allocations)} cuentas del grupo {group_name}")
+        mark_timing(timings, "order_sent")
+        sends = [send_one(account_id, account_volume) for account_id, account_volume in allocations]
         
-        def handle_error(failure):
-            print(f"[cTrader] ❌ Error calculando precios: {failure}")
-            result_deferred.errback(failure)
-            return failure
+        def aggregate(outcomes):
+            mark_timing(timings, "executed")
+            results = []
+            for (account_id, account_volume), (ok, value) in zip(allocations, outcomes):
+                result = {"account_id": account_id, "volume": account_volume, "status": "filled" if ok else "failed"}
+                if not ok:
+                    result["error"] = value.getErrorMessage()
+                results.append(result)
+            filled = sum(1 for r in results if r["status"] == "filled")
+            print(f"[cTrader] 👥 Grupo {group_name}: {filled}/{len(results)} órdenes ejecutadas")
+            return {
+                "status": "executed" if filled == len(results) else "partial" if filled else "failed",
+                "group": group_name,
+                "accounts": len(results),
+                "filled": filled,
+                "failed": len(results) - filled,
+                "message": f"{filled}/{len(results)} cuentas del grupo {group_name}",
+                "results": results,
+            }
         
-        # Combinar ambos deferreds
-        defer.gatherResults([sl_deferred, tp_deferred]).addCallbacks(handle_prices, handle_error)
+        return defer.DeferredList(sends, consumeErrors=True).addCallback(aggregate)
     
-    # Función para enviar la orden una vez calculados los precios
-    def send_order(sl_price=None, tp_price=None):
-        try:
-            # Configurar la orden
-            request = ProtoOANewOrderReq()
-            request.ctidTraderAccountId = ACCOUNT_ID
-            request.symbolId = symbol_id
-            request.orderType = ProtoOAOrderType.MARKET
-            
-            # Determinar el lado de la operación
-            if side.upper() == "BUY":
-                request.tradeSide = ProtoOATradeSide.BUY
-            elif side.upper() == "SELL":
-                request.tradeSide = ProtoOATradeSide.SELL
-            else:
-                raise ValueError(f"Lado de operación inválido: {side}. Debe ser 'BUY' o 'SELL'")
-            
-            # Convertir el volumen a centilotes (x100)
-            volume_in_centilotes = int(float(volume) * 100)
-            
-            # Asegurarnos de que el volumen sea al menos 1 centilote
-            if volume_in_centilotes < 1:
-                volume_in_centilotes = 1
-                print(f"[cTrader] ⚠️ Volumen ajustado al mínimo: 0.01 lotes (1 centilote)")
-            
-            request.volume = volume_in_centilotes
-            request.comment = "Order from TradingView Webhook"
-            
-            # Añadir stop loss si está calculado
-            if sl_price is not None:
-                request.stopLoss = sl_price
-                print(f"[cTrader] 🛑 Stop Loss establecido a {sl_price} ({sl_pips} pips)")
-            
-            # Añadir take profit si está calculado
-            if tp_price is not None:
-                request.takeProfit = tp_price
-                print(f"[cTrader] 🎯 Take Profit establecido a {tp_price} ({tp_pips} pips)")
-            
-            print(f"[cTrader] 🚀 Enviando orden {side} para {symbol} con volumen {volume} ({volume_in_centilotes} centilotes)")
-            
-            # Enviar la orden
-            order_deferred = client.send(request)
-            
-            def on_order_success(response):
-                print(f"[cTrader] ✅ Orden enviada correctamente: {response}")
-                result_deferred.callback(response)
-                return response
-            
-            def on_order_error(failure):
-                print(f"[cTrader] ❌ Error al enviar orden: {failure}")
-                result_deferred.errback(failure)
-                return failure
-            
-            order_deferred.addCallbacks(on_order_success, on_order_error)
-            
-        except Exception as e:
-            print(f"[cTrader] ❌ Error enviando orden: {str(e)}")
-            result_deferred.errback(e)
+    return resolve_sl_tp(symbol_id, side, sl_pips, tp_pips).addCallback(send_orders)
+
+def run_group_order(group_name, symbol, side, volume, sl_pips=None, tp_pips=None, timings=None, label=None, account_ids=None):
+    """
+    Función para ser llamada desde el webhook para replicar una orden en un
+    grupo de cuentas (ver send_group_order)
+    """
+    mark_timing(timings, "queued")
     
-    return result_deferred
+    if not pool.is_ready:
+        pool.start()
+    
+    def start_order(_=None):
+        mark_timing(timings, "dispatched")
+        return send_group_order(group_name, symbol, side, volume, sl_pips=sl_pips, tp_pips=tp_pips, timings=timings, label=label, account_ids=account_ids)
+    
+    if pool.is_ready:
+        return defer.maybeDeferred(start_order)
+    print(f"[cTrader] ⏳ Esperando a que la sesión esté lista (estado: {pool.state})...")
+    return pool.wait_ready(SESSION_READY_TIMEOUT).addCallback(start_order)
 
-def run_ctrader_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_color=None):
+def run_ctrader_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_color=None, timings=None, label=None):
     """
     Función para ser llamada desde el webhook para ejecutar una orden
     
@@ -843,28 +1018,39 @@ def run_ctrader_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_c
         sl_pips: Stop loss en pips (opcional)
         tp_pips: Take profit en pips (opcional)
         candle_color: Color de la vela ("GREEN" o "RED")
+        timings: Diccionario opcional donde se anotan (con time.perf_counter)
+            los instantes queued, dispatched, prices_started, prices_resolved,
+            order_sent y executed
+        label: Etiqueta de la orden (ver build_market_order)
     """
-    global client, account_authorized, connection_ready
+    mark_timing(timings, "queued")
     
     # Creamos un nuevo deferred para el resultado de esta operación
     result_deferred = defer.Deferred()
     
     try:
-        # Inicializar cliente si no existe
-        if client is None:
-            client, connection_ready = initialize_client()
+        # Arrancar la sesión si el webhook no lo ha hecho al iniciar
+        if not pool.is_ready:
+            pool.start()
+        
+        # Función que ejecuta la orden cuando le llega el turno en la cola del símbolo
+        def start_order():
+            mark_timing(timings, "dispatched")
+            return send_market_order(
+                symbol, 
+                side, 
+                volume, 
+                sl_pips=sl_pips, 
+                tp_pips=tp_pips, 
+                candle_color=candle_color,
+                timings=timings,
+                label=label
+            )
         
-        # Función que envía la orden cuando la conexión está lista
         def send_order_when_ready(_=None):
             try:
-                order_deferred = send_market_order(
-                    symbol, 
-                    side, 
-                    volume, 
-                    sl_pips=sl_pips, 
-                    tp_pips=tp_pips, 
-                    candle_color=candle_color
-                )
+                # Las órdenes del mismo símbolo esperan a que termine la anterior
+                order_deferred = order_queue.run(symbol, start_order)
                 
                 def on_success(response):
                     if not result_deferred.called:
@@ -885,19 +1071,18 @@ def run_ctrader_order(symbol, side, volume, sl_pips=None, tp_pips=None, candle_c
         
         # Función para manejar errores de conexión
         def on_connection_error(error):
-            print(f"[cTrader] ❌ Error de conexión: {error}")
+            print(f"[cTrader] ❌ Error de conexión: {error.getErrorMessage()}")
             if not result_deferred.called:
                 result_deferred.errback(error)
-            return error
+            return None
         
-        # Si la conexión ya está lista y la cuenta está autorizada
-        if connection_ready.called and account_authorized:
+        # Si la sesión ya está lista
+        if pool.is_ready:
             reactor.callLater(0, send_order_when_ready)
-        # Si la conexión no está lista aún
+        # Si no, esperar como mucho SESSION_READY_TIMEOUT segundos
         else:
-            print("[cTrader] ⏳ Esperando a que la conexión esté lista...")
-            connection_ready.addCallback(send_order_when_ready)
-            connection_ready.addErrback(on_connection_error)
+            print(f"[cTrader] ⏳ Esperando a que la sesión esté lista (estado: {pool.state})...")
+            pool.wait_ready(SESSION_READY_TIMEOUT).addCallbacks(send_order_when_ready, on_connection_error)
         
         return result_deferred
     
@@ -1,8 +1,15 @@
 import os
 import time
 from dotenv import load_dotenv
-from ctrader_open_api import Client, Protobuf, EndPoints, TcpProtocol
+from ctrader_open_api import Client, Protobuf, EndPoints
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAExecutionEvent, ProtoOAErrorRes, ProtoOASpotEvent
 from twisted.internet import reactor, defer
+from message_router import MessageRouter
+from rate_limiter import RateLimiter, ImmediateTcpProtocol, NON_TRADING_REQUESTS
+from symbol_registry import SymbolRegistry
+from symbol_table import SymbolTableWatcher
+from price_book import PriceBook
+from money_converter import MoneyConverter, RELATIVE_SCALE
 
 load_dotenv()
 
@@ -22,11 +29,62 @@ ACCESS_TOKEN = os.getenv("CTRADER_ACCESS_TOKEN")
 REFRESH_TOKEN = os.getenv("CTRADER_REFRESH_TOKEN")
 ACCOUNT_ID = int(os.getenv("ACCOUNT_ID"))
 
+# Servidor de la API (por defecto la demo; ctrader_simulator.py para pruebas sin red)
+CTRADER_HOST = os.getenv("CTRADER_HOST", EndPoints.PROTOBUF_DEMO_HOST)
+CTRADER_PORT = int(os.getenv("CTRADER_PORT", EndPoints.PROTOBUF_PORT))
+
+# Tabla binaria con el catálogo completo de símbolos (generada por list_symbols.py)
+SYMBOL_TABLE_FILE = os.getenv("SYMBOL_TABLE_FILE", "symbols.bin")
+
+# Segundos que se espera el primer precio de los símbolos de conversión de divisa
+CONVERSION_PRICE_TIMEOUT = float(os.getenv("CONVERSION_PRICE_TIMEOUT", "5"))
+
+# Límite de mensajes de la conexión (la API admite 50/s) y límite aparte para
+# metadatos y market data, para que nunca agoten el margen de las órdenes
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", 45))
+RATE_LIMIT_NON_TRADING_PER_SECOND = float(os.getenv("RATE_LIMIT_NON_TRADING_PER_SECOND", 25))
+
 # Cliente global
 client = None
+# Los mensajes salen en el momento (ImmediateTcpProtocol) al ritmo que marca
+# el limitador, en vez de en lotes de 5 por segundo de la librería
+limiter = RateLimiter(
+    RATE_LIMIT_PER_SECOND,
+    class_limits={NON_TRADING_REQUESTS: (RATE_LIMIT_NON_TRADING_PER_SECOND, RATE_LIMIT_NON_TRADING_PER_SECOND)}
+)
 account_authorized = False
 connection_ready = defer.Deferred()
 
+# Registro de símbolos con índices nombre→id e id→nombre
+symbols = SymbolRegistry(SYMBOLS)
+
+# Conversión de SL/TP en dinero a distancias: datos de símbolos y cadenas de
+# conversión en caché y tipos de cambio en vivo desde los spots
+price_book = PriceBook()
+money_converter = MoneyConverter(price_book)
+light_symbols = {}  # {symbolId: (baseAssetId, quoteAssetId)}
+price_waiters = {}  # {symbolId: [deferreds esperando el primer precio]}
+# Las cargas se hacen de una en una para no repetir peticiones ni suscripciones
+money_conversion_lock = defer.DeferredLock()
+
+# payloadType de los mensajes que se procesan al recibirlos, calculados una sola vez
+SPOT_EVENT = ProtoOASpotEvent().payloadType
+EXECUTION_EVENT = ProtoOAExecutionEvent().payloadType
+ERROR_RES = ProtoOAErrorRes().payloadType
+
+# Tabla payloadType → manejadores de los mensajes recibidos (ver on_message_received)
+message_router = MessageRouter()
+
+def on_symbol_table_loaded(table):
+    """Incorpora el catálogo de la tabla binaria al registro de símbolos"""
+    # Los símbolos definidos en SYMBOLS tienen prioridad sobre la tabla
+    symbols.load({**table.as_dict(), **SYMBOLS})
+    print(f"[cTrader] 📚 Tabla de símbolos cargada: {len(table)} símbolos")
+
+# Carga la tabla ya y la recarga si list_symbols.py la regenera
+symbol_table_watcher = SymbolTableWatcher(SYMBOL_TABLE_FILE, on_symbol_table_loaded)
+symbol_table_watcher.start()
+
 def initialize_client():
     """
     Inicializa y retorna un cliente cTrader
@@ -49,9 +107,9 @@ def initialize_client():
         
         # Crear cliente usando el protocolo correcto
         client = Client(
-            EndPoints.PROTOBUF_DEMO_HOST, 
-            EndPoints.PROTOBUF_PORT, 
-            TcpProtocol
+            CTRADER_HOST, 
+            CTRADER_PORT, 
+            ImmediateTcpProtocol
         )
         # Configuramos los callbacks básicos
         client.setConnectedCallback(on_connected)
@@ -72,7 +130,7 @@ def on_connected(client_instance):
     request = ProtoOAApplicationAuthReq()
     request.clientId = CLIENT_ID
     request.clientSecret = CLIENT_SECRET
-    deferred = client_instance.send(request)
+    deferred = send_limited(request, client_instance)
     deferred.addCallback(on_app_auth_success)
     deferred.addErrback(on_error)
 
@@ -86,7 +144,7 @@ def on_app_auth_success(response):
     request = ProtoOAAccountAuthReq()
     request.ctidTraderAccountId = ACCOUNT_ID
     request.accessToken = ACCESS_TOKEN
-    deferred = client.send(request)
+    deferred = send_limited(request)
     deferred.addCallback(on_account_auth_success)
     deferred.addErrback(on_error)
     
@@ -103,6 +161,13 @@ def on_account_auth_success(response):
     if not connection_ready.called:
         connection_ready.callback(None)
     
+    # Precargar la conversión de dinero de los símbolos conocidos (y
+    # renovar las suscripciones de spots, que no sobreviven a una reconexión)
+    def on_conversion_error(failure):
+        print(f"[cTrader] ⚠️ No se pudo preparar la conversión de dinero a pips: {failure.getErrorMessage()}")
+    
+    ensure_money_conversion(list(SYMBOLS.values())).addErrback(on_conversion_error)
+    
     return response
 
 def on_disconnected(client_instance, reason):
@@ -111,6 +176,7 @@ def on_disconnected(client_instance, reason):
     
     print(f"[cTrader] ❌ Desconectado: {reason}")
     account_authorized = False
+    price_book.subscribed.clear()
     
     # Reiniciar el deferred para la próxima conexión
     if connection_ready.called:
@@ -120,26 +186,36 @@ def on_disconnected(client_instance, reason):
     reactor.callLater(5, initialize_client)
 
 def on_message_received(client_instance, message):
-    """Callback para procesar mensajes recibidos"""
-    from ctrader_open_api import Protobuf
-    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAExecutionEvent, ProtoOAErrorRes
-    
-    # Procesar mensajes de error
-    if message.payloadType == ProtoOAErrorRes().payloadType:
-        error_event = Protobuf.extract(message)
-        print(f"[cTrader] ⚠️ Error recibido: {error_event}")
-        
-        # Si el error es de autorización, intentar reautenticar
-        if "not authorized" in str(error_event).lower():
-            print("[cTrader] 🔄 Reiniciando autenticación debido a error de autorización...")
-            global account_authorized
-            account_authorized = False
-            on_connected(client)
-    
-    # Procesar mensajes de ejecución
-    elif message.payloadType == ProtoOAExecutionEvent().payloadType:
-        execution_event = Protobuf.extract(message)
-        print(f"[cTrader] ✅ Evento de ejecución recibido: {execution_event}")
+    """Callback para procesar mensajes recibidos (ver message_router)"""
+    message_router.route(client_instance, message)
+
+def on_spot_event(client_instance, spot):
+    """Los spots solo actualizan el libro de precios (tipos de cambio)"""
+    price_book.update_from_spot(spot)
+    if spot.symbolId in price_waiters and price_book.quote(spot.symbolId) is not None:
+        for waiter in price_waiters.pop(spot.symbolId):
+            # Los que agotaron el tiempo de espera ya están cancelados
+            if not waiter.called:
+                waiter.callback(None)
+
+def on_error_res(client_instance, error_event):
+    """Procesa mensajes de error"""
+    print(f"[cTrader] ⚠️ Error recibido: {error_event}")
+    
+    # Si el error es de autorización, intentar reautenticar
+    if "not authorized" in str(error_event).lower():
+        print("[cTrader] 🔄 Reiniciando autenticación debido a error de autorización...")
+        global account_authorized
+        account_authorized = False
+        on_connected(client)
+
+def on_execution_event(client_instance, execution_event):
+    """Procesa mensajes de ejecución"""
+    print(f"[cTrader] ✅ Evento de ejecución recibido: {execution_event}")
+
+message_router.register(SPOT_EVENT, on_spot_event)
+message_router.register(ERROR_RES, on_error_res)
+message_router.register(EXECUTION_EVENT, on_execution_event)
 
 def on_error(failure):
     """Callback para manejar errores"""
@@ -171,13 +247,13 @@ def send_market_order(symbol, side, volume, sl_money=0, tp_money=0):
     deferred = defer.Deferred()
     
     try:
-        # Obtener el symbolId del diccionario SYMBOLS o usar un valor predeterminado
-        symbol_id = SYMBOLS.get(symbol)
+        # Obtener el symbolId del registro (SYMBOLS + tabla de símbolos)
+        symbol_id = symbols.id_of(symbol)
         if not symbol_id:
-            raise ValueError(f"Symbol ID not found for {symbol}. Add it to the SYMBOLS dictionary.")
+            raise ValueError(f"Symbol ID not found for {symbol}. Add it to the SYMBOLS dictionary or run list_symbols.py.")
         
         # Convertir el lado de la operación al formato adecuado
-        from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoOATradeSide
+        from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOATradeSide
         trade_side = ProtoOATradeSide.BUY if side == "BUY" else ProtoOATradeSide.SELL
         
         # Crear la solicitud de nueva orden
@@ -194,17 +270,26 @@ def send_market_order(symbol, side, volume, sl_money=0, tp_money=0):
         request.tradeSide = trade_side
         request.volume = volume_in_units
         
-        # Añadir SL/TP si están presentes
-        if sl_money > 0:
-            request.stopLossInPips = convert_money_to_pips(symbol, sl_money, trade_side)
+        def send_order(_=None):
+            # Añadir SL/TP si están presentes, como distancias relativas al
+            # precio de ejecución (el dinero se convierte con datos en caché)
+            if sl_money > 0:
+                request.relativeStopLoss = convert_money_to_distance(symbol_id, sl_money, request.volume, round_down=True)
             
-        if tp_money > 0:
-            request.takeProfitInPips = convert_money_to_pips(symbol, tp_money, trade_side)
-        
-        print(f"[cTrader] 📊 Enviando orden de mercado: {request}")
+            if tp_money > 0:
+                request.relativeTakeProfit = convert_money_to_distance(symbol_id, tp_money, request.volume)
+            
+            print(f"[cTrader] 📊 Enviando orden de mercado: {request}")
+            
+            # Enviar la orden a través del cliente de cTrader
+            return send_limited(request)
         
-        # Enviar la orden a través del cliente de cTrader
-        order_deferred = client.send(request)
+        # Solo la primera orden de un símbolo espera a cargar sus datos de conversión
+        if (sl_money > 0 or tp_money > 0) and not money_conversion_ready(symbol_id):
+            order_deferred = ensure_money_conversion([symbol_id])
+            order_deferred.addCallback(send_order)
+        else:
+            order_deferred = send_order()
         order_deferred.addCallback(on_order_sent)
         order_deferred.addErrback(on_order_error)
         order_deferred.chainDeferred(deferred)
@@ -215,15 +300,163 @@ def send_market_order(symbol, side, volume, sl_money=0, tp_money=0):
     
     return deferred
 
-def convert_money_to_pips(symbol, money_amount, trade_side):
+def convert_money_to_distance(symbol_id, money_amount, volume, round_down=False):
     """
-    Función auxiliar para convertir dinero a pips
-    Esta es una implementación simplificada - en un caso real
-    necesitarías obtener el precio actual y hacer cálculos más precisos
+    Convierte un importe en la divisa de la cuenta en la distancia de precio
+    (en 1/100000) a la que la posición gana o pierde ese importe
+    
+    Usa los dígitos y la cadena de conversión en caché y el último precio
+    de los símbolos de la cadena, sin peticiones de red.
+    
+    Raises:
+        ConversionUnavailable: Si aún no hay datos o precios para convertir
+    """
+    distance = money_converter.relative_distance(symbol_id, money_amount, volume, round_down)
+    print(f"[cTrader] 💱 {money_amount} → {distance / RELATIVE_SCALE} de distancia de precio ({symbols.name_of(symbol_id) or symbol_id})")
+    return distance
+
+def money_conversion_ready(symbol_id):
+    """Indica si ya están en caché los datos para convertir dinero en el símbolo"""
+    if not money_converter.has_symbol(symbol_id) or not money_converter.has_chain(money_converter.quote_asset(symbol_id)):
+        return False
+    return all(
+        conversion_id in price_book.subscribed and price_book.quote(conversion_id) is not None
+        for conversion_id in money_converter.conversion_symbol_ids()
+    )
+
+def send_limited(request, client_instance=None):
+    """
+    Envía una petición a través del limitador de mensajes
+    
+    Returns:
+        Deferred con el ProtoMessage de respuesta (sin extraer)
     """
-    # Implementación simple - reemplazar con lógica real
-    # Esta es solo una aproximación, lo ideal sería obtener el precio actual
-    return int(money_amount * 10)  # Ejemplo: 1€ = 10 pips
+    target = client_instance if client_instance is not None else client
+    return limiter.submit(request, lambda: target.send(request))
+
+def send_request(request):
+    """
+    Envía una petición y devuelve un deferred con la respuesta extraída
+    (los ProtoOAErrorRes se convierten en errores)
+    """
+    def extract(message):
+        response = Protobuf.extract(message)
+        if message.payloadType == ERROR_RES:
+            raise Exception(f"{response.errorCode}: {response.description}")
+        return response
+    
+    return send_limited(request).addCallback(extract)
+
+def ensure_money_conversion(symbol_ids):
+    """
+    Carga en caché lo necesario para convertir dinero en distancias de SL/TP
+    en los símbolos indicados: divisa de la cuenta, dígitos y divisa de
+    cotización de cada símbolo, cadenas de conversión hasta la divisa de la
+    cuenta y suscripción a los spots de esas cadenas
+    
+    Solo pide lo que falta, así que tras la primera llamada no hace
+    peticiones (salvo renovar suscripciones tras una reconexión).
+    
+    Returns:
+        Deferred que se resuelve cuando todo está cargado
+    """
+    from ctrader_open_api.messages.OpenApiMessages_pb2 import (
+        ProtoOATraderReq, ProtoOASymbolsListReq, ProtoOASymbolByIdReq,
+        ProtoOASymbolsForConversionReq, ProtoOASubscribeSpotsReq
+    )
+    
+    def load_deposit_asset(_):
+        if money_converter.deposit_asset_id is not None:
+            return None
+        request = ProtoOATraderReq()
+        request.ctidTraderAccountId = ACCOUNT_ID
+        
+        def on_trader(response):
+            money_converter.deposit_asset_id = response.trader.depositAssetId
+        
+        return send_request(request).addCallback(on_trader)
+    
+    def load_light_symbols(_):
+        if all(symbol_id in light_symbols for symbol_id in symbol_ids):
+            return None
+        request = ProtoOASymbolsListReq()
+        request.ctidTraderAccountId = ACCOUNT_ID
+        
+        def on_symbols(response):
+            for symbol in response.symbol:
+                light_symbols[symbol.symbolId] = (symbol.baseAssetId, symbol.quoteAssetId)
+        
+        return send_request(request).addCallback(on_symbols)
+    
+    def load_symbols(_):
+        missing = [symbol_id for symbol_id in symbol_ids if not money_converter.has_symbol(symbol_id)]
+        if not missing:
+            return None
+        for symbol_id in missing:
+            if symbol_id not in light_symbols:
+                raise ValueError(f"El símbolo {symbol_id} no existe en la cuenta {ACCOUNT_ID}")
+        request = ProtoOASymbolByIdReq()
+        request.ctidTraderAccountId = ACCOUNT_ID
+        request.symbolId.extend(missing)
+        
+        def on_symbols(response):
+            for symbol in response.symbol:
+                money_converter.set_symbol(symbol.symbolId, symbol.digits, light_symbols[symbol.symbolId][1])
+        
+        return send_request(request).addCallback(on_symbols)
+    
+    def load_chains(_):
+        deferreds = []
+        quote_assets = {money_converter.quote_asset(symbol_id) for symbol_id in symbol_ids}
+        for quote_asset_id in quote_assets:
+            if money_converter.has_chain(quote_asset_id):
+                continue
+            request = ProtoOASymbolsForConversionReq()
+            request.ctidTraderAccountId = ACCOUNT_ID
+            request.firstAssetId = quote_asset_id
+            request.lastAssetId = money_converter.deposit_asset_id
+            
+            def on_chain(response, quote_asset_id=quote_asset_id):
+                money_converter.set_chain(quote_asset_id, response.symbol)
+            
+            deferreds.append(send_request(request).addCallback(on_chain))
+        return defer.gatherResults(deferreds, consumeErrors=True)
+    
+    def subscribe_spots(_):
+        missing = [symbol_id for symbol_id in money_converter.conversion_symbol_ids() if symbol_id not in price_book.subscribed]
+        if not missing:
+            return None
+        request = ProtoOASubscribeSpotsReq()
+        request.ctidTraderAccountId = ACCOUNT_ID
+        request.symbolId.extend(missing)
+        
+        def on_subscribed(response):
+            price_book.subscribed.update(missing)
+            print(f"[cTrader] 💱 Suscrito a {len(missing)} símbolos de conversión de divisa")
+        
+        return send_request(request).addCallback(on_subscribed)
+    
+    def wait_for_prices(_):
+        # Tras suscribirse, el primer spot de cada símbolo llega por separado
+        deferreds = []
+        for symbol_id in money_converter.conversion_symbol_ids():
+            if price_book.quote(symbol_id) is None:
+                waiter = defer.Deferred()
+                price_waiters.setdefault(symbol_id, []).append(waiter)
+                deferreds.append(waiter)
+        return defer.gatherResults(deferreds, consumeErrors=True).addTimeout(CONVERSION_PRICE_TIMEOUT, reactor)
+    
+    def load():
+        d = defer.succeed(None)
+        d.addCallback(load_deposit_asset)
+        d.addCallback(load_light_symbols)
+        d.addCallback(load_symbols)
+        d.addCallback(load_chains)
+        d.addCallback(subscribe_spots)
+        d.addCallback(wait_for_prices)
+        return d
+    
+    return money_conversion_lock.run(load)
 
 def on_order_sent(response):
     """Callback después de enviar una orden"""
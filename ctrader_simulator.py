@@ -0,0 +1,517 @@
+import time
+import random
+import argparse
+from collections import deque
+from twisted.internet import reactor, protocol, task, ssl
+from twisted.protocols.basic import Int32StringReceiver
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage, ProtoHeartbeatEvent
+from ctrader_open_api.messages.OpenApiMessages_pb2 import (
+    ProtoOAApplicationAuthReq, ProtoOAApplicationAuthRes,
+    ProtoOAAccountAuthReq, ProtoOAAccountAuthRes,
+    ProtoOATraderReq, ProtoOATraderRes,
+    ProtoOASymbolsListReq, ProtoOASymbolsListRes,
+    ProtoOASymbolByIdReq, ProtoOASymbolByIdRes,
+    ProtoOASymbolsForConversionReq, ProtoOASymbolsForConversionRes,
+    ProtoOASubscribeSpotsReq, ProtoOASubscribeSpotsRes,
+    ProtoOAUnsubscribeSpotsReq, ProtoOAUnsubscribeSpotsRes,
+    ProtoOANewOrderReq, ProtoOAClosePositionReq,
+    ProtoOAReconcileReq, ProtoOAReconcileRes,
+    ProtoOAExecutionEvent, ProtoOASpotEvent, ProtoOAErrorRes,
+)
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import (
+    ProtoOAExecutionType, ProtoOAPositionStatus, ProtoOAOrderStatus, ProtoOADealStatus, ProtoOATradeSide
+)
+
+# Los precios de la API van en 1/100000
+PRICE_SCALE = 100000
+
+# Divisa de las cuentas simuladas (activos: 1 EUR, 2 USD, 3 XAU, 4 BTC, 5 ETH)
+DEPOSIT_ASSET_ID = 2
+
+# Peticiones sobre las que se aplica error_rate (las de trading)
+TRADING_PAYLOAD_TYPES = frozenset([ProtoOANewOrderReq().payloadType, ProtoOAClosePositionReq().payloadType])
+
+
+class SimulatedSymbol:
+    """Símbolo del simulador con su precio actual"""
+
+    def __init__(self, symbol_id, name, digits, pip_position, base_asset_id, quote_asset_id, bid, spread):
+        self.symbol_id = symbol_id
+        self.name = name
+        self.digits = digits
+        self.pip_position = pip_position
+        self.base_asset_id = base_asset_id
+        self.quote_asset_id = quote_asset_id
+        self.bid = bid
+        self.spread = spread
+
+    @property
+    def ask(self):
+        return round(self.bid + self.spread, self.digits)
+
+
+def default_symbols():
+    """Símbolos por defecto, con los mismos IDs que SYMBOLS en ctrader*.py"""
+    return {
+        1: SimulatedSymbol(1, "EURUSD", 5, 4, 1, 2, 1.10000, 0.00002),
+        41: SimulatedSymbol(41, "XAUUSD", 2, 1, 3, 2, 2400.00, 0.30),
+        22395: SimulatedSymbol(22395, "BTCUSD", 2, 0, 4, 2, 60000.00, 15.00),
+        22397: SimulatedSymbol(22397, "ETHUSD", 2, 0, 5, 2, 3000.00, 1.50),
+    }
+
+
+class SimulatorProtocol(Int32StringReceiver):
+    """
+    Una conexión de cliente: recibe ProtoMessage con el mismo marco que
+    TcpProtocol (longitud de 4 bytes + mensaje) y contesta con la latencia
+    configurada en el servidor
+    """
+
+    MAX_LENGTH = 15000000
+
+    def connectionMade(self):
+        self.app_authorized = False
+        self.accounts = set()
+        self.spots = set()  # {(ctidTraderAccountId, symbolId)}
+        self.factory.clients.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.clients.discard(self)
+
+    def stringReceived(self, data):
+        message = ProtoMessage()
+        message.ParseFromString(data)
+        # Los heartbeats del cliente no llevan respuesta
+        if message.payloadType == ProtoHeartbeatEvent().payloadType:
+            return
+        self.factory.handle_request(self, message)
+
+    def send(self, payload, client_msg_id=None):
+        """Envía un mensaje protobuf enmarcado como lo hace la API"""
+        if not self.connected:
+            return
+        message = ProtoMessage(payloadType=payload.payloadType, payload=payload.SerializeToString())
+        if client_msg_id:
+            message.clientMsgId = client_msg_id
+        self.sendString(message.SerializeToString())
+        self.factory.sent += 1
+
+
+class SimulatedServer(protocol.Factory):
+    """
+    Servidor local que sustituye a la API de cTrader en pruebas y benchmarks.
+
+    Habla el mismo protocolo que EndPoints.PROTOBUF_DEMO_HOST (ProtoMessage
+    sobre TLS con marco Int32) y responde a la autenticación, los metadatos
+    de símbolos, las suscripciones a spots, las órdenes de mercado, los
+    cierres y la reconciliación, con latencia configurable, errores
+    inyectados y un feed de ticks sintético. Con la misma semilla, los
+    precios, latencias y errores se repiten de una ejecución a otra.
+    """
+
+    protocol = SimulatorProtocol
+
+    def __init__(self, symbols=None, latency=0.0, jitter=0.0, error_rate=0.0, error_code="NOT_ENOUGH_MONEY",
+                 tick_interval=0.0, volatility=1.0, seed=None, client_id=None, client_secret=None,
+                 access_token=None, deposit_asset_id=DEPOSIT_ASSET_ID, clock=reactor):
+        """
+        Args:
+            symbols: {symbolId: SimulatedSymbol} (por defecto default_symbols())
+            latency: Segundos hasta responder a cada petición
+            jitter: Segundos aleatorios (uniforme 0..jitter) sumados a latency
+            error_rate: Probabilidad de rechazar una orden o un cierre
+            error_code: errorCode de los rechazos de error_rate
+            tick_interval: Segundos entre ticks del feed sintético (0 sin feed)
+            volatility: Desplazamiento máximo de cada tick, en pips
+            seed: Semilla de precios, latencias y errores
+            client_id, client_secret, access_token: Credenciales aceptadas
+                (None para aceptar cualquiera)
+            deposit_asset_id: Divisa de las cuentas
+        """
+        self.symbols = symbols if symbols is not None else default_symbols()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.tick_interval = tick_interval
+        self.volatility = volatility
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.access_token = access_token
+        self.deposit_asset_id = deposit_asset_id
+        self._clock = clock
+        self._random = random.Random(seed)
+        self._ids = iter(range(1, 2 ** 62))
+        self._injected = {}  # {payloadType: deque de errorCode}
+        self._tick_task = None
+        self._listening = None
+
+        self.clients = set()
+        self.positions = {}  # {ctidTraderAccountId: {positionId: posición}}
+        self.requests = {}  # {payloadType: peticiones recibidas}
+        self.sent = 0
+        self.errors = 0
+        self.ticks = 0
+
+        self.handlers = {
+            ProtoOAApplicationAuthReq().payloadType: self.on_application_auth,
+            ProtoOAAccountAuthReq().payloadType: self.on_account_auth,
+            ProtoOATraderReq().payloadType: self.on_trader,
+            ProtoOASymbolsListReq().payloadType: self.on_symbols_list,
+            ProtoOASymbolByIdReq().payloadType: self.on_symbol_by_id,
+            ProtoOASymbolsForConversionReq().payloadType: self.on_symbols_for_conversion,
+            ProtoOASubscribeSpotsReq().payloadType: self.on_subscribe_spots,
+            ProtoOAUnsubscribeSpotsReq().payloadType: self.on_unsubscribe_spots,
+            ProtoOANewOrderReq().payloadType: self.on_new_order,
+            ProtoOAClosePositionReq().payloadType: self.on_close_position,
+            ProtoOAReconcileReq().payloadType: self.on_reconcile,
+        }
+
+    def listen(self, port=0, interface="127.0.0.1", tls=True):
+        """
+        Empieza a aceptar conexiones y arranca el feed de ticks
+
+        Args:
+            port: Puerto (0 para uno libre)
+            tls: Servir TLS con un certificado autofirmado; el Client de
+                ctrader_open_api siempre conecta por "ssl:" sin verificar el
+                certificado
+
+        Returns:
+            El puerto en el que escucha
+        """
+        if tls:
+            certificate = ssl.KeyPair.generate(size=2048).selfSignedCert(1, CN="localhost")
+            self._listening = self._clock.listenSSL(port, self, certificate.options(), interface=interface)
+        else:
+            self._listening = self._clock.listenTCP(port, self, interface=interface)
+        if self.tick_interval > 0:
+            self._tick_task = task.LoopingCall(self.tick)
+            self._tick_task.clock = self._clock
+            self._tick_task.start(self.tick_interval, now=False)
+        return self._listening.getHost().port
+
+    def stop(self):
+        if self._tick_task is not None and self._tick_task.running:
+            self._tick_task.stop()
+        for client in list(self.clients):
+            client.transport.loseConnection()
+        if self._listening is not None:
+            return self._listening.stopListening()
+
+    def inject_error(self, payload_type, error_code, count=1):
+        """Rechaza las próximas count peticiones de un tipo con error_code"""
+        self._injected.setdefault(payload_type, deque()).extend([error_code] * count)
+
+    def set_price(self, symbol_id, bid):
+        """Fija el precio de un símbolo y lo publica a los suscritos"""
+        symbol = self.symbols[symbol_id]
+        symbol.bid = round(bid, symbol.digits)
+        self._publish(symbol)
+
+    def open_position(self, account_id, symbol_id, trade_side, volume, label=""):
+        """
+        Abre una posición sin orden, como una que ya estaba abierta antes
+        de que el cliente conectara
+
+        Returns:
+            El diccionario de la posición
+        """
+        symbol = self.symbols[symbol_id]
+        position = {
+            "position_id": next(self._ids),
+            "symbol_id": symbol_id,
+            "trade_side": trade_side,
+            "volume": volume,
+            "price": symbol.ask if trade_side == ProtoOATradeSide.BUY else symbol.bid,
+            "label": label,
+            "stop_loss": None,
+            "take_profit": None,
+        }
+        self.positions.setdefault(account_id, {})[position["position_id"]] = position
+        return position
+
+    def handle_request(self, client, message):
+        """Atiende una petición tras la latencia simulada"""
+        self.requests[message.payloadType] = self.requests.get(message.payloadType, 0) + 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            self._clock.callLater(delay, self._handle, client, message)
+        else:
+            self._handle(client, message)
+
+    def _handle(self, client, message):
+        client_msg_id = message.clientMsgId if message.HasField("clientMsgId") else None
+        request = Protobuf.extract(message)
+
+        handler = self.handlers.get(message.payloadType)
+        if handler is None:
+            return self._error(client, client_msg_id, "UNSUPPORTED_MESSAGE", f"Mensaje {message.payloadType} no simulado")
+
+        injected = self._injected.get(message.payloadType)
+        if injected:
+            return self._error(client, client_msg_id, injected.popleft(), "Error inyectado", request)
+        if message.payloadType in TRADING_PAYLOAD_TYPES and self._random.random() < self.error_rate:
+            return self._error(client, client_msg_id, self.error_code, "Error simulado", request)
+
+        account_id = getattr(request, "ctidTraderAccountId", None)
+        if account_id is not None and message.payloadType != ProtoOAAccountAuthReq().payloadType and account_id not in client.accounts:
+            return self._error(client, client_msg_id, "INVALID_REQUEST", "Trading account is not authorized", request)
+
+        handler(client, client_msg_id, request)
+
+    def _error(self, client, client_msg_id, error_code, description, request=None):
+        self.errors += 1
+        response = ProtoOAErrorRes(errorCode=error_code, description=description)
+        if request is not None and getattr(request, "ctidTraderAccountId", None):
+            response.ctidTraderAccountId = request.ctidTraderAccountId
+        client.send(response, client_msg_id)
+
+    def on_application_auth(self, client, client_msg_id, request):
+        if self.client_id is not None and (request.clientId, request.clientSecret) != (self.client_id, self.client_secret):
+            return self._error(client, client_msg_id, "CH_CLIENT_AUTH_FAILURE", "Credenciales de aplicación inválidas")
+        client.app_authorized = True
+        client.send(ProtoOAApplicationAuthRes(), client_msg_id)
+
+    def on_account_auth(self, client, client_msg_id, request):
+        if not client.app_authorized:
+            return self._error(client, client_msg_id, "CH_CLIENT_NOT_AUTHENTICATED", "Aplicación no autenticada")
+        if self.access_token is not None and request.accessToken != self.access_token:
+            return self._error(client, client_msg_id, "CH_ACCESS_TOKEN_INVALID", "Access token inválido")
+        client.accounts.add(request.ctidTraderAccountId)
+        self.positions.setdefault(request.ctidTraderAccountId, {})
+        client.send(ProtoOAAccountAuthRes(ctidTraderAccountId=request.ctidTraderAccountId), client_msg_id)
+
+    def on_trader(self, client, client_msg_id, request):
+        response = ProtoOATraderRes(ctidTraderAccountId=request.ctidTraderAccountId)
+        response.trader.ctidTraderAccountId = request.ctidTraderAccountId
+        response.trader.balance = 10000 * 100
+        response.trader.depositAssetId = self.deposit_asset_id
+        response.trader.moneyDigits = 2
+        client.send(response, client_msg_id)
+
+    def on_symbols_list(self, client, client_msg_id, request):
+        response = ProtoOASymbolsListRes(ctidTraderAccountId=request.ctidTraderAccountId)
+        for symbol in self.symbols.values():
+            self._light_symbol(response.symbol.add(), symbol)
+        client.send(response, client_msg_id)
+
+    def on_symbol_by_id(self, client, client_msg_id, request):
+        response = ProtoOASymbolByIdRes(ctidTraderAccountId=request.ctidTraderAccountId)
+        for symbol_id in request.symbolId:
+            symbol = self.symbols.get(symbol_id)
+            if symbol is None:
+                continue
+            entry = response.symbol.add()
+            entry.symbolId = symbol_id
+            entry.digits = symbol.digits
+            entry.pipPosition = symbol.pip_position
+            entry.lotSize = 100 * PRICE_SCALE
+            entry.minVolume = 1
+            entry.stepVolume = 1
+        client.send(response, client_msg_id)
+
+    def on_symbols_for_conversion(self, client, client_msg_id, request):
+        chain = self._conversion_chain(request.firstAssetId, request.lastAssetId)
+        if chain is None:
+            return self._error(client, client_msg_id, "SYMBOL_NOT_FOUND", "Sin cadena de conversión", request)
+        response = ProtoOASymbolsForConversionRes(ctidTraderAccountId=request.ctidTraderAccountId)
+        for symbol in chain:
+            self._light_symbol(response.symbol.add(), symbol)
+        client.send(response, client_msg_id)
+
+    def on_subscribe_spots(self, client, client_msg_id, request):
+        for symbol_id in request.symbolId:
+            if symbol_id not in self.symbols:
+                return self._error(client, client_msg_id, "SYMBOL_NOT_FOUND", f"Símbolo {symbol_id} no encontrado", request)
+        client.send(ProtoOASubscribeSpotsRes(ctidTraderAccountId=request.ctidTraderAccountId), client_msg_id)
+        # Como la API, publicar enseguida el precio actual de cada símbolo
+        for symbol_id in request.symbolId:
+            client.spots.add((request.ctidTraderAccountId, symbol_id))
+            self._send_spot(client, request.ctidTraderAccountId, self.symbols[symbol_id])
+
+    def on_unsubscribe_spots(self, client, client_msg_id, request):
+        for symbol_id in request.symbolId:
+            client.spots.discard((request.ctidTraderAccountId, symbol_id))
+        client.send(ProtoOAUnsubscribeSpotsRes(ctidTraderAccountId=request.ctidTraderAccountId), client_msg_id)
+
+    def on_new_order(self, client, client_msg_id, request):
+        symbol = self.symbols.get(request.symbolId)
+        if symbol is None:
+            return self._error(client, client_msg_id, "SYMBOL_NOT_FOUND", f"Símbolo {request.symbolId} no encontrado", request)
+
+        position = self.open_position(request.ctidTraderAccountId, request.symbolId, request.tradeSide, request.volume, request.label)
+        price = position["price"]
+        direction = 1 if request.tradeSide == ProtoOATradeSide.BUY else -1
+        # SL/TP absolutos o relativos al precio de ejecución
+        if request.HasField("stopLoss"):
+            position["stop_loss"] = request.stopLoss
+        elif request.HasField("relativeStopLoss"):
+            position["stop_loss"] = round(price - direction * request.relativeStopLoss / PRICE_SCALE, symbol.digits)
+        if request.HasField("takeProfit"):
+            position["take_profit"] = request.takeProfit
+        elif request.HasField("relativeTakeProfit"):
+            position["take_profit"] = round(price + direction * request.relativeTakeProfit / PRICE_SCALE, symbol.digits)
+
+        order_id = next(self._ids)
+        self._execution(client, client_msg_id, request.ctidTraderAccountId, ProtoOAExecutionType.ORDER_ACCEPTED,
+                        position, order_id, ProtoOAOrderStatus.ORDER_STATUS_ACCEPTED)
+        self._execution(client, client_msg_id, request.ctidTraderAccountId, ProtoOAExecutionType.ORDER_FILLED,
+                        position, order_id, ProtoOAOrderStatus.ORDER_STATUS_FILLED, deal_volume=request.volume)
+
+    def on_close_position(self, client, client_msg_id, request):
+        positions = self.positions.setdefault(request.ctidTraderAccountId, {})
+        position = positions.get(request.positionId)
+        if position is None:
+            return self._error(client, client_msg_id, "POSITION_NOT_FOUND", f"Posición {request.positionId} no encontrada", request)
+
+        closed_volume = min(request.volume, position["volume"])
+        position["volume"] -= closed_volume
+        if position["volume"] <= 0:
+            del positions[request.positionId]
+        order_id = next(self._ids)
+        self._execution(client, client_msg_id, request.ctidTraderAccountId, ProtoOAExecutionType.ORDER_ACCEPTED,
+                        position, order_id, ProtoOAOrderStatus.ORDER_STATUS_ACCEPTED, closing=True)
+        self._execution(client, client_msg_id, request.ctidTraderAccountId, ProtoOAExecutionType.ORDER_FILLED,
+                        position, order_id, ProtoOAOrderStatus.ORDER_STATUS_FILLED, closing=True, deal_volume=closed_volume)
+
+    def on_reconcile(self, client, client_msg_id, request):
+        response = ProtoOAReconcileRes(ctidTraderAccountId=request.ctidTraderAccountId)
+        for position in self.positions.get(request.ctidTraderAccountId, {}).values():
+            self._fill_position(response.position.add(), position)
+        client.send(response, client_msg_id)
+
+    def _execution(self, client, client_msg_id, account_id, execution_type, position, order_id, order_status,
+                   closing=False, deal_volume=None):
+        event = ProtoOAExecutionEvent(ctidTraderAccountId=account_id, executionType=execution_type)
+        self._fill_position(event.position, position)
+        if closing and position["volume"] <= 0:
+            event.position.positionStatus = ProtoOAPositionStatus.POSITION_STATUS_CLOSED
+
+        event.order.orderId = order_id
+        event.order.orderType = 1  # MARKET
+        event.order.orderStatus = order_status
+        event.order.closingOrder = closing
+        self._fill_trade_data(event.order.tradeData, position)
+        if closing:
+            # La orden de cierre va en sentido contrario a la posición
+            event.order.tradeData.tradeSide = ProtoOATradeSide.SELL if position["trade_side"] == ProtoOATradeSide.BUY else ProtoOATradeSide.BUY
+
+        if deal_volume is not None:
+            now = int(time.time() * 1000)
+            event.deal.dealId = next(self._ids)
+            event.deal.orderId = order_id
+            event.deal.positionId = position["position_id"]
+            event.deal.volume = deal_volume
+            event.deal.filledVolume = deal_volume
+            event.deal.symbolId = position["symbol_id"]
+            event.deal.createTimestamp = now
+            event.deal.executionTimestamp = now
+            event.deal.executionPrice = position["price"]
+            event.deal.tradeSide = event.order.tradeData.tradeSide
+            event.deal.dealStatus = ProtoOADealStatus.FILLED
+        client.send(event, client_msg_id)
+
+    def _fill_position(self, entry, position):
+        entry.positionId = position["position_id"]
+        entry.positionStatus = ProtoOAPositionStatus.POSITION_STATUS_OPEN
+        entry.swap = 0
+        entry.price = position["price"]
+        if position["stop_loss"] is not None:
+            entry.stopLoss = position["stop_loss"]
+        if position["take_profit"] is not None:
+            entry.takeProfit = position["take_profit"]
+        self._fill_trade_data(entry.tradeData, position)
+
+    def _fill_trade_data(self, trade_data, position):
+        trade_data.symbolId = position["symbol_id"]
+        trade_data.volume = position["volume"]
+        trade_data.tradeSide = position["trade_side"]
+        if position["label"]:
+            trade_data.label = position["label"]
+
+    def _light_symbol(self, entry, symbol):
+        entry.symbolId = symbol.symbol_id
+        entry.symbolName = symbol.name
+        entry.enabled = True
+        entry.baseAssetId = symbol.base_asset_id
+        entry.quoteAssetId = symbol.quote_asset_id
+
+    def _conversion_chain(self, first_asset_id, last_asset_id):
+        """Símbolos que llevan de first_asset_id a last_asset_id (búsqueda en anchura)"""
+        paths = {first_asset_id: []}
+        frontier = deque([first_asset_id])
+        while frontier:
+            asset_id = frontier.popleft()
+            if asset_id == last_asset_id:
+                return paths[asset_id]
+            for symbol in self.symbols.values():
+                for start, end in ((symbol.base_asset_id, symbol.quote_asset_id), (symbol.quote_asset_id, symbol.base_asset_id)):
+                    if start == asset_id and end not in paths:
+                        paths[end] = paths[asset_id] + [symbol]
+                        frontier.append(end)
+        return None
+
+    def tick(self):
+        """Mueve todos los precios al azar y publica los spots a los suscritos"""
+        for symbol in self.symbols.values():
+            pip = 10 ** -symbol.pip_position
+            symbol.bid = round(max(symbol.bid + self._random.uniform(-self.volatility, self.volatility) * pip, pip), symbol.digits)
+            self._publish(symbol)
+
+    def _publish(self, symbol):
+        for client in list(self.clients):
+            for account_id, symbol_id in list(client.spots):
+                if symbol_id == symbol.symbol_id:
+                    self._send_spot(client, account_id, symbol)
+
+    def _send_spot(self, client, account_id, symbol):
+        self.ticks += 1
+        client.send(ProtoOASpotEvent(
+            ctidTraderAccountId=account_id,
+            symbolId=symbol.symbol_id,
+            bid=int(round(symbol.bid * PRICE_SCALE)),
+            ask=int(round(symbol.ask * PRICE_SCALE)),
+            timestamp=int(time.time() * 1000)
+        ))
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "requests": sum(self.requests.values()),
+            "sent": self.sent,
+            "errors": self.errors,
+            "ticks": self.ticks,
+            "open_positions": sum(len(positions) for positions in self.positions.values()),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que simula la API Open API de cTrader")
+    parser.add_argument("--port", type=int, default=5035)
+    parser.add_argument("--interface", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos hasta responder a cada petición")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Segundos aleatorios sumados a la latencia")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de rechazar una orden")
+    parser.add_argument("--tick-interval", type=float, default=0.5, help="Segundos entre ticks (0 sin feed)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-tls", action="store_true", help="TCP sin TLS (el Client de ctrader_open_api necesita TLS)")
+    args = parser.parse_args()
+
+    server = SimulatedServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        tick_interval=args.tick_interval,
+        seed=args.seed
+    )
+    port = server.listen(args.port, args.interface, tls=not args.no_tls)
+    print(f"🧪 Simulador de cTrader escuchando en {args.interface}:{port}")
+    print(f"🧪 Usa CTRADER_HOST={args.interface} CTRADER_PORT={port} para conectar los scripts")
+
+    def report():
+        print(f"🧪 {server.stats()}")
+
+    task.LoopingCall(report).start(60, now=False)
+    reactor.run()
@@ -1,12 +1,11 @@
 import os
-import csv
-import datetime
 import traceback
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 from twisted.internet import reactor
 from threading import Thread
 from ctrader import run_ctrader_order, initialize_client
+from operation_log import OperationLogWriter
 
 # Cargar variables de entorno
 load_dotenv()
@@ -23,6 +22,9 @@ app = Flask(__name__)
 LOGS_DIR = "logs"
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# Escritor del log de operaciones: agrupa filas y escribe fuera del hilo del reactor
+operation_log = OperationLogWriter(LOGS_DIR, ["timestamp", "symbol", "order", "volume", "status"])
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
     try:
@@ -116,25 +118,13 @@ def webhook():
         return jsonify({"error": str(e)}), 500
 
 def log_operation(symbol, order_type, volume, status):
-    """Registra la operación en el archivo de log"""
-    try:
-        now = datetime.datetime.now(datetime.timezone.utc)
-        log_filename = f"{LOGS_DIR}/operations_{now.strftime('%Y-%m')}.csv"
-        write_header = not os.path.exists(log_filename)
-        
-        with open(log_filename, mode="a", newline="") as file:
-            writer = csv.writer(file)
-            if write_header:
-                writer.writerow(["timestamp", "symbol", "order", "volume", "status"])
-            writer.writerow([
-                now.isoformat(),
-                symbol,
-                order_type.upper(),
-                volume,
-                status
-            ])
-    except Exception as e:
-        print(f"❌ Error al registrar operación: {str(e)}")
+    """Registra la operación en el archivo de log (escritura en segundo plano)"""
+    operation_log.write([
+        symbol,
+        order_type.upper(),
+        volume,
+        status
+    ])
 
 if __name__ == "__main__":
     # Inicializar el cliente de cTrader y obtener el deferred
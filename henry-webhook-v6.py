@@ -1,21 +1,28 @@
 import os
-import csv
-import datetime
 import traceback
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 from twisted.internet import reactor
 from threading import Thread
 from ctrader import run_ctrader_order, initialize_client
+from operation_log import OperationLogWriter
+from alert_payload import AlertParser, PayloadError, decode_body
 
 # Cargar variables de entorno
 load_dotenv()
 SECRET_TOKEN = os.getenv("SECRET_TOKEN")
 
+# Configuración del servidor HTTP
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 5001))
+
 # Configuración de límites
 MAX_VOLUME = 50  # Volumen máximo permitido por la cuenta
 DEFAULT_VOLUME = 0.1  # Volumen predeterminado para pruebas
 
+# Esquema de la alerta compilado una sola vez
+alert_parser = AlertParser(default_volume=DEFAULT_VOLUME, max_volume=MAX_VOLUME)
+
 # Inicializar servidor Flask
 app = Flask(__name__)
 
@@ -23,67 +30,45 @@ app = Flask(__name__)
 LOGS_DIR = "logs"
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# Escritor del log de operaciones: agrupa filas y escribe fuera del hilo del reactor
+operation_log = OperationLogWriter(LOGS_DIR, ["timestamp", "symbol", "order", "volume", "sl_money", "tp_money", "status"])
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
     try:
-        # Verificar si es una solicitud JSON
-        if not request.is_json:
-            # TradingView a veces envía datos como x-www-form-urlencoded
-            data = request.form.to_dict()
-            if not data:
-                # Si no hay datos en form, intenta obtener de los parámetros de la URL
-                data = request.args.to_dict()
-                if not data:
-                    # Último recurso: intentar parsear el body como texto
-                    try:
-                        import json
-                        data = json.loads(request.data.decode('utf-8'))
-                    except:
-                        pass
-        else:
-            data = request.json
-        
-        print(f"📩 Webhook recibido con datos: {data}")
+        # JSON, formulario, parámetros de la URL o texto JSON (TradingView a
+        # veces envía x-www-form-urlencoded)
+        try:
+            data = decode_body(request.get_data(), request.content_type or "", request.query_string)
+        except PayloadError as e:
+            return jsonify({"error": str(e), "errors": e.errors}), 400
         
         # Verificar token si está configurado
         token = data.get("token", "")
         if SECRET_TOKEN and token != SECRET_TOKEN:
             return jsonify({"error": "Unauthorized"}), 401
         
-        # Obtener parámetros de la orden
-        symbol = data.get("symbol")
-        order_type = data.get("order")
-        
-        # Obtener y validar el volumen
         try:
-            volume = float(data.get("volume", DEFAULT_VOLUME))
-        except (ValueError, TypeError):
-            volume = DEFAULT_VOLUME
+            alert, warnings = alert_parser.validate(data)
+        except PayloadError as e:
+            return jsonify({"error": f"Invalid payload - {e}", "errors": e.errors}), 400
         
-        # Limitar el volumen al máximo permitido
-        volume = min(volume, MAX_VOLUME)
+        for warning in warnings:
+            print(f"⚠️ {warning}")
         
-        # Obtener stop loss y take profit en unidades monetarias (EUR)
-        try:
-            sl_money = float(data.get("sl_money", 0))
-        except (ValueError, TypeError):
-            sl_money = 0
-            
-        try:
-            tp_money = float(data.get("tp_money", 0))
-        except (ValueError, TypeError):
-            tp_money = 0
+        # Parámetros de la orden (volumen ya limitado a MAX_VOLUME)
+        symbol = alert["symbol"]
+        order_type = alert["order"]
+        volume = alert["volume"]
+        
+        # Stop loss y take profit en unidades monetarias (EUR)
+        sl_money = alert["sl_money"] or 0
+        tp_money = alert["tp_money"] or 0
         
         # Usar un volumen pequeño para prueba si es muy grande
         if volume > 10:
             print(f"⚠️ Volumen {volume} es grande, considere reducirlo para evitar errores de saldo")
         
-        if not all([symbol, order_type]):
-            return jsonify({
-                "error": "Invalid payload - missing required parameters",
-                "received": data
-            }), 400
-        
         # Registrar que se recibió el webhook
         sl_tp_info = ""
         if sl_money > 0 or tp_money > 0:
@@ -139,27 +124,15 @@ def webhook():
         return jsonify({"error": str(e)}), 500
 
 def log_operation(symbol, order_type, volume, status, sl_money=0, tp_money=0):
-    """Registra la operación en el archivo de log"""
-    try:
-        now = datetime.datetime.now(datetime.timezone.utc)
-        log_filename = f"{LOGS_DIR}/operations_{now.strftime('%Y-%m')}.csv"
-        write_header = not os.path.exists(log_filename)
-        
-        with open(log_filename, mode="a", newline="") as file:
-            writer = csv.writer(file)
-            if write_header:
-                writer.writerow(["timestamp", "symbol", "order", "volume", "sl_money", "tp_money", "status"])
-            writer.writerow([
-                now.isoformat(),
-                symbol,
-                order_type.upper(),
-                volume,
-                sl_money,
-                tp_money,
-                status
-            ])
-    except Exception as e:
-        print(f"❌ Error al registrar operación: {str(e)}")
+    """Registra la operación en el archivo de log (escritura en segundo plano)"""
+    operation_log.write([
+        symbol,
+        order_type.upper(),
+        volume,
+        sl_money,
+        tp_money,
+        status
+    ])
 
 if __name__ == "__main__":
     # Inicializar el cliente de cTrader y obtener el deferred
@@ -177,14 +150,14 @@ if __name__ == "__main__":
     
     # Ejecutar Flask en un hilo separado
     def run_flask():
-        app.run(host="0.0.0.0", port=5001, debug=False, use_reloader=False)
+        app.run(host=WEBHOOK_HOST, port=WEBHOOK_PORT, debug=False, use_reloader=False)
     
     flask_thread = Thread(target=run_flask)
     flask_thread.daemon = True
     flask_thread.start()
     
     # Imprimir mensaje de inicio
-    print(f"🚀 Servidor webhook iniciado en http://0.0.0.0:5001/webhook")
+    print(f"🚀 Servidor webhook iniciado en http://{WEBHOOK_HOST}:{WEBHOOK_PORT}/webhook")
     
     # Iniciar el reactor de Twisted en el hilo principal
     reactor.run()
@@ -0,0 +1,538 @@
+import os
+import sys
+import json
+import time
+import uuid
+import traceback
+import importlib.util
+from collections import ChainMap
+from dotenv import load_dotenv
+from google.protobuf.json_format import MessageToDict
+from twisted.internet import reactor, defer
+from twisted.web import server, resource
+
+def load_ctrader_module():
+    """
+    Carga el módulo cTrader de v7 con el nombre "ctrader"
+
+    v7 usa ctrader-stop-loss.py (pool de sesiones, grupos de cuentas,
+    diario...), que no se puede importar por el guion de su nombre.
+    CTRADER_MODULE permite indicar otro fichero; si ya hay un módulo
+    "ctrader" cargado (por ejemplo desde bench-e2e.py), se usa ese.
+    """
+    if "ctrader" in sys.modules:
+        return sys.modules["ctrader"]
+    path = os.getenv("CTRADER_MODULE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ctrader-stop-loss.py"))
+    spec = importlib.util.spec_from_file_location("ctrader", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["ctrader"] = module
+    spec.loader.exec_module(module)
+    return module
+
+load_ctrader_module()
+from ctrader import run_ctrader_order, run_group_order, initialize_client, pool, message_router, spot_feed, accounts_with_label, account_groups, ACCOUNT_ID
+from operation_log import OperationLogWriter
+from alert_payload import AlertParser, PayloadError, decode_body
+from signal_coalescer import SignalCoalescer, signal_key, DUPLICATE, MERGED
+from order_journal import OrderJournal
+from twisted.python.failure import Failure
+
+# Cargar variables de entorno
+load_dotenv()
+SECRET_TOKEN = os.getenv("SECRET_TOKEN")
+
+# Configuración del servidor HTTP
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 5001))
+
+# Modo síncrono: tiempo máximo (segundos) que /webhook espera la ejecución
+SYNC_ACK_TIMEOUT = float(os.getenv("SYNC_ACK_TIMEOUT", 10))
+
+# Si la sesión cTrader no está lista: rechazar con 503 (true) o encolar la
+# orden con la espera máxima SESSION_READY_TIMEOUT del módulo ctrader (false)
+REJECT_WHEN_NOT_READY = os.getenv("REJECT_WHEN_NOT_READY", "false").lower() == "true"
+
+# Configuración de límites
+MAX_VOLUME = 50  # Volumen máximo permitido por la cuenta
+DEFAULT_VOLUME = 0.1  # Volumen predeterminado para pruebas
+
+# Esquema de la alerta compilado una sola vez
+alert_parser = AlertParser(default_volume=DEFAULT_VOLUME, max_volume=MAX_VOLUME)
+
+# Señales en ráfaga: ventana en la que una señal repetida (misma clave de
+# idempotencia) se descarta, y ventana en la que las señales del mismo
+# símbolo y sentido se suman en una orden neta (0 = sin fusionar)
+SIGNAL_DEDUP_WINDOW = float(os.getenv("SIGNAL_DEDUP_WINDOW", 60))  # Segundos
+SIGNAL_MERGE_WINDOW = float(os.getenv("SIGNAL_MERGE_WINDOW", 0))  # Segundos
+
+# Crear carpeta de logs si no existe
+LOGS_DIR = "logs"
+os.makedirs(LOGS_DIR, exist_ok=True)
+
+# Escritor del log de operaciones: agrupa filas y escribe fuera del hilo del reactor
+operation_log = OperationLogWriter(LOGS_DIR, ["timestamp", "symbol", "order", "volume", "sl_pips", "tp_pips", "candle_color", "status", "latency_ms"])
+
+# Diario de órdenes: cada señal se guarda en disco antes de responder y las
+# que quedan sin terminar tras una caída se reejecutan al arrancar
+ORDER_JOURNAL_FILE = os.getenv("ORDER_JOURNAL_FILE", os.path.join(LOGS_DIR, "orders.journal"))
+journal = OrderJournal(ORDER_JOURNAL_FILE)
+
+def json_response(request, data, status=200):
+    """Escribe una respuesta JSON con el código de estado indicado"""
+    request.setResponseCode(status)
+    request.setHeader(b"content-type", b"application/json")
+    return json.dumps(data).encode("utf-8")
+
+def parse_payload(request):
+    """
+    Obtiene los datos del webhook del cuerpo de la petición (ver
+    alert_payload.decode_body)
+    """
+    query_string = request.uri.split(b"?", 1)[1] if b"?" in request.uri else b""
+    return decode_body(request.content.read(), request.getHeader("content-type") or "", query_string)
+
+def wants_sync_ack(request, data):
+    """True si el llamante pide esperar a la ejecución (?wait=1 o "wait": true)"""
+    flag = data.get("wait")
+    if flag is None and b"wait" in request.args:
+        flag = request.args[b"wait"][0].decode("utf-8")
+    return str(flag).lower() in ("1", "true", "yes")
+
+def sync_deadline(data):
+    """Plazo de espera del modo síncrono, limitado por SYNC_ACK_TIMEOUT"""
+    try:
+        return min(float(data.get("wait_timeout", SYNC_ACK_TIMEOUT)), SYNC_ACK_TIMEOUT)
+    except (ValueError, TypeError):
+        return SYNC_ACK_TIMEOUT
+
+def timing_breakdown(received_at, timings, finished_at):
+    """
+    Desglose de latencias en milisegundos a partir de las marcas de run_ctrader_order
+
+    - queue_wait: desde que llega el webhook hasta que la orden se despacha
+      (incluye la espera a que la conexión esté lista); en una señal
+      duplicada, hasta que se descarta y se engancha a la original
+    - price_resolution: cálculo de los precios de SL/TP
+    - broker_rtt: desde el envío de ProtoOANewOrderReq hasta su ejecución
+    - total: desde que llega el webhook hasta la respuesta
+
+    En una señal duplicada, price_resolution y broker_rtt son los de la
+    orden original, que es la que se ejecuta.
+    """
+    def span(start, end):
+        if start in timings and end in timings:
+            return round((timings[end] - timings[start]) * 1000.0, 3)
+        return None
+
+    timings = dict(timings, received=received_at)
+    return {
+        "queue_wait": span("received", "dispatched"),
+        "price_resolution": span("prices_started", "prices_resolved"),
+        "broker_rtt": span("order_sent", "executed"),
+        "total": round((finished_at - received_at) * 1000.0, 3),
+    }
+
+def describe_result(result):
+    """Convierte el resultado de run_ctrader_order en algo serializable a JSON"""
+    if isinstance(result, dict):
+        return result
+    if hasattr(result, "DESCRIPTOR"):
+        return MessageToDict(result)
+    return {"result": str(result)}
+
+class HealthResource(resource.Resource):
+    """Endpoint /health con el estado del pool de sesiones cTrader y sus métricas"""
+    isLeaf = True
+
+    def render_GET(self, request):
+        return json_response(request, {
+            "session": pool.state,
+            "sessions": pool.stats(),
+            "messages": message_router.stats(),
+            "spots": spot_feed.stats(),
+            "signals": coalescer.stats(),
+            "journal": journal.stats(),
+        }, 200 if pool.is_ready else 503)
+
+class WebhookResource(resource.Resource):
+    """Endpoint /webhook servido en el mismo reactor que el cliente cTrader"""
+    isLeaf = True
+
+    def render_POST(self, request):
+        received_at = time.perf_counter()
+        try:
+            try:
+                data = parse_payload(request)
+            except PayloadError as e:
+                return json_response(request, {"error": str(e), "errors": e.errors}, 400)
+
+            # Verificar token si está configurado
+            token = data.get("token", "")
+            if SECRET_TOKEN and token != SECRET_TOKEN:
+                return json_response(request, {"error": "Unauthorized"}, 401)
+
+            try:
+                alert, warnings = alert_parser.validate(data)
+            except PayloadError as e:
+                return json_response(request, {"error": f"Invalid payload - {e}", "errors": e.errors}, 400)
+
+            for warning in warnings:
+                print(f"⚠️ {warning}")
+
+            symbol = alert["symbol"]
+            order_type = alert["order"]
+            volume = alert["volume"]
+            sl_pips = alert["sl_pips"]
+            tp_pips = alert["tp_pips"]
+            # Color de la vela (para lógica de mantener/cerrar posiciones)
+            candle_color = alert["candle_color"]
+            # Grupo de cuentas opcional: replicar la orden en todas sus cuentas
+            group = alert["group"]
+
+            # Registrar que se recibió el webhook (sin el payload completo, que lleva el token)
+            log_message = f"📩 Webhook recibido: {symbol} {order_type} {volume}"
+            if sl_pips is not None:
+                log_message += f" SL:{sl_pips} pips"
+            if tp_pips is not None:
+                log_message += f" TP:{tp_pips} pips"
+            if candle_color:
+                log_message += f" Vela:{candle_color}"
+            print(log_message)
+
+            if REJECT_WHEN_NOT_READY and not pool.is_ready:
+                return json_response(request, {
+                    "error": "cTrader session not ready",
+                    "session": pool.state
+                }, 503)
+
+            # Ya estamos en el hilo del reactor: la señal pasa por el coalescer
+            # (duplicados y fusión) y la orden se lanza sin saltos entre hilos
+            journal_id = uuid.uuid4().hex
+            signal = {
+                "symbol": symbol,
+                "side": order_type.upper(),
+                "volume": volume,
+                "sl_pips": sl_pips,
+                "tp_pips": tp_pips,
+                "candle_color": candle_color,
+                "group": group,
+                "timings": {},
+                "label": journal_id,
+            }
+            key = signal_key(data, request.getHeader("idempotency-key") or data.get("idempotency_key"))
+            coalesced, order_deferred = coalescer.submit(key, signal)
+            timings = signal["timings"]
+
+            if coalesced == DUPLICATE:
+                # La original ya está en el diario; sus marcas se leen al responder
+                timings = ChainMap({"dispatched": time.perf_counter()}, timings)
+                journal_deferred = defer.succeed(None)
+            else:
+                # La orden ya está en marcha; la respuesta espera a que la señal esté en disco
+                journal_deferred = journal.accept(journal_id, journal_entry(signal), label=signal["label"])
+                order_deferred.addBoth(complete_in_journal, journal_id)
+
+            # Modo síncrono: responder con el resultado de la ejecución
+            if wants_sync_ack(request, data):
+                return self.respond_when_executed(request, journal_deferred.addCallback(lambda _: order_deferred), received_at, timings, sync_deadline(data))
+            order_deferred.addErrback(lambda failure: None)
+
+            if coalesced == DUPLICATE:
+                return json_response(request, {
+                    "status": "duplicate",
+                    "message": "Señal repetida: ya se está procesando o se procesó"
+                }, 200)
+
+            # Devolvemos respuesta inmediata (la orden se procesa async)
+            response_data = {
+                "status": "processing",
+                "message": f"Orden enviada a procesar (volumen ajustado a {volume})",
+                "details": {
+                    "symbol": symbol,
+                    "side": order_type.upper(),
+                    "volume": volume,
+                }
+            }
+
+            # Incluir detalles adicionales si están presentes
+            if sl_pips is not None:
+                response_data["details"]["sl_pips"] = sl_pips
+            if tp_pips is not None:
+                response_data["details"]["tp_pips"] = tp_pips
+            if candle_color:
+                response_data["details"]["candle_color"] = candle_color
+            if group:
+                response_data["details"]["group"] = group
+            if coalesced == MERGED:
+                response_data["message"] = "Señal fusionada con otra del mismo símbolo y sentido en una orden neta"
+
+            return self.respond_when_journaled(request, journal_deferred, response_data)
+
+        except Exception as e:
+            print(f"❌ Error procesando webhook: {str(e)}")
+            traceback.print_exc()
+            return json_response(request, {"error": str(e)}, 500)
+
+    def respond_when_journaled(self, request, journal_deferred, data):
+        """Responde 200 en cuanto la señal está en el diario (tras el fsync)"""
+        state = {"done": False}
+
+        def finish(data, status):
+            if state["done"]:
+                return
+            state["done"] = True
+            request.write(json_response(request, data, status))
+            request.finish()
+
+        def on_error(failure):
+            # La orden sigue en marcha, pero no sobreviviría a un reinicio
+            finish({"error": f"No se pudo registrar la orden en el diario: {failure.getErrorMessage()}"}, 500)
+
+        request.notifyFinish().addErrback(lambda failure: state.update(done=True))
+        journal_deferred.addCallbacks(lambda _: finish(data, 200), on_error)
+        return server.NOT_DONE_YET
+
+    def respond_when_executed(self, request, order_deferred, received_at, timings, deadline):
+        """
+        Deja la petición abierta hasta que la orden se ejecute o venza el plazo
+
+        La orden no se cancela al vencer el plazo: se responde 202 y el
+        resultado se sigue registrando en el CSV.
+        """
+        state = {"done": False}
+
+        def finish(data, status):
+            if state["done"]:
+                return
+            state["done"] = True
+            if timeout_call.active():
+                timeout_call.cancel()
+            data["timings_ms"] = timing_breakdown(received_at, timings, time.perf_counter())
+            request.write(json_response(request, data, status))
+            request.finish()
+
+        def on_executed(result):
+            finish({"status": "executed", "execution": describe_result(result)}, 200)
+            return result
+
+        def on_failed(failure):
+            finish({"status": "error", "error": failure.getErrorMessage()}, 502)
+            return None
+
+        def on_deadline():
+            finish({"status": "pending", "message": f"La orden no se ejecutó en {deadline}s, sigue en proceso"}, 202)
+
+        # Si el cliente HTTP se desconecta, no intentar responder
+        request.notifyFinish().addErrback(lambda failure: state.update(done=True))
+
+        timeout_call = reactor.callLater(deadline, on_deadline)
+        order_deferred.addCallbacks(on_executed, on_failed)
+        return server.NOT_DONE_YET
+
+def execute_order(symbol, order_type, volume, sl_pips, tp_pips, candle_color, timings=None, group=None, label=None, account_ids=None):
+    """
+    Lanza la orden en cTrader y registra el resultado cuando llegue
+
+    Si se indica group, la orden se replica en todas las cuentas del grupo
+    (o solo en account_ids) y el resultado es el resumen agregado de
+    run_group_order. label se guarda en la orden para poder comprobar tras
+    un reinicio si llegó a ejecutarse.
+
+    Returns:
+        El deferred de run_ctrader_order, que sigue propagando el resultado o
+        el error después de registrarlo
+    """
+    if timings is None:
+        timings = {}
+
+    def latency_ms():
+        # Desde que la orden entra en cTrader hasta que se conoce el resultado
+        if "queued" in timings:
+            return round((time.perf_counter() - timings["queued"]) * 1000.0, 3)
+        return None
+
+    try:
+        if group:
+            d = run_group_order(group, symbol, order_type.upper(), volume, sl_pips=sl_pips, tp_pips=tp_pips, timings=timings, label=label, account_ids=account_ids)
+        else:
+            d = run_ctrader_order(
+                symbol,
+                order_type.upper(),
+                volume,
+                sl_pips=sl_pips,
+                tp_pips=tp_pips,
+                candle_color=candle_color,
+                timings=timings,
+                label=label
+            )
+
+        def on_order_success(result):
+            status = "SUCCESS"
+            # Verificar si el resultado contiene un estado específico (mantenido, cerrado)
+            if isinstance(result, dict) and "status" in result:
+                status = result["status"].upper()
+                message = result.get("message", "")
+                print(f"✅ Operación completada: {status} - {message}")
+            else:
+                print(f"✅ Orden completada: {result}")
+
+            log_operation(symbol, order_type, volume, status, sl_pips=sl_pips, tp_pips=tp_pips, candle_color=candle_color, latency_ms=latency_ms())
+            return result
+
+        def on_order_error(err):
+            print(f"❌ Error en la orden: {err}")
+            log_operation(symbol, order_type, volume, f"ERROR: {err}", sl_pips=sl_pips, tp_pips=tp_pips, candle_color=candle_color, latency_ms=latency_ms())
+            return err
+
+        d.addCallbacks(on_order_success, on_order_error)
+        return d
+    except Exception as e:
+        print(f"❌ Error al ejecutar orden: {str(e)}")
+        traceback.print_exc()
+        log_operation(symbol, order_type, volume, f"EXCEPTION: {str(e)}", sl_pips=sl_pips, tp_pips=tp_pips, candle_color=candle_color)
+        return defer.fail(e)
+
+def execute_signal(signal):
+    """Ejecuta una señal (o la orden neta de varias) entregada por el coalescer"""
+    return execute_order(
+        signal["symbol"],
+        signal["side"],
+        signal["volume"],
+        signal["sl_pips"],
+        signal["tp_pips"],
+        signal["candle_color"],
+        signal["timings"],
+        group=signal["group"],
+        label=signal.get("label"),
+        account_ids=signal.get("account_ids")
+    )
+
+coalescer = SignalCoalescer(execute_signal, dedup_window=SIGNAL_DEDUP_WINDOW, merge_window=SIGNAL_MERGE_WINDOW, max_volume=MAX_VOLUME)
+
+def journal_entry(signal):
+    """Campos de la señal que se guardan en el diario"""
+    return {field: signal[field] for field in ("symbol", "side", "volume", "sl_pips", "tp_pips", "candle_color", "group")}
+
+def complete_in_journal(result, journal_id):
+    """Marca la señal como terminada en el diario y deja pasar el resultado"""
+    if isinstance(result, Failure):
+        status = f"ERROR: {result.getErrorMessage()}"
+    elif isinstance(result, dict) and "status" in result:
+        status = result["status"].upper()
+    else:
+        status = "SUCCESS"
+    journal.complete(journal_id, status)
+    return result
+
+def replay_batch(label, batch):
+    """
+    Reejecuta una orden del diario (una o varias señales fusionadas)
+
+    Antes de reenviarla se comprueba con ProtoOAReconcileReq qué cuentas ya
+    tienen una posición con su etiqueta, y solo se envía a las que no.
+
+    Returns:
+        Un deferred con el resultado de la orden, o None si no se pudo
+        comprobar (la señal sigue pendiente para el próximo arranque)
+    """
+    signal = dict(
+        batch[0]["signal"],
+        volume=min(round(sum(record["signal"]["volume"] for record in batch), 2), MAX_VOLUME),
+        timings={},
+        label=label
+    )
+    group = signal.get("group")
+    if group and group not in account_groups:
+        return defer.fail(Exception(f"Grupo de cuentas desconocido: {group}"))
+    account_ids = account_groups[group].account_ids() if group else [ACCOUNT_ID]
+
+    def on_checked(found):
+        missing = [account_id for account_id in account_ids if account_id not in found]
+        if not missing:
+            print(f"♻️ Orden {signal['side']} {signal['symbol']} ya ejecutada antes del reinicio")
+            return {"status": "recovered"}
+        print(f"♻️ Reejecutando orden {signal['side']} {signal['symbol']} {signal['volume']}")
+        if group:
+            signal["account_ids"] = missing
+        return execute_signal(signal)
+
+    def on_check_error(failure):
+        print(f"⚠️ No se pudo comprobar la orden {signal['side']} {signal['symbol']} del diario: {failure.getErrorMessage()}")
+        return None
+
+    return accounts_with_label(label, account_ids).addCallbacks(on_checked, on_check_error)
+
+def replay_journal(records):
+    """Reejecuta las señales que quedaron sin terminar antes del reinicio"""
+    batches = {}
+    for record in records:
+        # Las señales fusionadas comparten etiqueta: fueron una sola orden
+        batches.setdefault(record["label"], []).append(record)
+
+    print(f"♻️ Diario de órdenes: {len(records)} señales sin terminar ({len(batches)} órdenes)")
+
+    for label, batch in batches.items():
+        def complete_batch(result, batch=batch):
+            if result is not None:
+                for record in batch:
+                    complete_in_journal(result, record["id"])
+
+        replay_batch(label, batch).addBoth(complete_batch)
+
+def log_operation(symbol, order_type, volume, status, sl_pips=None, tp_pips=None, candle_color=None, latency_ms=None):
+    """Registra la operación en el archivo de log (escritura en segundo plano)"""
+    operation_log.write([
+        symbol,
+        order_type.upper(),
+        volume,
+        sl_pips if sl_pips is not None else "",
+        tp_pips if tp_pips is not None else "",
+        candle_color if candle_color is not None else "",
+        status,
+        latency_ms if latency_ms is not None else ""
+    ])
+
+def build_site():
+    """Crea el sitio HTTP con el endpoint /webhook"""
+    root = resource.Resource()
+    root.putChild(b"webhook", WebhookResource())
+    root.putChild(b"health", HealthResource())
+    return server.Site(root)
+
+if __name__ == "__main__":
+    # Inicializar el cliente de cTrader y obtener el deferred
+    client, connection_ready = initialize_client()
+
+    # Señales que la ejecución anterior dejó sin terminar
+    unfinished = journal.pending()
+
+    # Registrar un callback para saber cuando la conexión está lista
+    def on_connection_ready(_):
+        print("✅ Conexión cTrader establecida y lista para recibir órdenes")
+        if unfinished:
+            replay_journal(unfinished)
+
+    def on_connection_failed(failure):
+        print(f"❌ Error al establecer conexión cTrader: {failure}")
+
+    connection_ready.addCallback(on_connection_ready)
+    connection_ready.addErrback(on_connection_failed)
+
+    # Servir el webhook en el mismo reactor que el cliente cTrader
+    port = reactor.listenTCP(WEBHOOK_PORT, build_site(), interface=WEBHOOK_HOST)
+
+    # Parada ordenada: dejar de aceptar peticiones y cerrar la conexión cTrader
+    def shutdown():
+        print("🛑 Deteniendo servidor webhook...")
+        pool.stop()
+        operation_log.close()
+        journal.close()
+        return port.stopListening()
+
+    reactor.addSystemEventTrigger("before", "shutdown", shutdown)
+
+    # Imprimir mensaje de inicio
+    print(f"🚀 Servidor webhook iniciado en http://{WEBHOOK_HOST}:{WEBHOOK_PORT}/webhook")
+
+    # Iniciar el reactor de Twisted en el hilo principal
+    reactor.run()
@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from ctrader_open_api import Client, Protobuf, EndPoints, TcpProtocol
 from twisted.internet import reactor, defer
+from symbol_table import SymbolTable
 
 load_dotenv()
 
@@ -10,6 +11,7 @@ CLIENT_ID = os.getenv("CTRADER_CLIENT_ID")
 CLIENT_SECRET = os.getenv("CTRADER_CLIENT_SECRET")
 ACCESS_TOKEN = os.getenv("CTRADER_ACCESS_TOKEN")
 ACCOUNT_ID = int(os.getenv("ACCOUNT_ID"))  # Ahora usando el ID correcto
+SYMBOL_TABLE_FILE = os.getenv("SYMBOL_TABLE_FILE", "symbols.bin")
 
 print("=== Obtener lista de símbolos para la cuenta ===")
 print(f"CLIENT_ID: {CLIENT_ID}")
@@ -111,11 +113,66 @@ def on_symbols_received(response):
         
         print("Lista completa de símbolos guardada en symbols.txt")
         
+        # Pedir digits/lotSize de todos los símbolos para la tabla binaria
+        request_symbol_details(symbols.symbol)
+        return
+        
     except Exception as e:
         print(f"[TEST] ❌ Error procesando símbolos: {e}")
     
     symbols_completed.callback(None)
 
+def request_symbol_details(light_symbols):
+    """Solicita los detalles de todos los símbolos en una única petición"""
+    from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOASymbolByIdReq, ProtoOAErrorRes
+    
+    names = {symbol.symbolId: symbol.symbolName for symbol in light_symbols}
+    
+    request = ProtoOASymbolByIdReq()
+    request.ctidTraderAccountId = ACCOUNT_ID
+    request.symbolId.extend(names)
+    
+    def on_details_received(response):
+        payload = Protobuf.extract(response)
+        if response.payloadType == ProtoOAErrorRes().payloadType:
+            # Sin detalles guardamos igualmente ids y nombres
+            print(f"[TEST] ⚠️ No se pudieron obtener los detalles de los símbolos: {payload.errorCode} {payload.description}")
+            save_symbol_table(names, {})
+            return
+        details = {symbol.symbolId: symbol for symbol in payload.symbol}
+        save_symbol_table(names, details)
+    
+    def on_details_error(failure):
+        # Sin detalles guardamos igualmente ids y nombres
+        print(f"[TEST] ⚠️ No se pudieron obtener los detalles de los símbolos: {failure.getErrorMessage()}")
+        save_symbol_table(names, {})
+    
+    # La petición tiene su propio timeout: el global ya no debe cortar la espera
+    if timeout_call.active():
+        timeout_call.cancel()
+    
+    deferred = client.send(request, responseTimeoutInSeconds=30)
+    deferred.addCallbacks(on_details_received, on_details_error)
+
+def save_symbol_table(names, details):
+    """Guarda el catálogo en la tabla binaria que cargan los módulos de trading"""
+    try:
+        records = []
+        for symbol_id, name in names.items():
+            detail = details.get(symbol_id)
+            if detail is not None:
+                records.append((symbol_id, name, detail.digits, detail.pipPosition, detail.lotSize))
+            else:
+                records.append((symbol_id, name, 0, 0, 0))
+        
+        SymbolTable(records).save(SYMBOL_TABLE_FILE)
+        print(f"Tabla binaria de símbolos guardada en {SYMBOL_TABLE_FILE} ({len(records)} símbolos, {len(details)} con detalles)")
+    except Exception as e:
+        print(f"[TEST] ❌ Error guardando la tabla de símbolos: {e}")
+    
+    if not symbols_completed.called:
+        symbols_completed.callback(None)
+
 def on_error(failure):
     """Callback para manejar errores"""
     print(f"[TEST] ❌ Error: {failure}")
@@ -156,7 +213,7 @@ def on_timeout():
         print("[TEST] ⚠️ Timeout de conexión!")
         symbols_completed.errback(Exception("Timeout de conexión"))
 
-reactor.callLater(30, on_timeout)
+timeout_call = reactor.callLater(30, on_timeout)
 
 # Añadir callback para cierre
 symbols_completed.addBoth(shutdown_test)
@@ -0,0 +1,192 @@
+import os
+import sys
+import csv
+import glob
+import argparse
+import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    print("❌ logs_tool.py necesita pyarrow: pip install pyarrow")
+    sys.exit(1)
+
+# Compacta los logs/operations_*.csv en un único almacén columnar (Parquet)
+# y consulta estadísticas por símbolo sobre él.
+#
+# Uso:
+#   python logs_tool.py compact                      # logs/*.csv -> logs/operations.parquet
+#   python logs_tool.py query                        # fills, errores y latencias por símbolo
+#   python logs_tool.py query --symbol BTCUSD --since 2025-04-15
+
+LOGS_DIR = "logs"
+DEFAULT_STORE = os.path.join(LOGS_DIR, "operations.parquet")
+
+# Esquema común que reconcilia las columnas de todas las versiones del webhook
+SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("symbol", pa.string()),
+    ("order", pa.string()),
+    ("volume", pa.float64()),
+    ("sl_money", pa.float64()),
+    ("tp_money", pa.float64()),
+    ("sl_pips", pa.float64()),
+    ("tp_pips", pa.float64()),
+    ("candle_color", pa.string()),
+    ("order_id", pa.string()),
+    ("status", pa.string()),
+    ("latency_ms", pa.float64()),
+    ("source", pa.string()),
+])
+
+FLOAT_COLUMNS = {"volume", "sl_money", "tp_money", "sl_pips", "tp_pips", "latency_ms"}
+
+# Columnas que escribe cada versión del webhook, según el número de campos.
+# OperationLogWriter separa en operations_YYYY-MM_N.csv los ficheros de
+# cabeceras distintas, pero los logs antiguos pueden mezclar filas de varias
+# versiones bajo una única cabecera, así que las filas que no encajan con la
+# cabecera se interpretan por su longitud.
+BASE_COLUMNS = ["timestamp", "symbol", "order", "volume"]
+LAYOUTS = {
+    4: BASE_COLUMNS,                                                              # henry-webhook.py
+    7: BASE_COLUMNS + ["sl_money", "tp_money", "status"],                         # v6
+    8: BASE_COLUMNS + ["sl_pips", "tp_pips", "candle_color", "status"],           # v5
+    9: BASE_COLUMNS + ["sl_pips", "tp_pips", "candle_color", "status", "latency_ms"],  # v7
+}
+STATUS_PREFIXES = ("SUCCESS", "ERROR", "EXCEPTION", "MAINTAINED", "CLOSED", "EXECUTED")
+
+def row_columns(row, header):
+    """Nombres de columna de una fila: la cabecera si encaja, si no la versión por longitud"""
+    if header is not None and len(header) == len(row):
+        return header
+    if len(row) == 5:
+        # v4 escribe el estado y v3 el id de la orden en la quinta columna
+        return BASE_COLUMNS + (["status"] if row[4].startswith(STATUS_PREFIXES) else ["order_id"])
+    return LAYOUTS.get(len(row))
+
+def parse_timestamp(value):
+    """Acepta tanto '2025-04-06 13:59:00' como ISO 8601 con zona horaria"""
+    ts = datetime.datetime.fromisoformat(value)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return ts
+
+def parse_float(value):
+    try:
+        return float(value) if value != "" else None
+    except ValueError:
+        return None
+
+def read_csv_logs(paths):
+    """
+    Lee los CSV mensuales y devuelve una tabla Arrow con el esquema común
+
+    Returns:
+        Tupla (tabla, filas descartadas)
+    """
+    columns = {field.name: [] for field in SCHEMA}
+    skipped = 0
+
+    for path in paths:
+        source = os.path.basename(path)
+        header = None
+        with open(path, newline="") as file:
+            for row in csv.reader(file):
+                if not row:
+                    continue
+                if row[0] == "timestamp":
+                    header = row
+                    continue
+
+                names = row_columns(row, header)
+                if names is None:
+                    skipped += 1
+                    continue
+                try:
+                    record = dict(zip(names, row))
+                    timestamp = parse_timestamp(record["timestamp"])
+                except (KeyError, ValueError):
+                    skipped += 1
+                    continue
+
+                for name in columns:
+                    if name == "timestamp":
+                        columns[name].append(timestamp)
+                    elif name == "source":
+                        columns[name].append(source)
+                    elif name in FLOAT_COLUMNS:
+                        columns[name].append(parse_float(record.get(name, "")))
+                    else:
+                        columns[name].append(record.get(name) or None)
+
+    return pa.table(columns, schema=SCHEMA), skipped
+
+def compact(logs_dir, output):
+    """Convierte todos los operations_*.csv en un único fichero Parquet"""
+    paths = sorted(glob.glob(os.path.join(logs_dir, "operations_*.csv")))
+    if not paths:
+        print(f"⚠️ No hay ficheros operations_*.csv en {logs_dir}")
+        return
+
+    table, skipped = read_csv_logs(paths)
+    table = table.sort_by("timestamp")
+    pq.write_table(table, output, compression="zstd")
+    print(f"✅ {table.num_rows} operaciones de {len(paths)} ficheros guardadas en {output} ({skipped} filas descartadas)")
+
+def query(store, symbol=None, since=None):
+    """
+    Estadísticas por símbolo calculadas con operaciones vectorizadas de Arrow
+
+    - fills: operaciones con estado SUCCESS/EXECUTED
+    - errors: operaciones con estado ERROR/EXCEPTION
+    - error_rate: errores sobre operaciones con estado conocido
+    - latency p50/p90/p99 (ms), si el log incluye latency_ms
+    """
+    table = pq.read_table(store)
+
+    if symbol:
+        table = table.filter(pc.equal(table["symbol"], symbol))
+    if since:
+        table = table.filter(pc.greater_equal(table["timestamp"], pa.scalar(parse_timestamp(since), SCHEMA.field("timestamp").type)))
+
+    status = pc.fill_null(table["status"], "")
+    table = table.append_column("is_fill", pc.match_substring_regex(status, "^(SUCCESS|EXECUTED)"))
+    table = table.append_column("is_error", pc.match_substring_regex(status, "^(ERROR|EXCEPTION)"))
+    table = table.append_column("has_status", pc.not_equal(status, ""))
+
+    stats = table.group_by("symbol").aggregate([
+        ("symbol", "count"),
+        ("is_fill", "sum"),
+        ("is_error", "sum"),
+        ("has_status", "sum"),
+        ("latency_ms", "tdigest", pc.TDigestOptions(q=[0.5, 0.9, 0.99])),
+    ]).sort_by([("symbol_count", "descending")])
+
+    print(f"{'SYMBOL':<12} {'TOTAL':>7} {'FILLS':>7} {'ERRORS':>7} {'ERR%':>7} {'P50ms':>9} {'P90ms':>9} {'P99ms':>9}")
+    for row in stats.to_pylist():
+        with_status = row["has_status_sum"]
+        error_rate = 100.0 * row["is_error_sum"] / with_status if with_status else 0.0
+        quantiles = [q for q in row["latency_ms_tdigest"] or [] if q is not None]
+        p50, p90, p99 = (f"{q:.1f}" for q in quantiles) if len(quantiles) == 3 else ("-", "-", "-")
+        print(f"{str(row['symbol']):<12} {row['symbol_count']:>7} {row['is_fill_sum']:>7} {row['is_error_sum']:>7} {error_rate:>6.1f}% {p50:>9} {p90:>9} {p99:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Almacén columnar de logs/operations_*.csv")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="Convierte los CSV en un único Parquet")
+    compact_parser.add_argument("--logs-dir", default=LOGS_DIR)
+    compact_parser.add_argument("--output", default=DEFAULT_STORE)
+
+    query_parser = subparsers.add_parser("query", help="Fills, errores y latencias por símbolo")
+    query_parser.add_argument("--store", default=DEFAULT_STORE)
+    query_parser.add_argument("--symbol")
+    query_parser.add_argument("--since", help="Fecha mínima (ISO 8601, UTC si no lleva zona)")
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        compact(args.logs_dir, args.output)
+    else:
+        query(args.store, symbol=args.symbol, since=args.since)
@@ -0,0 +1,150 @@
+from ctrader_open_api import Protobuf
+from ctrader_open_api.messages.OpenApiCommonModelMessages_pb2 import ProtoPayloadType
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAPayloadType
+
+
+def payload_type_name(payload_type):
+    """Nombre del payloadType (ej. PROTO_OA_SPOT_EVENT) o el número si no se conoce"""
+    for enum in (ProtoOAPayloadType, ProtoPayloadType):
+        try:
+            return enum.Name(payload_type)
+        except ValueError:
+            pass
+    return str(payload_type)
+
+
+def extract(message):
+    """Payload de un ProtoMessage o de un LazyMessage (ver LazyMessage.extract)"""
+    if isinstance(message, LazyMessage):
+        return message.extract()
+    return Protobuf.extract(message)
+
+
+class LazyMessage:
+    """
+    ProtoMessage recibido cuyo payload aún no se ha extraído.
+
+    Expone la cabecera (payloadType, clientMsgId) para decidir quién lo
+    quiere; el payload se extrae la primera vez que alguien lo pide y se
+    reutiliza en el resto de consumidores. Si nadie lo pide, el mensaje se
+    descarta sin deserializarlo.
+    """
+
+    __slots__ = ("message", "payloadType", "_payload", "_on_extract")
+
+    def __init__(self, message, on_extract=None):
+        """
+        Args:
+            message: ProtoMessage tal como lo entrega el cliente
+            on_extract: Función opcional on_extract(payload_type) llamada la
+                única vez que se extrae el payload
+        """
+        self.message = message
+        self.payloadType = message.payloadType
+        self._payload = None
+        self._on_extract = on_extract
+
+    @property
+    def extracted(self):
+        return self._payload is not None
+
+    @property
+    def clientMsgId(self):
+        return self.message.clientMsgId
+
+    def HasField(self, name):
+        return self.message.HasField(name)
+
+    def extract(self):
+        """Payload del mensaje, extraído solo la primera vez"""
+        if self._payload is None:
+            self._payload = Protobuf.extract(self.message)
+            if self._on_extract is not None:
+                self._on_extract(self.payloadType)
+        return self._payload
+
+
+class MessageRouter:
+    """
+    Reparte los mensajes recibidos entre los manejadores de su payloadType.
+
+    La tabla payloadType → manejadores se monta al registrar, así que cada
+    mensaje solo hace una búsqueda en un diccionario: sin importaciones ni
+    instancias de mensajes para comparar el tipo. El mensaje se extrae una
+    sola vez aunque haya varios manejadores para su tipo, y se cuentan los
+    mensajes recibidos y los extraídos de cada tipo.
+    """
+
+    def __init__(self):
+        # {payloadType: (manejador, ...)}; tupla para recorrerla sin copiar
+        self._handlers = {}
+        # {payloadType: mensajes recibidos}
+        self.counts = {}
+        # {payloadType: mensajes cuyo payload se ha extraído}
+        self.extracted = {}
+
+    def register(self, payload_type, handler):
+        """
+        Añade un manejador para un payloadType
+
+        Args:
+            payload_type: payloadType del mensaje (ej. ProtoOASpotEvent().payloadType)
+            handler: Función handler(client, payload) que recibe el cliente
+                y el mensaje ya extraído
+        """
+        self._handlers[payload_type] = self._handlers.get(payload_type, ()) + (handler,)
+
+    def unregister(self, payload_type, handler):
+        """Quita un manejador; no hace nada si no estaba registrado"""
+        handlers = tuple(h for h in self._handlers.get(payload_type, ()) if h != handler)
+        if handlers:
+            self._handlers[payload_type] = handlers
+        else:
+            self._handlers.pop(payload_type, None)
+
+    def handles(self, payload_type):
+        return payload_type in self._handlers
+
+    def frame(self, message):
+        """
+        Envuelve un ProtoMessage en un LazyMessage que cuenta su extracción
+
+        Hay que usarlo cuando el mensaje tiene más consumidores además del
+        router (por ejemplo el RequestDispatcher), para que lo compartan.
+        """
+        return LazyMessage(message, self._count_extracted)
+
+    def route(self, client, message):
+        """
+        Entrega un ProtoMessage o LazyMessage a los manejadores de su tipo
+
+        Si su tipo no tiene manejadores, el payload no se extrae.
+
+        Returns:
+            True si algún manejador lo ha recibido
+        """
+        payload_type = message.payloadType
+        counts = self.counts
+        counts[payload_type] = counts.get(payload_type, 0) + 1
+
+        handlers = self._handlers.get(payload_type)
+        if handlers is None:
+            return False
+        if isinstance(message, LazyMessage):
+            payload = message.extract()
+        else:
+            payload = Protobuf.extract(message)
+            self._count_extracted(payload_type)
+        for handler in handlers:
+            handler(client, payload)
+        return True
+
+    def _count_extracted(self, payload_type):
+        self.extracted[payload_type] = self.extracted.get(payload_type, 0) + 1
+
+    def stats(self):
+        """Mensajes recibidos y extraídos por tipo, con el nombre del payloadType"""
+        return {
+            payload_type_name(payload_type): {"received": count, "extracted": self.extracted.get(payload_type, 0)}
+            for payload_type, count in sorted(self.counts.items())
+        }
@@ -0,0 +1,124 @@
+# Las distancias relativas de SL/TP de la API van en 1/100000 de unidad de precio
+RELATIVE_SCALE = 100000
+
+
+class ConversionUnavailable(Exception):
+    """Faltan datos (símbolo, cadena de conversión o precio) para convertir"""
+
+
+class MoneyConverter:
+    """
+    Convierte un importe en la divisa de la cuenta en distancias de SL/TP.
+
+    Para cada símbolo se guardan sus dígitos y su divisa de cotización, y
+    para cada divisa de cotización la cadena de símbolos que la lleva hasta
+    la divisa de la cuenta (ProtoOASymbolsForConversionRes). El tipo de
+    cambio se obtiene en cada orden multiplicando los precios medios de esa
+    cadena en el PriceBook, que los spots actualizan en el sitio, así que la
+    conversión no hace ninguna petición de red.
+    """
+
+    def __init__(self, price_book, max_age=None):
+        """
+        Args:
+            price_book: PriceBook suscrito a los símbolos operados y a los de
+                las cadenas de conversión
+            max_age: Antigüedad máxima (segundos) de los precios usados
+        """
+        self.price_book = price_book
+        self.max_age = max_age
+        self.deposit_asset_id = None
+        self._symbols = {}  # {symbol_id: (digits, quote_asset_id)}
+        self._chains = {}  # {quote_asset_id: ((symbol_id, multiplica), ...)}
+
+    def has_symbol(self, symbol_id):
+        return symbol_id in self._symbols
+
+    def has_chain(self, quote_asset_id):
+        return quote_asset_id == self.deposit_asset_id or quote_asset_id in self._chains
+
+    def quote_asset(self, symbol_id):
+        return self._symbols[symbol_id][1]
+
+    def set_symbol(self, symbol_id, digits, quote_asset_id):
+        self._symbols[symbol_id] = (digits, quote_asset_id)
+
+    def set_chain(self, quote_asset_id, light_symbols):
+        """
+        Guarda la cadena de conversión de una divisa de cotización
+
+        Args:
+            quote_asset_id: Divisa de partida
+            light_symbols: ProtoOALightSymbol de ProtoOASymbolsForConversionRes,
+                en orden desde quote_asset_id hasta la divisa de la cuenta
+        """
+        steps = []
+        asset_id = quote_asset_id
+        for symbol in light_symbols:
+            if symbol.baseAssetId == asset_id:
+                # base→quote: 1 unidad de base vale precio unidades de quote
+                steps.append((symbol.symbolId, True))
+                asset_id = symbol.quoteAssetId
+            elif symbol.quoteAssetId == asset_id:
+                steps.append((symbol.symbolId, False))
+                asset_id = symbol.baseAssetId
+            else:
+                raise ValueError(f"Cadena de conversión inválida en el símbolo {symbol.symbolId}")
+        if asset_id != self.deposit_asset_id:
+            raise ValueError(f"La cadena de conversión de {quote_asset_id} no termina en la divisa de la cuenta")
+        self._chains[quote_asset_id] = tuple(steps)
+
+    def conversion_symbol_ids(self):
+        """Símbolos de todas las cadenas (hay que tenerlos suscritos)"""
+        return sorted({symbol_id for chain in self._chains.values() for symbol_id, _ in chain})
+
+    def rate(self, quote_asset_id):
+        """
+        Unidades de la divisa de la cuenta por unidad de quote_asset_id
+
+        Raises:
+            ConversionUnavailable: Si falta la cadena o algún precio
+        """
+        if quote_asset_id == self.deposit_asset_id:
+            return 1.0
+        chain = self._chains.get(quote_asset_id)
+        if chain is None:
+            raise ConversionUnavailable(f"Sin cadena de conversión para el activo {quote_asset_id}")
+        rate = 1.0
+        for symbol_id, multiply in chain:
+            quote = self.price_book.quote(symbol_id, self.max_age)
+            if quote is None:
+                raise ConversionUnavailable(f"Sin precio para el símbolo de conversión {symbol_id}")
+            mid = (quote[0] + quote[1]) / 2.0
+            rate = rate * mid if multiply else rate / mid
+        return rate
+
+    def relative_distance(self, symbol_id, money, volume, round_down=False):
+        """
+        Distancia de precio en la que la posición gana o pierde money
+
+        Args:
+            symbol_id: ID del símbolo
+            money: Importe en la divisa de la cuenta
+            volume: Volumen de la orden tal como se envía (centésimas de unidad)
+            round_down: Redondear hacia abajo (stop loss: no arriesgar más
+                de money); si no, al paso más cercano (take profit)
+
+        Returns:
+            Distancia en 1/100000 de unidad de precio, múltiplo del paso de
+            precio del símbolo y como mínimo un paso
+
+        Raises:
+            ConversionUnavailable: Si falta algún dato para convertir
+        """
+        entry = self._symbols.get(symbol_id)
+        if entry is None:
+            raise ConversionUnavailable(f"Sin datos del símbolo {symbol_id}")
+        digits, quote_asset_id = entry
+        units = volume / 100.0
+        # PnL (divisa de la cuenta) = distancia de precio × unidades × tipo de cambio
+        distance = money / (units * self.rate(quote_asset_id))
+        step = 10 ** (5 - digits) if digits <= 5 else 1
+        steps = distance * RELATIVE_SCALE / step
+        steps = int(steps) if round_down else int(round(steps))
+        return max(steps, 1) * step
@@ -0,0 +1,136 @@
+import os
+import csv
+import time
+import queue
+import atexit
+import datetime
+import threading
+
+
+class OperationLogWriter:
+    """
+    Escritor del log mensual de operaciones fuera del hilo del reactor.
+
+    write() solo encola la fila; un hilo en segundo plano agrupa las filas en
+    lotes y las escribe cuando el lote llega a batch_size filas o pasan
+    flush_interval segundos. El fichero del mes se mantiene abierto y se rota
+    automáticamente al cambiar de mes. Si el fichero del mes ya existe con
+    otra cabecera (lo escribió otra versión del webhook), las filas van a
+    operations_YYYY-MM_2.csv, _3, ... para no mezclar columnas en un fichero.
+    """
+
+    def __init__(self, logs_dir, header, batch_size=100, flush_interval=1.0):
+        """
+        Args:
+            logs_dir: Carpeta de los ficheros operations_YYYY-MM.csv
+            header: Cabecera del CSV (la primera columna es el timestamp)
+            batch_size: Número máximo de filas por escritura
+            flush_interval: Segundos máximos que una fila espera en el búfer
+        """
+        self.logs_dir = logs_dir
+        self.header = header
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue()
+        self._month = None
+        self._file = None
+        self._writer = None
+        self._closed = False
+
+        os.makedirs(logs_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="operation-log", daemon=True)
+        self._thread.start()
+        # Vaciar el búfer al salir del proceso
+        atexit.register(self.close)
+
+    def write(self, row, now=None):
+        """
+        Encola una fila del log sin bloquear
+
+        Args:
+            row: Valores de la fila sin el timestamp
+            now: Fecha UTC de la operación (por defecto, ahora)
+        """
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        self._queue.put((now, row))
+
+    def close(self, timeout=5):
+        """Escribe las filas pendientes y cierra el fichero"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # Agrupar filas hasta completar el lote o agotar el intervalo
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+            if stop:
+                break
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_batch(self, batch):
+        try:
+            for now, row in batch:
+                month = now.strftime("%Y-%m")
+                if month != self._month:
+                    self._rotate(month)
+                self._writer.writerow([now.isoformat(), *row])
+            self._file.flush()
+        except Exception as e:
+            print(f"❌ Error al registrar operaciones: {str(e)}")
+
+    def _rotate(self, month):
+        """Cierra el fichero del mes anterior y abre (o crea) el del nuevo mes"""
+        if self._file is not None:
+            self._file.close()
+
+        log_filename = self._month_filename(month)
+        self._file = open(log_filename, mode="a", newline="")
+        self._writer = csv.writer(self._file)
+        self._month = month
+
+        # En modo append la posición inicial es el final: 0 significa fichero nuevo
+        if self._file.tell() == 0:
+            self._writer.writerow(self.header)
+
+    def _month_filename(self, month):
+        """Primer fichero del mes que no existe o tiene la misma cabecera"""
+        suffix = 1
+        while True:
+            name = f"operations_{month}.csv" if suffix == 1 else f"operations_{month}_{suffix}.csv"
+            log_filename = os.path.join(self.logs_dir, name)
+            try:
+                with open(log_filename, newline="") as file:
+                    header = next(csv.reader(file), None)
+            except FileNotFoundError:
+                return log_filename
+            if header is None or header == list(self.header):
+                return log_filename
+            suffix += 1
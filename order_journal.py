@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from twisted.internet import reactor, defer
+from twisted.python.failure import Failure
+
+# Tipos de registro del diario
+ACCEPTED = "accepted"
+DONE = "done"
+
+
+class OrderJournal:
+    """
+    Diario de órdenes de solo escritura (write-ahead log) en JSON lines.
+
+    Cada señal aceptada se registra antes de responder al webhook y se marca
+    como terminada cuando llega su resultado; las que quedan sin terminar
+    tras una caída se devuelven con pending() para reejecutarlas al arrancar.
+
+    Las escrituras se hacen en un hilo en segundo plano con commit en grupo:
+    todo lo que llega mientras se hace un fsync se escribe junto y se
+    confirma con el siguiente, así que el coste del fsync se reparte entre
+    todas las señales de una ráfaga.
+    """
+
+    def __init__(self, path, clock=reactor):
+        """
+        Args:
+            path: Fichero del diario (se crea si no existe)
+            clock: Reactor en el que se resuelven los deferreds de append()
+        """
+        self.path = path
+        self._clock = clock
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._closed = False
+        self.commits = 0
+        self.records = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="order-journal", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def pending(self):
+        """Registros ACCEPTED sin DONE, en el orden en que se aceptaron"""
+        return list(self._pending.values())
+
+    def accept(self, journal_id, signal, label=None):
+        """
+        Registra una señal aceptada
+
+        Returns:
+            Un deferred que se resuelve cuando el registro está en disco
+            (tras el fsync)
+        """
+        record = {"op": ACCEPTED, "id": journal_id, "label": label or journal_id, "at": time.time(), "signal": signal}
+        self._pending[journal_id] = record
+        return self._append(record)
+
+    def complete(self, journal_id, status):
+        """
+        Marca una señal como terminada (no espera al fsync)
+
+        Si el diario ya está cerrado (órdenes que terminan durante el apagado)
+        solo se avisa: la señal quedará pendiente y se reejecutará al arrancar
+        tras comprobar su etiqueta.
+        """
+        if self._pending.pop(journal_id, None) is None:
+            return defer.succeed(None)
+        if self._closed:
+            print(f"⚠️ Diario de órdenes cerrado: no se pudo marcar {journal_id} como terminada ({status})")
+            return defer.succeed(None)
+        return self._append({"op": DONE, "id": journal_id, "status": status, "at": time.time()})
+
+    def close(self, timeout=5):
+        """Escribe los registros pendientes y cierra el fichero"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _append(self, record):
+        d = defer.Deferred()
+        if self._closed:
+            d.errback(Exception("Diario de órdenes cerrado"))
+            return d
+        self._queue.put((json.dumps(record, default=str), d))
+        return d
+
+    def _load(self):
+        """
+        Lee el diario, se queda con las señales sin terminar y lo compacta
+        reescribiéndolo solo con ellas
+        """
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Última línea a medio escribir si el proceso cayó durante un write
+                continue
+            if record.get("op") == ACCEPTED:
+                self._pending[record["id"]] = record
+            elif record.get("op") == DONE:
+                self._pending.pop(record.get("id"), None)
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for record in self._pending.values():
+                file.write(json.dumps(record, default=str) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # Commit en grupo: todo lo que ya está en cola va en el mismo fsync
+            batch = [item]
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._commit(batch)
+            if stop:
+                break
+
+        self._file.close()
+
+    def _commit(self, batch):
+        try:
+            self._file.write("".join(line + "\n" for line, _ in batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            result = None
+            self.commits += 1
+            self.records += len(batch)
+        except Exception as e:
+            print(f"❌ Error escribiendo el diario de órdenes: {str(e)}")
+            result = Failure(e)
+
+        for _, d in batch:
+            if result is None:
+                self._clock.callFromThread(d.callback, None)
+            else:
+                self._clock.callFromThread(d.errback, result)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "commits": self.commits,
+            "records": self.records,
+            "records_per_commit": round(self.records / self.commits, 2) if self.commits else None,
+        }
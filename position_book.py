@@ -0,0 +1,150 @@
+import time
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import ProtoOAPositionStatus, ProtoOATradeSide
+
+
+class PositionBook:
+    """
+    Libro de posiciones abiertas de la cuenta.
+
+    Las posiciones se guardan por positionId con un índice por symbolId, y se
+    actualizan de forma incremental con cada ProtoOAExecutionEvent. El
+    ProtoOAReconcileRes periódico solo corrige las diferencias, sin vaciar el
+    libro, así que las decisiones de las órdenes leen siempre estado local.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        # {positionId: {"position_id", "symbol_id", "side", "volume", "price", "updated_ts", "seen_at"}}
+        self._positions = {}
+        self._by_symbol = {}  # {symbol_id: {positionId, ...}}
+        # Posiciones cerradas y cuándo se vio el cierre: {positionId: seen_at}.
+        # Evitan que una foto de reconciliación anterior al cierre las reabra
+        self._closed = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, position_id):
+        return position_id in self._positions
+
+    def get(self, position_id):
+        return self._positions.get(position_id)
+
+    def for_symbol(self, symbol_id):
+        """Posiciones abiertas de un símbolo, de la más antigua a la más reciente"""
+        ids = self._by_symbol.get(symbol_id)
+        if not ids:
+            return []
+        return sorted((self._positions[i] for i in ids), key=lambda p: p["position_id"])
+
+    def latest(self, symbol_id):
+        """Posición abierta más reciente de un símbolo, o None"""
+        ids = self._by_symbol.get(symbol_id)
+        if not ids:
+            return None
+        return self._positions[max(ids)]
+
+    def apply_position(self, position):
+        """
+        Aplica el estado de un ProtoOAPosition
+
+        Las actualizaciones más antiguas que la guardada (por
+        utcLastUpdateTimestamp) se ignoran, por si llegan desordenadas.
+
+        Returns:
+            "opened", "updated", "closed" o None si no cambia nada
+        """
+        position_id = position.positionId
+        updated_ts = position.utcLastUpdateTimestamp if position.HasField("utcLastUpdateTimestamp") else 0
+        current = self._positions.get(position_id)
+        if current is not None and updated_ts and updated_ts < current["updated_ts"]:
+            return None
+
+        if position.positionStatus != ProtoOAPositionStatus.POSITION_STATUS_OPEN or not position.tradeData.volume:
+            self._closed[position_id] = self._clock()
+            return "closed" if self._remove(position_id) else None
+        self._closed.pop(position_id, None)
+
+        entry = {
+            "position_id": position_id,
+            "symbol_id": position.tradeData.symbolId,
+            "side": ProtoOATradeSide.Name(position.tradeData.tradeSide),
+            "volume": position.tradeData.volume,
+            "price": position.price,
+            "updated_ts": updated_ts,
+            "seen_at": self._clock(),
+        }
+        if current is not None:
+            if current["symbol_id"] != entry["symbol_id"]:
+                self._remove(position_id)
+            elif all(current[k] == entry[k] for k in ("side", "volume", "price")):
+                current["updated_ts"] = max(current["updated_ts"], updated_ts)
+                current["seen_at"] = entry["seen_at"]
+                return None
+
+        self._positions[position_id] = entry
+        self._by_symbol.setdefault(entry["symbol_id"], set()).add(position_id)
+        return "updated" if current is not None else "opened"
+
+    def apply_execution(self, event):
+        """Aplica un ProtoOAExecutionEvent (solo si trae posición)"""
+        if not event.HasField("position"):
+            return None
+        return self.apply_position(event.position)
+
+    def reconcile(self, positions, since=None):
+        """
+        Corrige el libro con la foto completa de un ProtoOAReconcileRes
+
+        Args:
+            positions: Lista de ProtoOAPosition abiertas según el servidor
+            since: Instante (del reloj del libro) en que se pidió la foto. Las
+                posiciones tocadas o cerradas por eventos posteriores no se
+                modifican, porque la foto puede ser más antigua que ellas
+
+        Returns:
+            Diccionario {"opened": [...], "updated": [...], "closed": [...]}
+            con los positionId corregidos
+        """
+        diff = {"opened": [], "updated": [], "closed": []}
+        snapshot_ids = set()
+
+        for position in positions:
+            snapshot_ids.add(position.positionId)
+            if since is not None:
+                # La foto no pisa el estado de eventos posteriores a la petición
+                closed_at = self._closed.get(position.positionId)
+                current = self._positions.get(position.positionId)
+                if (closed_at is not None and closed_at > since) or (current is not None and current["seen_at"] > since):
+                    continue
+            change = self.apply_position(position)
+            if change is not None:
+                diff[change].append(position.positionId)
+
+        for position_id in [i for i in self._positions if i not in snapshot_ids]:
+            if since is not None and self._positions[position_id]["seen_at"] > since:
+                continue
+            self._remove(position_id)
+            diff["closed"].append(position_id)
+
+        # Los cierres anteriores a la foto ya no pueden aparecer en otra más nueva
+        if since is not None:
+            self._closed = {i: closed_at for i, closed_at in self._closed.items() if closed_at > since}
+
+        return diff
+
+    def clear(self):
+        self._positions.clear()
+        self._by_symbol.clear()
+        self._closed.clear()
+
+    def _remove(self, position_id):
+        entry = self._positions.pop(position_id, None)
+        if entry is None:
+            return False
+        ids = self._by_symbol.get(entry["symbol_id"])
+        if ids is not None:
+            ids.discard(position_id)
+            if not ids:
+                del self._by_symbol[entry["symbol_id"]]
+        return True
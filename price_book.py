@@ -0,0 +1,89 @@
+import time
+from array import array
+
+# Los precios de ProtoOASpotEvent llegan como enteros en 1/100000
+SPOT_PRICE_SCALE = 100000.0
+
+
+class PriceBook:
+    """
+    Libro de precios con el último bid/ask de cada símbolo suscrito.
+
+    Cada símbolo ocupa una posición fija en tres arrays de dobles (bid, ask
+    y hora de la última actualización), que se actualizan en el sitio con
+    cada ProtoOASpotEvent sin crear objetos nuevos por tick.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._slots = {}  # {symbol_id: índice en los arrays}
+        self._bid = array("d")
+        self._ask = array("d")
+        self._updated_at = array("d")
+        # Símbolos con suscripción activa en la conexión actual
+        self.subscribed = set()
+        self.updates = 0
+
+    def __contains__(self, symbol_id):
+        return symbol_id in self._slots
+
+    def _slot(self, symbol_id):
+        slot = self._slots.get(symbol_id)
+        if slot is None:
+            slot = len(self._bid)
+            self._slots[symbol_id] = slot
+            self._bid.append(0.0)
+            self._ask.append(0.0)
+            self._updated_at.append(0.0)
+        return slot
+
+    def update(self, symbol_id, bid=None, ask=None):
+        """Actualiza en el sitio el bid y/o ask de un símbolo"""
+        slot = self._slot(symbol_id)
+        if bid is not None:
+            self._bid[slot] = bid
+        if ask is not None:
+            self._ask[slot] = ask
+        self._updated_at[slot] = self._clock()
+        self.updates += 1
+
+    def update_from_spot(self, spot):
+        """
+        Actualiza el libro con un ProtoOASpotEvent
+
+        Un spot puede traer solo bid o solo ask si el otro no ha cambiado.
+        """
+        self.update(
+            spot.symbolId,
+            bid=spot.bid / SPOT_PRICE_SCALE if spot.HasField("bid") else None,
+            ask=spot.ask / SPOT_PRICE_SCALE if spot.HasField("ask") else None
+        )
+
+    def quote(self, symbol_id, max_age=None):
+        """
+        Devuelve (bid, ask) de un símbolo
+
+        Args:
+            symbol_id: ID del símbolo
+            max_age: Antigüedad máxima en segundos (None para no comprobarla)
+
+        Returns:
+            Tupla (bid, ask), o None si no hay precio completo o está obsoleto
+        """
+        slot = self._slots.get(symbol_id)
+        if slot is None:
+            return None
+        bid = self._bid[slot]
+        ask = self._ask[slot]
+        if not bid or not ask:
+            return None
+        if max_age is not None and self._clock() - self._updated_at[slot] > max_age:
+            return None
+        return bid, ask
+
+    def age(self, symbol_id):
+        """Segundos desde la última actualización del símbolo (None si no existe)"""
+        slot = self._slots.get(symbol_id)
+        if slot is None or not self._updated_at[slot]:
+            return None
+        return self._clock() - self._updated_at[slot]
@@ -0,0 +1,239 @@
+import heapq
+import itertools
+from collections import deque
+from ctrader_open_api import TcpProtocol
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage, ProtoHeartbeatEvent
+from ctrader_open_api.messages.OpenApiMessages_pb2 import (
+    ProtoOANewOrderReq,
+    ProtoOAClosePositionReq,
+    ProtoOAAmendPositionSLTPReq,
+    ProtoOAAmendOrderReq,
+    ProtoOACancelOrderReq,
+    ProtoOASymbolByIdReq,
+    ProtoOASymbolsListReq,
+    ProtoOASubscribeSpotsReq,
+    ProtoOAUnsubscribeSpotsReq,
+)
+from twisted.internet import reactor, defer
+
+HEARTBEAT_EVENT = ProtoHeartbeatEvent().payloadType
+
+# Clases de peticiones, cada una con su propio límite opcional
+TRADING_REQUESTS = "trading"
+NON_TRADING_REQUESTS = "non_trading"
+
+# Prioridades dentro de la cola (menor = antes)
+PRIORITY_ORDER = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_METADATA = 2
+PRIORITY_MARKET_DATA = 3
+
+# {payloadType: (clase, prioridad)}; el resto son peticiones de cuenta
+REQUEST_CLASSES = {
+    **{t().payloadType: (TRADING_REQUESTS, PRIORITY_ORDER) for t in (
+        ProtoOANewOrderReq, ProtoOAClosePositionReq, ProtoOAAmendPositionSLTPReq,
+        ProtoOAAmendOrderReq, ProtoOACancelOrderReq,
+    )},
+    **{t().payloadType: (NON_TRADING_REQUESTS, PRIORITY_METADATA) for t in (
+        ProtoOASymbolByIdReq, ProtoOASymbolsListReq,
+    )},
+    **{t().payloadType: (NON_TRADING_REQUESTS, PRIORITY_MARKET_DATA) for t in (
+        ProtoOASubscribeSpotsReq, ProtoOAUnsubscribeSpotsReq,
+    )},
+}
+
+# Peso de la última espera en la media móvil exponencial
+WAIT_SMOOTHING = 0.2
+
+
+def classify(request):
+    """Clase y prioridad de una petición"""
+    return REQUEST_CLASSES.get(request.payloadType, (NON_TRADING_REQUESTS, PRIORITY_ACCOUNT))
+
+
+class TokenBucket:
+    """Token bucket: rate mensajes por segundo con ráfagas de hasta burst"""
+
+    def __init__(self, rate, burst=None, now=reactor.seconds):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self._now = now
+        self._last = now()
+
+    def _refill(self):
+        now = self._now()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def wait_time(self):
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    Planificador de envíos de una conexión cTrader.
+
+    Cada mensaje consume un token del límite de la conexión y, si su clase
+    tiene límite propio, otro del de su clase. Cuando no hay tokens, los
+    mensajes esperan en una cola por prioridad: las órdenes salen antes que
+    las peticiones de cuenta, de metadatos y de market data, de modo que
+    una ráfaga de suscripciones no retrasa una orden.
+    """
+
+    def __init__(self, rate, burst=None, class_limits=None, clock=reactor):
+        """
+        Args:
+            rate, burst: Mensajes por segundo y ráfaga máxima de la conexión
+            class_limits: Diccionario {clase: (rate, burst)} con límites
+                adicionales por clase de petición
+            clock: Reactor (o task.Clock en pruebas)
+        """
+        self._clock = clock
+        self.bucket = TokenBucket(rate, burst, now=clock.seconds)
+        self.class_buckets = {
+            request_class: TokenBucket(class_rate, class_burst, now=clock.seconds)
+            for request_class, (class_rate, class_burst) in (class_limits or {}).items()
+        }
+        self._seq = itertools.count()
+        # {clase: heap de [prioridad, seq, encolado, send, deferred]}
+        self._queues = {TRADING_REQUESTS: [], NON_TRADING_REQUESTS: []}
+        self._drain_call = None
+        self._metrics = {
+            request_class: {"sent": 0, "queued": 0, "max_depth": 0, "wait_avg": 0.0, "wait_max": 0.0}
+            for request_class in self._queues
+        }
+
+    def depth(self, request_class=None):
+        """Mensajes en cola (de una clase o en total)"""
+        if request_class is not None:
+            return len(self._queues[request_class])
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, request, send):
+        """
+        Envía una petición en cuanto lo permitan los límites
+
+        Args:
+            request: Mensaje protobuf (para clasificarlo)
+            send: Función sin argumentos que hace el envío real y devuelve
+                un deferred con la respuesta
+
+        Returns:
+            Un deferred encadenado al de send. Si se cancela mientras espera
+            en cola, el mensaje no llega a enviarse
+        """
+        request_class, priority = classify(request)
+
+        # Camino rápido: nada en cola y tokens disponibles
+        if not self.depth() and self._can_send(request_class):
+            return self._send(request_class, send, self._clock.seconds())
+
+        entry = [priority, next(self._seq), self._clock.seconds(), send, None]
+        queue = self._queues[request_class]
+
+        def cancel(_):
+            if entry in queue:
+                queue.remove(entry)
+                heapq.heapify(queue)
+
+        entry[4] = defer.Deferred(cancel)
+        heapq.heappush(queue, entry)
+        metrics = self._metrics[request_class]
+        metrics["queued"] += 1
+        metrics["max_depth"] = max(metrics["max_depth"], len(queue))
+        self._drain()
+        return entry[4]
+
+    def _can_send(self, request_class):
+        class_bucket = self.class_buckets.get(request_class)
+        return self.bucket.wait_time() == 0 and (class_bucket is None or class_bucket.wait_time() == 0)
+
+    def _send(self, request_class, send, enqueued_at):
+        self.bucket.take()
+        class_bucket = self.class_buckets.get(request_class)
+        if class_bucket is not None:
+            class_bucket.take()
+
+        metrics = self._metrics[request_class]
+        wait = self._clock.seconds() - enqueued_at
+        metrics["sent"] += 1
+        metrics["wait_avg"] = (1 - WAIT_SMOOTHING) * metrics["wait_avg"] + WAIT_SMOOTHING * wait
+        metrics["wait_max"] = max(metrics["wait_max"], wait)
+        return defer.maybeDeferred(send)
+
+    def _drain(self):
+        """Envía lo que permitan los tokens y programa el siguiente intento"""
+        if self._drain_call is not None and self._drain_call.active():
+            self._drain_call.cancel()
+        self._drain_call = None
+
+        while True:
+            # Cabeza más prioritaria entre las clases con token disponible
+            heads = [
+                (queue[0], request_class) for request_class, queue in self._queues.items()
+                if queue and self._can_send(request_class)
+            ]
+            if not heads:
+                break
+            entry, request_class = min(heads, key=lambda head: head[0][:2])
+            heapq.heappop(self._queues[request_class])
+            _, _, enqueued_at, send, deferred = entry
+            self._send(request_class, send, enqueued_at).chainDeferred(deferred)
+
+        waits = [
+            max(self.bucket.wait_time(), self.class_buckets[request_class].wait_time() if request_class in self.class_buckets else 0.0)
+            for request_class, queue in self._queues.items() if queue
+        ]
+        if waits:
+            self._drain_call = self._clock.callLater(min(waits), self._drain)
+
+    def stats(self):
+        """Métricas por clase: enviados, encolados, profundidad y espera en cola"""
+        return {
+            request_class: {
+                "depth": len(self._queues[request_class]),
+                "max_depth": metrics["max_depth"],
+                "sent": metrics["sent"],
+                "queued": metrics["queued"],
+                "wait_ms_avg": round(metrics["wait_avg"] * 1000.0, 3),
+                "wait_ms_max": round(metrics["wait_max"] * 1000.0, 3),
+            }
+            for request_class, metrics in self._metrics.items()
+        }
+
+
+class ImmediateTcpProtocol(TcpProtocol):
+    """
+    TcpProtocol que envía cada mensaje en el momento.
+
+    El TcpProtocol de la librería encola los mensajes y los envía en lotes
+    de numberOfMessagesToSendPerSecond una vez por segundo, lo que añade
+    hasta 1 s a cada orden, y su cola es un atributo de clase compartido
+    por todas las conexiones del proceso. Aquí el ritmo lo marca RateLimiter.
+
+    Al recibir solo se lee la cabecera (ProtoMessage): el payload queda en
+    bytes hasta que algún consumidor lo extrae (ver message_router.LazyMessage).
+    """
+
+    def connectionMade(self):
+        self._send_queue = deque()
+        super().connectionMade()
+
+    def send(self, message, instant=False, clientMsgId=None, isCanceled=None):
+        if isCanceled is not None and isCanceled():
+            return
+        super().send(message, instant=True, clientMsgId=clientMsgId)
+
+    def stringReceived(self, data):
+        message = ProtoMessage()
+        message.ParseFromString(data)
+        if message.payloadType == HEARTBEAT_EVENT:
+            self.heartbeat()
+        self.factory.received(message)
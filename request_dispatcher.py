@@ -0,0 +1,144 @@
+import itertools
+from message_router import extract
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoErrorRes
+from ctrader_open_api.messages.OpenApiMessages_pb2 import ProtoOAErrorRes, ProtoOAOrderErrorEvent
+from twisted.internet import reactor, defer
+
+# Tipos de mensaje que indican que la petición ha fallado
+ERROR_PAYLOAD_TYPES = frozenset([
+    ProtoErrorRes().payloadType,
+    ProtoOAErrorRes().payloadType,
+    ProtoOAOrderErrorEvent().payloadType,
+])
+
+
+class RequestError(Exception):
+    """Error devuelto por el servidor para una petición concreta"""
+
+    def __init__(self, response):
+        self.response = response
+        self.error_code = getattr(response, "errorCode", "")
+        description = getattr(response, "description", "")
+        super().__init__(f"{self.error_code}: {description}" if description else str(self.error_code))
+
+
+class RequestDispatcher:
+    """
+    Correlaciona peticiones y respuestas sobre una única conexión cTrader.
+
+    Las peticiones pendientes se guardan en un diccionario indexado por
+    clientMsgId, así que cada respuesta se entrega a quien la pidió en O(1)
+    sin reemplazar el callback global messageReceivedCallback del cliente.
+    Los eventos sin clientMsgId (por ejemplo ProtoOASpotEvent) los reparte
+    el MessageRouter.
+    """
+
+    def __init__(self, clock=reactor):
+        self._clock = clock
+        self._msg_ids = itertools.count(1)
+        # {clientMsgId: (deferred, timeout_call, until, última respuesta intermedia)}
+        self._pending = {}
+
+    def pending_count(self):
+        """Número de peticiones en curso"""
+        return len(self._pending)
+
+    def send(self, client, request, timeout=5, until=None):
+        """
+        Envía una petición y devuelve un deferred con su respuesta
+
+        Args:
+            client: Cliente cTrader por el que se envía la petición
+            request: Mensaje protobuf a enviar
+            timeout: Segundos máximos de espera de la respuesta
+            until: Función opcional que recibe cada respuesta con el mismo
+                clientMsgId y devuelve True cuando es la definitiva (por
+                ejemplo ORDER_FILLED tras ORDER_ACCEPTED). Si vence el
+                timeout tras alguna respuesta intermedia, se resuelve con la
+                última recibida
+
+        Returns:
+            Un deferred que se resolverá con la respuesta ya extraída, o
+            fallará con RequestError si el servidor responde con un error
+        """
+        msg_id = f"req-{next(self._msg_ids)}"
+        response_deferred = defer.Deferred()
+
+        def on_timeout():
+            entry = self._pending.pop(msg_id, None)
+            if entry is None or entry[0].called:
+                return
+            if entry[3] is not None:
+                entry[0].callback(entry[3])
+            else:
+                entry[0].errback(defer.TimeoutError(f"Timeout esperando respuesta a {type(request).__name__}"))
+
+        self._pending[msg_id] = (response_deferred, self._clock.callLater(timeout, on_timeout), until, None)
+
+        # El deferred del cliente solo nos interesa si falla el envío
+        def on_send_error(failure):
+            self._fail(msg_id, failure)
+            return None
+
+        send_deferred = client.send(request, clientMsgId=msg_id, responseTimeoutInSeconds=timeout)
+        send_deferred.addErrback(on_send_error)
+
+        return response_deferred
+
+    def dispatch(self, message):
+        """
+        Entrega un mensaje recibido a la petición que le corresponda
+
+        El payload solo se extrae si hay una petición pendiente con su
+        clientMsgId; con un LazyMessage se reutiliza el ya extraído por
+        otros consumidores.
+
+        Args:
+            message: ProtoMessage o LazyMessage recibido del servidor
+
+        Returns:
+            True si el mensaje se ha entregado a alguna petición
+        """
+        msg_id = message.clientMsgId if message.HasField("clientMsgId") else None
+        if not msg_id or msg_id not in self._pending:
+            return False
+
+        response_deferred, timeout_call, until, _ = self._pending[msg_id]
+        payload = extract(message)
+        is_error = message.payloadType in ERROR_PAYLOAD_TYPES
+
+        # Respuesta intermedia: seguir esperando la definitiva
+        if not is_error and until is not None and not until(payload):
+            self._pending[msg_id] = (response_deferred, timeout_call, until, payload)
+            return True
+
+        del self._pending[msg_id]
+        if timeout_call.active():
+            timeout_call.cancel()
+        if response_deferred.called:
+            return True
+        if is_error:
+            response_deferred.errback(RequestError(payload))
+        else:
+            response_deferred.callback(payload)
+        return True
+
+    def fail_all(self, reason):
+        """Falla todas las peticiones pendientes (por ejemplo al desconectar)"""
+        pending, self._pending = self._pending, {}
+
+        for response_deferred, timeout_call, _, _ in pending.values():
+            if timeout_call.active():
+                timeout_call.cancel()
+            if not response_deferred.called:
+                response_deferred.errback(Exception(reason))
+
+    def _fail(self, msg_id, failure):
+        entry = self._pending.pop(msg_id, None)
+        if entry is None:
+            return
+        response_deferred, timeout_call = entry[0], entry[1]
+        if timeout_call.active():
+            timeout_call.cancel()
+        if not response_deferred.called:
+            response_deferred.errback(failure)
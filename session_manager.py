@@ -0,0 +1,438 @@
+import os
+import json
+import time
+import random
+from ctrader_open_api import Client, Protobuf
+from ctrader_open_api.messages.OpenApiMessages_pb2 import (
+    ProtoOAApplicationAuthReq,
+    ProtoOAAccountAuthReq,
+    ProtoOARefreshTokenReq,
+    ProtoOAAccountsTokenInvalidatedEvent,
+    ProtoOAAccountDisconnectEvent,
+)
+from twisted.application.internet import backoffPolicy
+from twisted.internet import reactor, defer
+from rate_limiter import ImmediateTcpProtocol
+
+# payloadType de los eventos de sesión, calculados una sola vez
+TOKEN_INVALIDATED_EVENT = ProtoOAAccountsTokenInvalidatedEvent().payloadType
+ACCOUNT_DISCONNECT_EVENT = ProtoOAAccountDisconnectEvent().payloadType
+
+# Segundos tras recibir un token renovado en los que un aviso de token
+# invalidado se considera el mismo que provocó la renovación
+TOKEN_UPDATE_GRACE = 10
+
+# Estados de la sesión
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+AUTHENTICATING = "authenticating"
+SYNCING = "syncing"
+READY = "ready"
+
+
+class SessionNotReady(Exception):
+    """La sesión cTrader no ha quedado lista dentro del tiempo de espera"""
+
+
+class SessionManager:
+    """
+    Sesión cTrader persistente y precalentada.
+
+    Conecta y completa la autenticación de la aplicación y de la cuenta al
+    arrancar, reconecta con backoff exponencial con jitter (el ClientService
+    del cliente se encarga de reintentar con esa política) y renueva el
+    token de acceso antes de que caduque, reautenticando la cuenta sobre la
+    misma conexión. El estado de la sesión se consulta con is_ready y
+    wait_ready(timeout) permite esperar a que esté lista con un límite.
+
+    Tras cada autenticación (al arrancar, al reconectar o al reautenticar la
+    cuenta) la sesión pasa por SYNCING mientras on_sync sincroniza el estado
+    local, y solo queda lista cuando termina.
+    """
+
+    def __init__(self, host, port, client_id, client_secret, account_id, access_token,
+                 refresh_token=None, token_expires_at=None, token_file=None, dispatcher=None, limiter=None, extra_accounts=(),
+                 token_owner=True, token_wait_timeout=30.0,
+                 on_sync=None, on_ready=None, on_lost=None, on_message=None, on_token_refreshed=None,
+                 backoff_initial=1.0, backoff_max=60.0, reauth_margin=3600, clock=reactor):
+        """
+        Args:
+            host, port: Servidor de la API de cTrader
+            client_id, client_secret: Credenciales de la aplicación
+            account_id: ctidTraderAccountId de la cuenta
+            access_token, refresh_token: Tokens OAuth de la cuenta
+            token_expires_at: Caducidad del access token (epoch en segundos),
+                si se conoce
+            token_file: Fichero JSON donde se guardan los tokens renovados;
+                si existe al arrancar, tiene prioridad sobre los argumentos
+            dispatcher: RequestDispatcher usado para las peticiones de
+                autenticación
+            limiter: RateLimiter opcional de la conexión; las peticiones de
+                autenticación y renovación del token pasan por él como el
+                resto de mensajes
+            extra_accounts: Otras cuentas del mismo token que se autentican
+                sobre la misma conexión (por ejemplo, para copy trading)
+            token_owner: False si el token lo renueva otra sesión: cuando el
+                servidor lo invalida, esta espera a recibir el nuevo con
+                update_access_token y reautentica sobre la misma conexión
+            token_wait_timeout: Segundos que una sesión no propietaria
+                espera el token renovado antes de reconectar
+            on_sync: Función llamada tras cada autenticación, antes de que
+                la sesión quede lista; si devuelve un deferred, wait_ready
+                no se resuelve hasta que termina, y si falla se corta la
+                conexión para reintentar
+            on_ready: Función llamada cada vez que la sesión queda lista
+            on_lost: Función llamada con el motivo cuando se pierde la conexión
+            on_message: Función (client, message) para el resto de mensajes
+            on_token_refreshed: Función llamada con el access token nuevo
+                cada vez que se renueva (para compartirlo con otras sesiones)
+            backoff_initial, backoff_max: Espera inicial y máxima (segundos)
+                entre reintentos de conexión
+            reauth_margin: Segundos de antelación con que se renueva el token
+        """
+        self.account_id = account_id
+        self.extra_accounts = [a for a in extra_accounts if a != account_id]
+        # Cuentas autenticadas en la conexión actual
+        self.authorized_accounts = set()
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.token_expires_at = token_expires_at
+        self.token_file = token_file
+        self.token_owner = token_owner
+        self.token_wait_timeout = token_wait_timeout
+        self.dispatcher = dispatcher
+        self.limiter = limiter
+        self.on_sync = on_sync
+        self.on_ready = on_ready
+        self.on_lost = on_lost
+        self.on_message = on_message
+        self.on_token_refreshed = on_token_refreshed
+        self.reauth_margin = reauth_margin
+        self._clock = clock
+
+        self.state = DISCONNECTED
+        self._ready_waiters = []
+        self._reauth_call = None
+        self._refreshing = None
+        self._token_wait_call = None
+        self._token_updated_at = None
+        # Se incrementa en cada sincronización y desconexión: una
+        # sincronización que termina tarde no marca la sesión como lista
+        self._sync_generation = 0
+
+        self._load_tokens()
+
+        self.client = Client(
+            host,
+            port,
+            ImmediateTcpProtocol,
+            retryPolicy=backoffPolicy(initialDelay=backoff_initial, maxDelay=backoff_max, factor=2.0, jitter=random.random)
+        )
+        self.client.setConnectedCallback(self._on_connected)
+        self.client.setDisconnectedCallback(self._on_disconnected)
+        self.client.setMessageReceivedCallback(self._on_message)
+
+    @property
+    def is_ready(self):
+        return self.state == READY
+
+    def start(self):
+        """Conecta (si no se ha hecho ya) y devuelve un deferred de la primera sesión lista"""
+        if not self.client.running:
+            print("[cTrader] 🔄 Inicializando sesión...")
+            self.state = CONNECTING
+            self.client.startService()
+        return self.wait_ready()
+
+    def stop(self):
+        self._cancel_reauth()
+        self._cancel_token_wait()
+        self.client.stopService()
+
+    def wait_ready(self, timeout=None):
+        """
+        Espera a que la sesión esté lista
+
+        Args:
+            timeout: Segundos máximos de espera (None para esperar sin límite)
+
+        Returns:
+            Un deferred que se resuelve cuando la sesión está lista, o falla
+            con SessionNotReady si vence el timeout
+        """
+        if self.is_ready:
+            return defer.succeed(None)
+
+        waiter = defer.Deferred()
+        timeout_call = None
+        if timeout is not None:
+            def on_timeout():
+                self._ready_waiters[:] = [w for w in self._ready_waiters if w[0] is not waiter]
+                if not waiter.called:
+                    waiter.errback(SessionNotReady(f"Sesión cTrader no lista tras {timeout}s (estado: {self.state})"))
+            timeout_call = self._clock.callLater(timeout, on_timeout)
+        self._ready_waiters.append((waiter, timeout_call))
+        return waiter
+
+    def reauthenticate(self):
+        """Repite la autenticación de la cuenta sobre la conexión actual"""
+        if not self.client.isConnected:
+            return defer.succeed(None)
+        self.state = AUTHENTICATING
+        return self._account_auth().addCallbacks(lambda _: self._set_ready(), self._on_auth_error)
+
+    def update_access_token(self, access_token):
+        """Usa un access token renovado por otra sesión y reautentica la cuenta"""
+        self.access_token = access_token
+        self._token_updated_at = self._clock.seconds()
+        self._cancel_token_wait()
+        return self.reauthenticate()
+
+    def refresh_access_token(self):
+        """
+        Renueva el access token con el refresh token y reautentica la cuenta
+
+        Returns:
+            Un deferred que se resuelve cuando la cuenta usa ya el token nuevo
+        """
+        if self._refreshing is not None:
+            return self._refreshing
+        if not self.refresh_token:
+            return defer.fail(Exception("No hay refresh token: no se puede renovar el access token"))
+
+        request = ProtoOARefreshTokenReq()
+        request.refreshToken = self.refresh_token
+
+        def on_refreshed(response):
+            self.access_token = response.accessToken
+            self.refresh_token = response.refreshToken or self.refresh_token
+            self.token_expires_at = time.time() + response.expiresIn if response.expiresIn else None
+            self._save_tokens()
+            print("[cTrader] 🔑 Access token renovado")
+            if self.on_token_refreshed is not None:
+                self.on_token_refreshed(self.access_token)
+            return self._account_auth()
+
+        def on_done(result):
+            self._refreshing = None
+            return result
+
+        d = self._refreshing = self._send(request).addCallback(on_refreshed)
+        d.addBoth(on_done)
+        return d
+
+    def _on_connected(self, client):
+        print("[cTrader] ✅ Conectado al servidor")
+        self.state = AUTHENTICATING
+
+        request = ProtoOAApplicationAuthReq()
+        request.clientId = self.client_id
+        request.clientSecret = self.client_secret
+
+        def on_app_auth(_):
+            print("[cTrader] ✅ Aplicación autenticada correctamente")
+            # Si el token ya ha caducado (o está a punto), renovarlo antes de usarlo
+            if self._token_expiring() and self.refresh_token:
+                return self.refresh_access_token()
+            return self._account_auth()
+
+        d = self._send(request).addCallback(on_app_auth)
+        d.addCallbacks(lambda _: self._set_ready(), self._on_auth_error)
+
+    def _send(self, request, timeout=10):
+        """Envía una petición de la sesión, pasando por el limitador si lo hay"""
+        def send():
+            return self.dispatcher.send(self.client, request, timeout=timeout)
+        return self.limiter.submit(request, send) if self.limiter is not None else send()
+
+    def _account_auth(self):
+        """Autentica la cuenta principal y, después, las adicionales"""
+        d = self._auth_account(self.account_id)
+        if self.extra_accounts:
+            d.addCallback(lambda _: self._auth_extra_accounts())
+        return d
+
+    def _auth_account(self, account_id):
+        request = ProtoOAAccountAuthReq()
+        request.ctidTraderAccountId = account_id
+        request.accessToken = self.access_token
+
+        def on_authorized(response):
+            self.authorized_accounts.add(account_id)
+            return response
+
+        return self._send(request).addCallback(on_authorized)
+
+    def _auth_extra_accounts(self):
+        """Autentica las cuentas adicionales en paralelo; las que fallen no
+        impiden que la sesión quede lista"""
+        def on_error(failure, account_id):
+            self.authorized_accounts.discard(account_id)
+            print(f"[cTrader] ⚠️ No se pudo autenticar la cuenta {account_id}: {failure.getErrorMessage()}")
+            return None
+
+        return defer.gatherResults([
+            self._auth_account(account_id).addErrback(on_error, account_id)
+            for account_id in self.extra_accounts
+        ])
+
+    def _on_auth_error(self, failure):
+        print(f"[cTrader] ❌ Error de autenticación: {failure.getErrorMessage()}")
+        self._drop_connection()
+        return None
+
+    def _on_sync_error(self, failure):
+        print(f"[cTrader] ❌ Error sincronizando la sesión: {failure.getErrorMessage()}")
+        self._drop_connection()
+        return None
+
+    def _drop_connection(self):
+        """Corta la conexión: el ClientService reintentará con backoff"""
+        if self.client.isConnected:
+            self.client.whenConnected().addCallback(lambda protocol: protocol.transport.loseConnection())
+
+    def _set_ready(self):
+        if not self.client.isConnected:
+            return
+        was_ready = self.is_ready
+        print(f"[cTrader] ✅ Cuenta {self.account_id} autenticada correctamente ({len(self.authorized_accounts)} cuentas en la sesión)")
+        self._schedule_reauth()
+        if was_ready or self.on_sync is None:
+            self._mark_ready(was_ready)
+            return
+
+        # Sincronizar el estado local (posiciones) antes de aceptar órdenes
+        self.state = SYNCING
+        self._sync_generation += 1
+        generation = self._sync_generation
+
+        def on_synced(_):
+            if generation == self._sync_generation and self.state == SYNCING and self.client.isConnected:
+                self._mark_ready(False)
+
+        def on_sync_failed(failure):
+            if generation == self._sync_generation:
+                return self._on_sync_error(failure)
+
+        defer.maybeDeferred(self.on_sync).addCallbacks(on_synced, on_sync_failed)
+
+    def _mark_ready(self, was_ready):
+        self.state = READY
+
+        waiters, self._ready_waiters = self._ready_waiters, []
+        for waiter, timeout_call in waiters:
+            if timeout_call is not None and timeout_call.active():
+                timeout_call.cancel()
+            if not waiter.called:
+                waiter.callback(None)
+
+        if not was_ready and self.on_ready is not None:
+            self.on_ready()
+
+    def _on_disconnected(self, client, reason):
+        print(f"[cTrader] ❌ Desconectado: {reason}")
+        self.state = CONNECTING if self.client.running else DISCONNECTED
+        self._sync_generation += 1
+        self.authorized_accounts.clear()
+        self._cancel_reauth()
+        self._cancel_token_wait()
+        if self.on_lost is not None:
+            self.on_lost(reason)
+
+    def _on_message(self, client, message):
+        if message.payloadType == TOKEN_INVALIDATED_EVENT:
+            if self.token_owner:
+                print("[cTrader] 🔑 Token invalidado por el servidor: renovando...")
+                self.state = AUTHENTICATING
+                self.refresh_access_token().addCallbacks(lambda _: self._set_ready(), self._on_auth_error)
+            elif self._token_updated_at is not None and self._clock.seconds() - self._token_updated_at < TOKEN_UPDATE_GRACE:
+                # El propietario ya ha renovado el token y esta sesión ya lo usa
+                pass
+            else:
+                print("[cTrader] 🔑 Token invalidado por el servidor: esperando el token renovado...")
+                self.state = AUTHENTICATING
+                self._wait_token_update()
+        elif message.payloadType == ACCOUNT_DISCONNECT_EVENT:
+            event = Protobuf.extract(message)
+            if event.ctidTraderAccountId == self.account_id:
+                print("[cTrader] 🔄 Cuenta desconectada por el servidor: reautenticando...")
+                self.reauthenticate()
+            elif event.ctidTraderAccountId in self.extra_accounts:
+                self.authorized_accounts.discard(event.ctidTraderAccountId)
+                self._auth_account(event.ctidTraderAccountId).addErrback(
+                    lambda failure: print(f"[cTrader] ⚠️ No se pudo reautenticar la cuenta {event.ctidTraderAccountId}: {failure.getErrorMessage()}")
+                )
+
+        if self.on_message is not None:
+            self.on_message(client, message)
+
+    def _wait_token_update(self):
+        """Espera a que la sesión propietaria reparta el token renovado; si no
+        llega en token_wait_timeout segundos, reconecta"""
+        def on_timeout():
+            self._token_wait_call = None
+            print(f"[cTrader] ❌ No se recibió el token renovado en {self.token_wait_timeout}s")
+            self._drop_connection()
+
+        self._cancel_token_wait()
+        self._token_wait_call = self._clock.callLater(self.token_wait_timeout, on_timeout)
+
+    def _cancel_token_wait(self):
+        if self._token_wait_call is not None and self._token_wait_call.active():
+            self._token_wait_call.cancel()
+        self._token_wait_call = None
+
+    def _token_expiring(self):
+        return self.token_expires_at is not None and self.token_expires_at - time.time() <= self.reauth_margin
+
+    def _schedule_reauth(self):
+        """Programa la renovación del token reauth_margin segundos antes de que caduque"""
+        self._cancel_reauth()
+        if self.token_expires_at is None or not self.refresh_token:
+            return
+        delay = max(self.token_expires_at - time.time() - self.reauth_margin, 0)
+        self._reauth_call = self._clock.callLater(delay, self._scheduled_refresh)
+
+    def _scheduled_refresh(self):
+        """Renovación programada: el token actual sigue valiendo, así que si
+        falla se reintenta más tarde sin cortar la sesión"""
+        def on_error(failure):
+            print(f"[cTrader] ⚠️ Error renovando el access token, se reintentará: {failure.getErrorMessage()}")
+            self._reauth_call = self._clock.callLater(60, self._scheduled_refresh)
+
+        self.refresh_access_token().addCallbacks(lambda _: self._set_ready(), on_error)
+
+    def _cancel_reauth(self):
+        if self._reauth_call is not None and self._reauth_call.active():
+            self._reauth_call.cancel()
+        self._reauth_call = None
+
+    def _load_tokens(self):
+        if not self.token_file:
+            return
+        try:
+            with open(self.token_file) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        self.access_token = data.get("access_token") or self.access_token
+        self.refresh_token = data.get("refresh_token") or self.refresh_token
+        self.token_expires_at = data.get("expires_at", self.token_expires_at)
+
+    def _save_tokens(self):
+        """Guarda los tokens renovados de forma atómica"""
+        if not self.token_file:
+            return
+        tmp_path = f"{self.token_file}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump({
+                    "access_token": self.access_token,
+                    "refresh_token": self.refresh_token,
+                    "expires_at": self.token_expires_at,
+                }, file)
+            os.replace(tmp_path, self.token_file)
+        except OSError as e:
+            print(f"[cTrader] ⚠️ No se pudieron guardar los tokens renovados: {e}")
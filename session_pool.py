@@ -0,0 +1,195 @@
+import time
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from session_manager import SessionNotReady, DISCONNECTED, READY
+
+# Roles de las sesiones del pool
+TRADING = "trading"
+MARKET_DATA = "market_data"
+
+# Peso de la última medida en la media móvil exponencial del RTT
+RTT_SMOOTHING = 0.2
+
+
+class PooledSession:
+    """
+    Sesión del pool con su propio RequestDispatcher y métricas de carga.
+
+    Cada sesión tiene su conexión, así que sus peticiones pendientes solo
+    fallan si cae esa conexión. Se cuentan las peticiones en curso y se
+    mantiene una media móvil del RTT de las respuestas. Si tiene un
+    RateLimiter, las peticiones pasan por él antes de enviarse.
+    """
+
+    def __init__(self, name, role, session, dispatcher, limiter=None, clock=time.perf_counter):
+        self.name = name
+        self.role = role
+        self.session = session
+        self.dispatcher = dispatcher
+        self.limiter = limiter
+        self._clock = clock
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.rtt = None  # Segundos (media móvil)
+
+    @property
+    def client(self):
+        return self.session.client
+
+    @property
+    def is_ready(self):
+        return self.session.is_ready
+
+    def load(self):
+        """Clave de ordenación para elegir la sesión menos cargada"""
+        return (self.in_flight, self.rtt or 0.0)
+
+    def send(self, request, timeout=5, until=None):
+        """Envía una petición por esta sesión (ver RequestDispatcher.send)"""
+        self.in_flight += 1
+        self.requests += 1
+
+        # El RTT y el timeout cuentan desde el envío real, sin la espera en cola
+        def dispatch():
+            start = self._clock()
+
+            def on_response(response):
+                elapsed = self._clock() - start
+                self.rtt = elapsed if self.rtt is None else (1 - RTT_SMOOTHING) * self.rtt + RTT_SMOOTHING * elapsed
+                return response
+
+            return self.dispatcher.send(self.client, request, timeout=timeout, until=until).addCallback(on_response)
+
+        def on_done(result):
+            self.in_flight -= 1
+            if isinstance(result, Failure):
+                self.errors += 1
+            return result
+
+        sent = self.limiter.submit(request, dispatch) if self.limiter is not None else dispatch()
+        return sent.addBoth(on_done)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "role": self.role,
+            "state": self.session.state,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "rtt_ms": round(self.rtt * 1000.0, 3) if self.rtt is not None else None,
+            "rate_limiter": self.limiter.stats() if self.limiter is not None else None,
+        }
+
+
+class SessionPool:
+    """
+    Pool de sesiones cTrader autenticadas.
+
+    Las órdenes van a la sesión de trading lista con menos peticiones en
+    curso (y, a igualdad, menor RTT). Las suscripciones de precios y las
+    peticiones de metadatos van a sesiones de market data dedicadas, para
+    que una ráfaga de ProtoOASpotEvent no retrase las órdenes; si no hay
+    sesiones de market data, las comparten las de trading.
+    """
+
+    def __init__(self, trading, market_data=()):
+        """
+        Args:
+            trading: Lista de PooledSession de trading (al menos una)
+            market_data: Lista de PooledSession de market data (opcional)
+        """
+        self.trading = list(trading)
+        self.market_data = list(market_data)
+        self._by_client = {pooled.client: pooled for pooled in self.all()}
+
+    def all(self):
+        return self.trading + self.market_data
+
+    def for_client(self, client):
+        """PooledSession a la que pertenece un cliente"""
+        return self._by_client.get(client)
+
+    @property
+    def is_ready(self):
+        """True si hay al menos una sesión de trading lista"""
+        return any(pooled.is_ready for pooled in self.trading)
+
+    @property
+    def state(self):
+        """Estado del pool: el de la mejor sesión de trading"""
+        if self.is_ready:
+            return READY
+        return self.trading[0].session.state if self.trading else DISCONNECTED
+
+    def trading_session(self, account_id=None):
+        """
+        Sesión de trading lista menos cargada (la primera si no hay ninguna lista)
+
+        Con account_id solo se consideran las sesiones en las que esa cuenta
+        está autenticada.
+        """
+        ready = [
+            pooled for pooled in self.trading
+            if pooled.is_ready and (account_id is None or account_id in pooled.session.authorized_accounts)
+        ]
+        if not ready:
+            return self.trading[0]
+        return min(ready, key=PooledSession.load)
+
+    def market_data_sessions(self):
+        return self.market_data or self.trading
+
+    def market_data_session(self, symbol_id=None):
+        """
+        Sesión de market data de un símbolo
+
+        Las suscripciones viven en la conexión en la que se hicieron, así que
+        cada símbolo se asigna siempre a la misma sesión. Sin symbol_id
+        (peticiones de metadatos) se usa la sesión lista menos cargada.
+        """
+        sessions = self.market_data_sessions()
+        if symbol_id is not None:
+            return sessions[symbol_id % len(sessions)]
+        ready = [pooled for pooled in sessions if pooled.is_ready]
+        return min(ready, key=PooledSession.load) if ready else sessions[0]
+
+    def start(self):
+        """Arranca todas las sesiones y devuelve un deferred de la primera de trading lista"""
+        for pooled in self.all():
+            pooled.session.start()
+        return self.wait_ready()
+
+    def stop(self):
+        for pooled in self.all():
+            pooled.session.stop()
+
+    def wait_ready(self, timeout=None):
+        """
+        Espera a que alguna sesión de trading esté lista
+
+        Returns:
+            Un deferred que se resuelve con la primera sesión lista, o falla
+            con SessionNotReady si vence el timeout
+        """
+        if self.is_ready:
+            return defer.succeed(self.trading_session())
+
+        waiters = [
+            pooled.session.wait_ready(timeout).addCallback(lambda _, pooled=pooled: pooled)
+            for pooled in self.trading
+        ]
+
+        def on_result(result):
+            # Con fireOnOneCallback llega (resultado, índice) de la primera
+            # sesión lista; si todas vencen, la lista de (False, failure)
+            if isinstance(result, tuple):
+                return result[0]
+            raise SessionNotReady(f"Ninguna sesión cTrader lista tras {timeout}s (estado: {self.state})")
+
+        return defer.DeferredList(waiters, fireOnOneCallback=True, consumeErrors=True).addCallback(on_result)
+
+    def stats(self):
+        """Métricas por sesión: estado, peticiones en curso, errores y RTT"""
+        return [pooled.stats() for pooled in self.all()]
@@ -0,0 +1,182 @@
+import json
+import hashlib
+from collections import OrderedDict
+from twisted.internet import reactor, defer
+from twisted.python.failure import Failure
+
+# Campos del payload que no cambian la orden y no cuentan para el hash
+IGNORED_FIELDS = frozenset(["token", "wait", "wait_timeout"])
+
+# Campos que deben coincidir para fusionar dos señales en una orden neta
+MERGE_FIELDS = ("symbol", "side", "sl_pips", "tp_pips", "candle_color", "group")
+
+# Campos que una señal fusionada toma del lote en el que entra
+SHARED_FIELDS = ("timings", "label")
+
+# Resultado de SignalCoalescer.submit
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+MERGED = "merged"
+
+
+def signal_key(data, client_key=None):
+    """
+    Clave de idempotencia de una señal
+
+    Args:
+        data: Payload del webhook
+        client_key: Identificador enviado por el cliente (cabecera
+            Idempotency-Key o campo "idempotency_key"), si lo hay
+
+    Returns:
+        El identificador del cliente o, si no lo hay, un hash del payload
+    """
+    if client_key:
+        return f"id:{client_key}"
+    canonical = json.dumps(
+        {key: value for key, value in data.items() if key not in IGNORED_FIELDS},
+        sort_keys=True, default=str
+    )
+    return "sha256:" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Outcome:
+    """Resultado compartido por varias señales: reparte un deferred a cada una"""
+
+    def __init__(self, signal):
+        # Señal que se ejecuta: los duplicados toman sus SHARED_FIELDS
+        self.signal = signal
+        self.result = None
+        self.done = False
+        self._waiters = []
+
+    def wait(self):
+        if self.done:
+            return defer.fail(self.result) if isinstance(self.result, Failure) else defer.succeed(self.result)
+        d = defer.Deferred()
+        self._waiters.append(d)
+        return d
+
+    def resolve(self, result):
+        self.result = result
+        self.done = True
+        waiters, self._waiters = self._waiters, []
+        for d in waiters:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        # El error se entrega a los que esperan, no se propaga
+        return None
+
+
+class SignalCoalescer:
+    """
+    Etapa entre /webhook y la ejecución que agrupa las alertas en ráfaga.
+
+    Una señal con una clave ya vista dentro de dedup_window (un reintento
+    de TradingView) no se vuelve a ejecutar: recibe el resultado de la
+    original. Si merge_window es mayor que 0, las señales del mismo símbolo
+    y sentido (y mismos SL/TP, vela y grupo) que llegan dentro de esa
+    ventana se suman en una sola orden neta, a costa de retrasar la primera
+    merge_window segundos.
+    """
+
+    def __init__(self, execute, dedup_window=60.0, merge_window=0.0, max_volume=None, clock=reactor):
+        """
+        Args:
+            execute: Función que recibe la señal (diccionario con symbol,
+                side, volume, sl_pips, tp_pips, candle_color, group y
+                timings) y devuelve un deferred con el resultado
+            dedup_window: Segundos durante los que se recuerda cada clave
+            merge_window: Segundos que se espera a fusionar señales (0 para
+                ejecutar cada señal en el momento)
+            max_volume: Volumen máximo de la orden neta
+        """
+        self.execute = execute
+        self.dedup_window = dedup_window
+        self.merge_window = merge_window
+        self.max_volume = max_volume
+        self._clock = clock
+        self._seen = OrderedDict()  # {clave: (caduca_en, _Outcome)}
+        self._batches = {}  # {campos de MERGE_FIELDS: lote abierto}
+        self.duplicates = 0
+        self.merged = 0
+
+    def submit(self, key, signal):
+        """
+        Entrega una señal para su ejecución
+
+        Si la señal se fusiona en un lote o es un duplicado, sus
+        SHARED_FIELDS pasan a ser los del lote o los de la original, para
+        que el desglose de latencias y la etiqueta sean los de la orden real.
+
+        Returns:
+            Tupla (estado, deferred): ACCEPTED, DUPLICATE o MERGED y un
+            deferred con el resultado de la orden que la ejecuta
+        """
+        now = self._clock.seconds()
+        self._expire(now)
+
+        seen = self._seen.get(key)
+        if seen is not None:
+            self.duplicates += 1
+            print(f"🔁 Señal duplicada ignorada: {signal['symbol']} {signal['side']} {signal['volume']}")
+            self._share(seen[1].signal, signal)
+            return DUPLICATE, seen[1].wait()
+
+        if self.merge_window <= 0:
+            outcome = _Outcome(signal)
+            self._seen[key] = (now + self.dedup_window, outcome)
+            d = outcome.wait()
+            defer.maybeDeferred(self.execute, signal).addBoth(outcome.resolve)
+            return ACCEPTED, d
+
+        merge_key = tuple(signal.get(field) for field in MERGE_FIELDS)
+        batch = self._batches.get(merge_key)
+        if batch is not None:
+            batch["signal"]["volume"] = self._cap(batch["signal"]["volume"] + signal["volume"])
+            batch["count"] += 1
+            self._share(batch["signal"], signal)
+            self._seen[key] = (now + self.dedup_window, batch["outcome"])
+            self.merged += 1
+            print(f"➕ Señal fusionada: {signal['symbol']} {signal['side']} (volumen neto {batch['signal']['volume']})")
+            return MERGED, batch["outcome"].wait()
+
+        batch_signal = dict(signal, volume=self._cap(signal["volume"]))
+        batch = {"signal": batch_signal, "count": 1, "outcome": _Outcome(batch_signal)}
+        self._batches[merge_key] = batch
+        self._seen[key] = (now + self.dedup_window, batch["outcome"])
+        self._clock.callLater(self.merge_window, self._flush, merge_key)
+        return ACCEPTED, batch["outcome"].wait()
+
+    def _flush(self, merge_key):
+        batch = self._batches.pop(merge_key)
+        if batch["count"] > 1:
+            print(f"📦 {batch['count']} señales fusionadas en una orden de {batch['signal']['volume']}")
+        defer.maybeDeferred(self.execute, batch["signal"]).addBoth(batch["outcome"].resolve)
+
+    def _share(self, source, signal):
+        for field in SHARED_FIELDS:
+            if field in source:
+                signal[field] = source[field]
+
+    def _cap(self, volume):
+        volume = round(volume, 2)
+        return min(volume, self.max_volume) if self.max_volume is not None else volume
+
+    def _expire(self, now):
+        # Las claves se insertan en orden de caducidad
+        while self._seen:
+            key, (expires_at, _) = next(iter(self._seen.items()))
+            if expires_at > now:
+                break
+            del self._seen[key]
+
+    def stats(self):
+        return {
+            "keys": len(self._seen),
+            "open_batches": len(self._batches),
+            "duplicates": self.duplicates,
+            "merged": self.merged,
+        }
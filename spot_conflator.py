@@ -0,0 +1,130 @@
+from twisted.internet import reactor, defer
+from price_book import SPOT_PRICE_SCALE
+
+
+class SpotConflator:
+    """
+    Conflación por símbolo de los ProtoOASpotEvent recibidos.
+
+    Los spots se acumulan en un diccionario {symbol_id: [bid, ask]} que solo
+    guarda el último bid/ask de cada símbolo (un spot que solo trae bid o
+    solo ask se fusiona con el pendiente). Cada flush_interval segundos (0:
+    en la siguiente vuelta del reactor) los consumidores reciben cada
+    símbolo pendiente una sola vez, así que su trabajo depende del número de
+    símbolos y no del de ticks aunque lleguen ráfagas.
+    """
+
+    def __init__(self, flush_interval=0.0, clock=reactor):
+        """
+        Args:
+            flush_interval: Segundos entre entregas a los consumidores
+            clock: Reactor (o task.Clock en pruebas) para programar los flush
+        """
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._pending = {}  # {symbol_id: [bid, ask]}; None si no ha cambiado
+        self._consumers = ()
+        # {symbol_id: [(ready, deferred), ...]}
+        self._waiters = {}
+        self._flush_call = None
+        self.received = 0
+        self.delivered = 0
+        self.merged = 0
+        self.flushes = 0
+
+    def add_consumer(self, consumer):
+        """
+        Añade un consumidor consumer(symbol_id, bid, ask); bid o ask son None
+        si no han cambiado desde la entrega anterior
+        """
+        self._consumers += (consumer,)
+
+    def remove_consumer(self, consumer):
+        self._consumers = tuple(c for c in self._consumers if c != consumer)
+
+    def push(self, spot):
+        """Acumula un ProtoOASpotEvent hasta el siguiente flush"""
+        bid = spot.bid / SPOT_PRICE_SCALE if spot.HasField("bid") else None
+        ask = spot.ask / SPOT_PRICE_SCALE if spot.HasField("ask") else None
+        self.received += 1
+
+        pending = self._pending.get(spot.symbolId)
+        if pending is None:
+            self._pending[spot.symbolId] = [bid, ask]
+        else:
+            # Tick sin entregar todavía: se queda solo el último precio
+            self.merged += 1
+            if bid is not None:
+                pending[0] = bid
+            if ask is not None:
+                pending[1] = ask
+
+        if self._flush_call is None:
+            self._flush_call = self._clock.callLater(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Entrega los precios pendientes a los consumidores y a las esperas"""
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        self.flushes += 1
+        self.delivered += len(pending)
+
+        for symbol_id, (bid, ask) in pending.items():
+            for consumer in self._consumers:
+                consumer(symbol_id, bid, ask)
+            # Los consumidores ya han visto el precio: despertar las esperas
+            waiters = self._waiters.get(symbol_id)
+            if waiters:
+                for ready, waiter_deferred in list(waiters):
+                    if not waiter_deferred.called and (ready is None or ready()):
+                        waiter_deferred.callback(None)
+
+    def wait_for(self, symbol_id, timeout, ready=None):
+        """
+        Espera la próxima entrega de un símbolo
+
+        Args:
+            symbol_id: ID del símbolo
+            timeout: Segundos máximos de espera
+            ready: Función opcional sin argumentos; si se indica, se sigue
+                esperando hasta una entrega en la que devuelva True
+
+        Returns:
+            Un deferred que se resolverá con None tras la entrega
+        """
+        waiter_deferred = defer.Deferred()
+        entry = (ready, waiter_deferred)
+        self._waiters.setdefault(symbol_id, []).append(entry)
+
+        def on_timeout():
+            if not waiter_deferred.called:
+                waiter_deferred.errback(defer.TimeoutError(f"Timeout esperando el precio de {symbol_id}"))
+
+        timeout_call = self._clock.callLater(timeout, on_timeout)
+
+        def cleanup(result):
+            if timeout_call.active():
+                timeout_call.cancel()
+            waiters = self._waiters.get(symbol_id)
+            if waiters and entry in waiters:
+                waiters.remove(entry)
+                if not waiters:
+                    del self._waiters[symbol_id]
+            return result
+
+        return waiter_deferred.addBoth(cleanup)
+
+    def stats(self):
+        """Spots recibidos, entregados y fusionados (descartados por llegar otro antes del flush)"""
+        return {
+            "flush_interval_ms": round(self.flush_interval * 1000.0, 3),
+            "received": self.received,
+            "delivered": self.delivered,
+            "merged": self.merged,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+        }
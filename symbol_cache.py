@@ -0,0 +1,100 @@
+import os
+import json
+import time
+
+# Campos de ProtoOASymbol que guardamos en caché
+SYMBOL_FIELDS = ("digits", "pipPosition", "lotSize", "minVolume", "maxVolume", "stepVolume")
+
+
+class SymbolCache:
+    """
+    Caché persistente de metadatos de símbolos indexada por symbolId.
+
+    Se guarda en disco en formato JSON para que los reinicios arranquen con
+    la caché caliente. Cada entrada lleva la marca de tiempo de su última
+    actualización para poder refrescarla en segundo plano según un TTL.
+    """
+
+    def __init__(self, path, ttl=6 * 3600):
+        self.path = path
+        self.ttl = ttl
+        # {symbol_id: {"digits": ..., "pipPosition": ..., ..., "updated_at": ...}}
+        self._symbols = {}
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def __contains__(self, symbol_id):
+        return symbol_id in self._symbols
+
+    def get(self, symbol_id):
+        """Devuelve los metadatos de un símbolo o None si no están en caché"""
+        return self._symbols.get(symbol_id)
+
+    def stale_ids(self, symbol_ids, now=None):
+        """
+        Devuelve los symbolIds que no están en caché o cuyo TTL ha expirado
+
+        Args:
+            symbol_ids: Iterable de symbolIds a comprobar
+            now: Marca de tiempo de referencia (por defecto, ahora)
+        """
+        now = time.time() if now is None else now
+        stale = []
+        for symbol_id in symbol_ids:
+            entry = self._symbols.get(symbol_id)
+            if entry is None or now - entry["updated_at"] >= self.ttl:
+                stale.append(symbol_id)
+        return stale
+
+    def seed(self, metadata):
+        """
+        Añade metadatos de símbolos que aún no están en caché
+
+        Las entradas añadidas se marcan como caducadas para que el siguiente
+        refresco las actualice desde el broker. Se ignoran las entradas sin
+        dígitos conocidos.
+
+        Args:
+            metadata: Diccionario {symbol_id: {"digits": ..., ...}}
+        """
+        for symbol_id, entry in metadata.items():
+            if symbol_id not in self._symbols and entry.get("digits"):
+                self._symbols[symbol_id] = dict(entry, updated_at=0)
+
+    def update_from_response(self, response):
+        """
+        Actualiza la caché con un ProtoOASymbolByIdRes
+
+        Returns:
+            Número de símbolos actualizados
+        """
+        now = time.time()
+        for symbol in response.symbol:
+            entry = {field: getattr(symbol, field) for field in SYMBOL_FIELDS}
+            entry["updated_at"] = now
+            self._symbols[symbol.symbolId] = entry
+        return len(response.symbol)
+
+    def load(self):
+        """Carga la caché desde disco. Devuelve el número de símbolos cargados"""
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+            self._symbols = {int(symbol_id): entry for symbol_id, entry in data.get("symbols", {}).items()}
+        except (OSError, ValueError) as e:
+            print(f"[cTrader] ⚠️ No se pudo cargar la caché de símbolos {self.path}: {e}")
+            self._symbols = {}
+        return len(self._symbols)
+
+    def save(self):
+        """Guarda la caché en disco de forma atómica"""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump({"saved_at": time.time(), "symbols": self._symbols}, file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[cTrader] ⚠️ No se pudo guardar la caché de símbolos {self.path}: {e}")
@@ -0,0 +1,47 @@
+from twisted.internet import defer
+
+
+class SymbolQueue:
+    """
+    Serializa las operaciones de cada símbolo.
+
+    Cada símbolo tiene su propia cola (un DeferredLock): una operación no
+    empieza hasta que termina la anterior del mismo símbolo, mientras que
+    símbolos distintos se procesan en paralelo. Las colas vacías se eliminan
+    para no acumular un lock por cada símbolo operado alguna vez.
+    """
+
+    def __init__(self):
+        self._locks = {}  # {symbol: DeferredLock}
+        self._queued = {}  # {symbol: operaciones en curso o en espera}
+
+    def depth(self, symbol):
+        """Número de operaciones en curso o en espera para un símbolo"""
+        return self._queued.get(symbol, 0)
+
+    def run(self, symbol, f, *args, **kwargs):
+        """
+        Ejecuta f(*args, **kwargs) cuando terminen las operaciones previas
+        del símbolo
+
+        Args:
+            symbol: Símbolo cuya cola se usa
+            f: Función a ejecutar; si devuelve un deferred, la cola no avanza
+                hasta que se resuelva
+
+        Returns:
+            Un deferred con el resultado (o el error) de f
+        """
+        lock = self._locks.get(symbol)
+        if lock is None:
+            lock = self._locks[symbol] = defer.DeferredLock()
+        self._queued[symbol] = self._queued.get(symbol, 0) + 1
+
+        def release(result):
+            self._queued[symbol] -= 1
+            if not self._queued[symbol]:
+                del self._queued[symbol]
+                del self._locks[symbol]
+            return result
+
+        return lock.run(f, *args, **kwargs).addBoth(release)
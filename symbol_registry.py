@@ -0,0 +1,49 @@
+class SymbolRegistry:
+    """
+    Registro de símbolos con índices nombre→id e id→nombre.
+
+    Los dos índices se construyen una sola vez al cargar los símbolos, de
+    modo que resolver el nombre de un symbolId recibido en un evento de
+    ejecución o en una reconciliación es O(1). Los metadatos de cada
+    símbolo (digits, pipPosition, lotSize...) se leen de la caché de
+    símbolos si se proporciona.
+    """
+
+    def __init__(self, symbols, metadata=None):
+        """
+        Args:
+            symbols: Diccionario {nombre: symbolId}
+            metadata: Objeto con get(symbol_id) que devuelve los metadatos del
+                símbolo (por ejemplo una SymbolCache), opcional
+        """
+        self._metadata = metadata
+        self.load(symbols)
+
+    def load(self, symbols):
+        """Reconstruye los índices a partir de un diccionario {nombre: symbolId}"""
+        self._by_name = dict(symbols)
+        self._by_id = {symbol_id: name for name, symbol_id in self._by_name.items()}
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def id_of(self, name):
+        """Devuelve el symbolId de un nombre o None si no existe"""
+        return self._by_name.get(name)
+
+    def name_of(self, symbol_id):
+        """Devuelve el nombre de un symbolId o None si no existe"""
+        return self._by_id.get(symbol_id)
+
+    def ids(self):
+        """Devuelve la lista de symbolIds registrados"""
+        return list(self._by_id)
+
+    def metadata(self, symbol_id):
+        """Devuelve los metadatos de un símbolo o None si no se conocen"""
+        if self._metadata is None:
+            return None
+        return self._metadata.get(symbol_id)
@@ -0,0 +1,134 @@
+import os
+import struct
+from twisted.internet import task
+
+# Formato del fichero binario de símbolos (little-endian):
+#   cabecera: magic (4s), versión (H), número de símbolos (I), tamaño de nombres (I)
+#   registros: symbolId (q), digits (i), pipPosition (i), lotSize (q)
+#   nombres: bloque UTF-8 con los nombres separados por NAME_SEPARATOR, en el
+#            mismo orden que los registros
+SYMBOL_TABLE_MAGIC = b"SYMT"
+SYMBOL_TABLE_VERSION = 1
+HEADER = struct.Struct("<4sHII")
+RECORD = struct.Struct("<qiiq")
+NAME_SEPARATOR = "\n"
+
+
+class SymbolTable:
+    """
+    Tabla de símbolos compacta generada por list_symbols.py.
+
+    Contiene el catálogo completo de la cuenta (ids, nombres, dígitos y
+    tamaño de lote) en un fichero binario versionado que se carga en
+    mucho menos de un milisegundo al arrancar.
+    """
+
+    def __init__(self, records):
+        """
+        Args:
+            records: Lista de tuplas (symbol_id, name, digits, pip_position, lot_size)
+        """
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def as_dict(self):
+        """Devuelve {nombre: symbolId}, el mismo formato que SYMBOLS"""
+        return {name: symbol_id for symbol_id, name, _, _, _ in self.records}
+
+    def metadata(self):
+        """Devuelve {symbolId: {"digits": ..., "pipPosition": ..., "lotSize": ...}}"""
+        return {
+            symbol_id: {"digits": digits, "pipPosition": pip_position, "lotSize": lot_size}
+            for symbol_id, _, digits, pip_position, lot_size in self.records
+        }
+
+    def save(self, path):
+        """Escribe la tabla en disco de forma atómica"""
+        records = bytearray()
+        for symbol_id, _, digits, pip_position, lot_size in self.records:
+            records += RECORD.pack(symbol_id, digits, pip_position, lot_size)
+        names = NAME_SEPARATOR.join(record[1] for record in self.records).encode("utf-8")
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(HEADER.pack(SYMBOL_TABLE_MAGIC, SYMBOL_TABLE_VERSION, len(self.records), len(names)))
+            file.write(records)
+            file.write(names)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Carga una tabla desde disco
+
+        Raises:
+            ValueError: Si el fichero no es una tabla de símbolos o su versión
+                no es compatible
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path} no es una tabla de símbolos válida")
+        magic, version, count, names_size = HEADER.unpack_from(data, 0)
+        if magic != SYMBOL_TABLE_MAGIC:
+            raise ValueError(f"{path} no es una tabla de símbolos válida")
+        if version != SYMBOL_TABLE_VERSION:
+            raise ValueError(f"Versión de tabla de símbolos no soportada: {version}")
+
+        names_start = HEADER.size + count * RECORD.size
+        if len(data) != names_start + names_size:
+            raise ValueError(f"{path} está truncado o corrupto")
+
+        names = str(memoryview(data)[names_start:], "utf-8").split(NAME_SEPARATOR) if count else []
+        records = memoryview(data)[HEADER.size:names_start]
+        return cls([
+            (symbol_id, name, digits, pip_position, lot_size)
+            for (symbol_id, digits, pip_position, lot_size), name in zip(RECORD.iter_unpack(records), names)
+        ])
+
+
+class SymbolTableWatcher:
+    """
+    Recarga la tabla de símbolos cuando cambia en disco, sin parar el reactor.
+
+    Comprueba periódicamente la fecha de modificación del fichero y llama a
+    on_reload(table) con la tabla nueva cuando cambia.
+    """
+
+    def __init__(self, path, on_reload, interval=30):
+        self.path = path
+        self.on_reload = on_reload
+        self.interval = interval
+        self._mtime = None
+        self._loop = task.LoopingCall(self.check)
+
+    def check(self):
+        """Recarga la tabla si el fichero ha cambiado. Devuelve True si se recargó"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            table = SymbolTable.load(self.path)
+        except (OSError, ValueError) as e:
+            print(f"[cTrader] ⚠️ No se pudo cargar la tabla de símbolos {self.path}: {e}")
+            return False
+
+        self._mtime = mtime
+        self.on_reload(table)
+        return True
+
+    def start(self):
+        """Carga la tabla inmediatamente y empieza a vigilar el fichero"""
+        if not self._loop.running:
+            self._loop.start(self.interval, now=True)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()